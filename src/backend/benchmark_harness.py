@@ -0,0 +1,439 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from tracing import tracer
+from local_backends import (
+    HashEmbedder, LocalPinecone, StubOllamaServer, StubOpenAI,
+    build_index, load_corpus, minilm_embedder, sample_corpus, sample_questions
+)
+
+logger = logging.getLogger(__name__)
+
+# Questions outside the workload, used to warm code paths without pre-filling caches
+WARMUP_QUERIES = ["What is the address of Borough Hall?", "What are the library hours?", "Who collects leaves in the fall?"]
+
+
+class BenchConfig:
+    """Workload and stand-in settings shared by every target."""
+
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        if args.embedder == "hash":
+            # Read when the retrieval policies are built, i.e. when the targets are imported
+            os.environ.setdefault("RETRIEVAL_MIN_SCORE", str(args.min_score))
+        self.corpus = load_corpus(args.corpus) if args.corpus else sample_corpus(args.chunks, args.seed)
+
+    def embedder(self, dim: int):
+        if self.args.embedder == "minilm":
+            model = minilm_embedder(target_dim=dim)
+            if model is not None:
+                return model
+        return HashEmbedder(dim=dim, latency=self.args.embed_ms / 1000)
+
+    def openai(self, embedder) -> StubOpenAI:
+        return StubOpenAI(embedder, self.args.llm_tps, self.args.llm_ttft_ms / 1000, self.args.answer_tokens)
+
+    def ollama(self) -> StubOllamaServer:
+        return StubOllamaServer(self.args.llm_tps, self.args.llm_ttft_ms / 1000, self.args.answer_tokens, self.args.llm_parallel)
+
+
+def build_workload(size: int, seed: int = 0, skew: float = 1.1, queries: Optional[List[str]] = None) -> List[str]:
+    """`size` questions drawn with Zipf-like popularity, so caches see realistic repeats."""
+    queries = queries or [q["query"] for q in sample_questions()]
+    rng = random.Random(seed)
+    weights = [1 / (rank + 1) ** skew for rank in range(len(queries))]
+    return rng.choices(queries, weights=weights, k=size)
+
+
+def summarize(values: List[float]) -> Dict[str, float]:
+    """p50/p95/p99/mean/max in milliseconds (nearest rank)."""
+    if not values:
+        return {"count": 0}
+    ordered = sorted(values)
+
+    def rank(p):
+        return ordered[min(len(ordered) - 1, max(0, int(round(p / 100 * len(ordered))) - 1))]
+
+    return {
+        "count": len(ordered),
+        "p50": round(rank(50) * 1000, 3),
+        "p95": round(rank(95) * 1000, 3),
+        "p99": round(rank(99) * 1000, 3),
+        "mean": round(sum(ordered) / len(ordered) * 1000, 3),
+        "max": round(ordered[-1] * 1000, 3),
+    }
+
+
+def stage_summary(traces) -> Dict[str, Dict[str, float]]:
+    """Per-stage latency percentiles from the traces recorded during a run."""
+    durations = {}
+    for trace in traces:
+        for stage, _, duration in trace.spans:
+            durations.setdefault(stage, []).append(duration)
+    return {stage: summarize(values) for stage, values in sorted(durations.items())}
+
+
+def rss_mb() -> Optional[float]:
+    """Current resident set size of this process."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    try:
+        import resource
+        return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    except ImportError:
+        return None
+
+
+class Run:
+    """Latencies, errors and traces collected while replaying a workload."""
+
+    def __init__(self):
+        self.latencies = []
+        self.errors = 0
+        self.traces = []
+        self.elapsed = 0.0
+
+    def collect_traces(self):
+        self.traces.extend(tracer.drain())
+
+    def report(self, trace_memory: bool) -> Dict[str, Any]:
+        self.collect_traces()
+        result = {
+            "requests": len(self.latencies) + self.errors,
+            "errors": self.errors,
+            "throughput_rps": round(len(self.latencies) / self.elapsed, 2) if self.elapsed else 0.0,
+            "latency_ms": summarize(self.latencies),
+            "stages_ms": stage_summary(self.traces),
+            "memory": {"rss_mb": rss_mb()},
+        }
+        if trace_memory:
+            result["memory"]["python_peak_mb"] = round(tracemalloc.get_traced_memory()[1] / 2 ** 20, 1)
+        return result
+
+
+def replay_threads(call: Callable[[str], Any], workload: List[str], concurrency: int) -> Run:
+    """Closed-loop replay: `concurrency` threads each issue their next query as soon as one finishes."""
+    run = Run()
+
+    def timed(query):
+        start = time.perf_counter()
+        try:
+            call(query)
+            run.latencies.append(time.perf_counter() - start)
+        except Exception as e:
+            logger.warning(f"Query failed: {e}")
+            run.errors += 1
+        run.collect_traces()
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(timed, workload))
+    run.elapsed = time.perf_counter() - start
+    return run
+
+
+async def replay_asgi(app, path: str, workload: List[str], concurrency: int, body: Callable[[str], Dict]) -> Run:
+    """Closed-loop replay of POST `path` against an ASGI app, in process (no sockets)."""
+    import httpx
+
+    run = Run()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench", timeout=None) as client:
+        async def timed(query):
+            async with semaphore:
+                start = time.perf_counter()
+                try:
+                    response = await client.post(path, json=body(query))
+                    response.raise_for_status()
+                    run.latencies.append(time.perf_counter() - start)
+                except Exception as e:
+                    logger.warning(f"Request failed: {e}")
+                    run.errors += 1
+                run.collect_traces()
+
+        start = time.perf_counter()
+        await asyncio.gather(*(timed(query) for query in workload))
+        run.elapsed = time.perf_counter() - start
+    return run
+
+
+def _query_handler(config: BenchConfig):
+    """PineconeQueryHandler wired to a local index and the stub OpenAI client."""
+    from pinecone_query import PineconeQueryHandler
+
+    embedder = config.embedder(1536)
+    index = build_index(config.corpus, embedder, config.args.index_ms / 1000)
+    return PineconeQueryHandler("bench", pc_client=LocalPinecone({"bench": index}), openai_client=config.openai(embedder))
+
+
+def _handler_stats(handler) -> Dict[str, Any]:
+    stats = handler.stats()
+    return {
+        "embedding": stats["embedding_cache"],
+        "reranker": stats["reranker"],
+        "coalescing": handler.inflight.stats(),
+        "planner_wins": stats["planner_wins"],
+    }
+
+
+def bench_handler(config: BenchConfig, workload: List[str]) -> Dict[str, Any]:
+    """PineconeQueryHandler.query called directly, one trace per query."""
+    handler = _query_handler(config)
+
+    def call(query):
+        trace, token = tracer.start_trace("handler.query")
+        try:
+            return handler.query(query)
+        finally:
+            tracer.finish_trace(trace, token)
+
+    for query in WARMUP_QUERIES:
+        call(query)
+    tracer.drain()
+    run = replay_threads(call, workload, config.args.concurrency)
+    return {**run.report(config.args.trace_memory), "caches": _handler_stats(handler)}
+
+
+@contextmanager
+def stub_hybrid_api(config: BenchConfig):
+    """hybrid_ai_api with the handler as its Pinecone backend; yields (app, cache stats callable)."""
+    import hybrid_ai_api as api
+
+    handler = _query_handler(config)
+    api.query_handler, api.pinecone_available, api.use_simulation = handler, True, False
+    yield api.app, lambda: _handler_stats(handler)
+
+
+@contextmanager
+def stub_pinecone_api(config: BenchConfig):
+    """pinecone_api on a local index with padded 1024-d embeddings and a stub Ollama server."""
+    import pinecone_api as api
+    if not hasattr(api, "process_query"):
+        raise ImportError("pinecone_new_private_gpt could not be imported")
+    import ollama_client
+    import pinecone_new_private_gpt as gpt
+
+    embedder = config.embedder(1024)
+    gpt._embedding_model = embedder
+    gpt._pinecone_index = build_index(config.corpus, embedder, config.args.index_ms / 1000)
+
+    with config.ollama() as server:
+        # Route PooledOllama through the stub; the pool size mirrors OLLAMA_MAX_CONCURRENCY
+        ollama_client._client = ollama_client.OllamaClient(base_url=server.url, max_concurrency=config.args.llm_parallel)
+        gpt.create_qa_chain(mute_stream=True)
+        # Lifespan is skipped for stubbed apps, so open the /log-chat writers here
+        api.open_chat_logs()
+        try:
+            yield api.app, lambda: {
+                "generation": gpt.generation_cache.stats(),
+                "reranker": gpt.reranker.stats() if gpt.reranker else None,
+                "coalescing": gpt.query_inflight.stats(),
+                "ollama": ollama_client._client.stats(),
+            }
+        finally:
+            api.close_chat_logs()
+
+
+# API modules that can be served entirely from the local stand-ins
+STUB_APPS = {
+    "hybrid_ai_api": stub_hybrid_api,
+    "pinecone_api": stub_pinecone_api,
+}
+
+
+def _bench_app(stub, config: BenchConfig, workload: List[str], body: Callable[[str], Dict[str, Any]]) -> Dict[str, Any]:
+    with stub(config) as (app, caches):
+        async def replay():
+            for query in WARMUP_QUERIES:
+                await replay_asgi(app, "/query", [query], 1, lambda q: {"query": q})
+            tracer.drain()
+            return await replay_asgi(app, "/query", workload, config.args.concurrency, body)
+
+        run = asyncio.run(replay())
+        return {**run.report(config.args.trace_memory), "caches": caches()}
+
+
+def bench_hybrid_api(config: BenchConfig, workload: List[str]) -> Dict[str, Any]:
+    """POST /query on hybrid_ai_api with the handler as its Pinecone backend."""
+    return _bench_app(stub_hybrid_api, config, workload, lambda q: {"query": q, "context": "general"})
+
+
+def bench_pinecone_api(config: BenchConfig, workload: List[str]) -> Dict[str, Any]:
+    """POST /query on pinecone_api: LangChain QA chain, padded 1024-d embeddings, stub Ollama server."""
+    return _bench_app(stub_pinecone_api, config, workload, lambda q: {"query": q})
+
+
+TARGETS = {
+    "handler": bench_handler,
+    "hybrid_ai_api": bench_hybrid_api,
+    "pinecone_api": bench_pinecone_api,
+}
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], threshold: float = 0.1, min_delta_ms: float = 1.0) -> List[str]:
+    """
+    Regressions of `current` against `baseline`: throughput down, or p95
+    latency (end to end or any stage) up, by more than `threshold`, or a
+    target that ran in the baseline failing now. Latency changes smaller
+    than `min_delta_ms` are treated as noise.
+    """
+    regressions = []
+    for name, result in current["targets"].items():
+        before = baseline.get("targets", {}).get(name)
+        if before and "error" not in before and "error" in result and not result.get("skipped"):
+            regressions.append(f"{name}: failed ({result['error']})")
+            continue
+        if not before or "error" in result or "error" in before:
+            continue
+        if result["throughput_rps"] < before["throughput_rps"] * (1 - threshold):
+            regressions.append(f"{name}: throughput {before['throughput_rps']} -> {result['throughput_rps']} req/s")
+        pairs = [("end to end", before["latency_ms"], result["latency_ms"])]
+        pairs += [(stage, before["stages_ms"].get(stage), stats) for stage, stats in result["stages_ms"].items()]
+        for label, old, new in pairs:
+            if not old or not new or "p95" not in old or "p95" not in new:
+                continue
+            if new["p95"] > old["p95"] * (1 + threshold) and new["p95"] - old["p95"] >= min_delta_ms:
+                regressions.append(f"{name}: {label} p95 {old['p95']} -> {new['p95']} ms")
+    return regressions
+
+
+def print_report(results: Dict[str, Any]):
+    for name, result in results["targets"].items():
+        if "error" in result:
+            print(f"{name}: {'skipped' if result.get('skipped') else 'FAILED'} ({result['error']})")
+            continue
+        latency = result["latency_ms"]
+        print(f"{name}: {result['throughput_rps']} req/s, p50 {latency['p50']} ms, p95 {latency['p95']} ms, "
+              f"p99 {latency['p99']} ms, {result['errors']} errors, rss {result['memory']['rss_mb']} MB")
+        for stage, stats in result["stages_ms"].items():
+            print(f"  {stage:20s} n={stats['count']:<6d} p50 {stats['p50']:9.3f}  p95 {stats['p95']:9.3f}  p99 {stats['p99']:9.3f} ms")
+        for cache, stats in result["caches"].items():
+            if isinstance(stats, dict) and "hit_rate" in stats:
+                print(f"  {cache} cache hit rate {stats['hit_rate']}")
+            elif isinstance(stats, dict) and "coalesced" in stats:
+                print(f"  {cache}: {stats['coalesced']} of {stats['requests']} requests coalesced")
+
+
+def add_stub_arguments(parser: argparse.ArgumentParser):
+    """Options for the local stand-ins (corpus, embedder, index and LLM timings); read by BenchConfig."""
+    parser.add_argument("--corpus", help="Directory of .pdf/.txt/.md documents to index, split like ingest (default: the synthetic sample corpus)")
+    parser.add_argument("--chunks", type=int, default=2000, help="Sample corpus size")
+    parser.add_argument("--embedder", choices=["hash", "minilm"], default="hash", help="Hashing stand-in or the real MiniLM model")
+    parser.add_argument("--embed-ms", type=float, default=5.0, help="Simulated embedding time per call (hash embedder)")
+    parser.add_argument("--min-score", type=float, default=0.2,
+                        help="RETRIEVAL_MIN_SCORE for the hash embedder, whose scores are lower than the calibrated models'")
+    parser.add_argument("--index-ms", type=float, default=20.0, help="Simulated vector query round trip")
+    parser.add_argument("--llm-tps", type=float, default=40.0, help="Stub LLM tokens per second")
+    parser.add_argument("--llm-ttft-ms", type=float, default=300.0, help="Stub LLM time to first token")
+    parser.add_argument("--llm-parallel", type=int, default=2, help="Concurrent generations the stub Ollama server allows")
+    parser.add_argument("--answer-tokens", type=int, default=40)
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Replay a query workload through the backend against local stand-ins (no network).")
+    parser.add_argument("--targets", default="handler,hybrid_ai_api,pinecone_api", help="Comma-separated: " + ", ".join(TARGETS))
+    parser.add_argument("--queries", type=int, default=200, help="Workload size")
+    parser.add_argument("--workload", help="File with one question per line (default: the sample questions)")
+    parser.add_argument("--skew", type=float, default=1.1, help="Zipf exponent of question popularity (0 = uniform)")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=0)
+    add_stub_arguments(parser)
+    parser.add_argument("--trace-memory", action="store_true", help="Report peak Python allocations (tracemalloc; slows the run)")
+    parser.add_argument("--output", help="Write results as JSON")
+    parser.add_argument("--compare", help="Baseline JSON from an earlier run; regressions are printed")
+    parser.add_argument("--threshold", type=float, default=0.1, help="Relative change counted as a regression")
+    parser.add_argument("--fail-on-regression", action="store_true", help="Exit with status 1 if --compare finds regressions")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    # The pipeline logs every query; keep the report readable
+    logging.basicConfig(level=logging.ERROR)
+    logger.setLevel(logging.WARNING)
+    queries = None
+    if args.workload:
+        with open(args.workload) as f:
+            queries = [line.strip() for line in f if line.strip()]
+    workload = build_workload(args.queries, args.seed, args.skew, queries)
+    config = BenchConfig(args)
+    if args.trace_memory:
+        tracemalloc.start()
+
+    results = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+        },
+        "config": vars(args),
+        "targets": {},
+    }
+    for name in [t.strip() for t in args.targets.split(",") if t.strip()]:
+        if name not in TARGETS:
+            raise SystemExit(f"Unknown target {name!r}; choose from {', '.join(TARGETS)}")
+        if args.trace_memory:
+            tracemalloc.reset_peak()
+        try:
+            results["targets"][name] = TARGETS[name](config, workload)
+        except ImportError as e:
+            logger.warning(f"Skipping {name}: {e}")
+            results["targets"][name] = {"error": f"import failed: {e}", "skipped": True}
+        except Exception as e:
+            # One broken target (e.g. pinecone_api without a static/ directory) shouldn't lose the others
+            logger.error(f"Target {name} failed: {e}", exc_info=True)
+            results["targets"][name] = {"error": f"{type(e).__name__}: {e}"}
+        # The API modules configure chatty loggers on import
+        logging.getLogger().setLevel(logging.ERROR)
+
+    print_report(results)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.output}")
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if not regressions:
+            print(f"No regressions against {args.compare}")
+        if regressions and args.fail_on_regression:
+            return 1
+    return 0
+
+
+# Example usage:
+#   python benchmark_harness.py --queries 500 --concurrency 16 --output bench.json
+#   python benchmark_harness.py --output new.json --compare bench.json --fail-on-regression
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,365 @@
+import glob
+import json
+import logging
+import math
+import os
+import threading
+import time
+from collections import Counter, OrderedDict
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+try:
+    import pyarrow as pa
+    import pyarrow.feather as feather
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+logger = logging.getLogger(__name__)
+
+# Columns stored for every interaction event
+EVENT_COLUMNS = ["ts", "type", "message", "user_id", "context", "latency_ms"]
+
+# 10000-01-01T00:00:00Z; later timestamps can't be turned into a day partition
+MAX_TIMESTAMP = 253402300800.0
+
+
+def _parse_timestamp(value: Any) -> float:
+    """
+    Accept epoch seconds/milliseconds or an ISO-8601 string; anything else,
+    or a time outside 1970..9999, defaults to now.
+    """
+    ts = None
+    if isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value):
+        ts = value / 1000.0 if value > 1e12 else float(value)
+    elif isinstance(value, str) and value:
+        try:
+            ts = datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+        except (ValueError, OverflowError, OSError):
+            pass
+    if ts is None or not 0 <= ts < MAX_TIMESTAMP:
+        return time.time()
+    return ts
+
+
+def _parse_latency(value: Any) -> float:
+    """Milliseconds as a float; anything unparsable becomes NaN and is left out of percentiles."""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return float("nan")
+
+
+def _day(ts: float) -> str:
+    return datetime.fromtimestamp(ts, tz=timezone.utc).strftime("%Y-%m-%d")
+
+
+class ChatAnalyticsSink:
+    """
+    Buffers chat interaction events in memory and flushes them in batches to
+    day-partitioned columnar files (Parquet by default, Arrow IPC with
+    fmt="arrow") under `root_dir/day=YYYY-MM-DD/`.
+
+    Part files are immutable once written, so per-file aggregates are cached
+    (the most recent `cache_files` of them) and queries only read the
+    partitions and columns they need. Every `compact_interval` seconds,
+    closed days are merged into a single part file, as is any partition
+    with more than `compact_threshold` parts. Falls back to JSONL part files
+    when pyarrow is not installed.
+    """
+
+    def __init__(self, root_dir: str = "analytics", fmt: str = "parquet", batch_size: int = 5000, flush_interval: float = 5.0,
+                 cache_files: int = 256, compact_interval: float = 300.0, compact_threshold: int = 64):
+        if fmt not in ("parquet", "arrow"):
+            raise ValueError(f"Unsupported analytics format: {fmt}")
+        if pa is None:
+            logger.warning("pyarrow is not installed; chat analytics will be stored as JSONL. Install with: pip install pyarrow")
+            fmt = "jsonl"
+
+        self.root_dir = root_dir
+        self.fmt = fmt
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.cache_files = cache_files
+        self.compact_interval = compact_interval
+        self.compact_threshold = compact_threshold
+
+        self._lock = threading.Lock()
+        self._buffer = self._empty_buffer()
+        self._sequence = 0
+        # Part file path -> aggregate, least recently used first
+        self._file_cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+        # Held while part files are listed and read, or swapped by compaction
+        self._files_lock = threading.RLock()
+        self._last_compaction = time.monotonic()
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self.events_written = 0
+
+        os.makedirs(root_dir, exist_ok=True)
+        self._thread = threading.Thread(target=self._run, name="chat-analytics-flush", daemon=True)
+        self._thread.start()
+
+    @staticmethod
+    def _empty_buffer() -> Dict[str, list]:
+        return {column: [] for column in EVENT_COLUMNS}
+
+    def record(self, event: Dict[str, Any]):
+        """Append one interaction event to the in-memory column buffer."""
+        latency = _parse_latency(event.get("latency_ms"))
+        if math.isnan(latency) and event.get("processing_time") is not None:
+            latency = _parse_latency(event["processing_time"]) * 1000.0
+        with self._lock:
+            buffer = self._buffer
+            buffer["ts"].append(_parse_timestamp(event.get("timestamp")))
+            buffer["type"].append(str(event.get("type", "")))
+            buffer["message"].append(str(event.get("message", "")))
+            buffer["user_id"].append(str(event.get("user_id", "anonymous")))
+            buffer["context"].append(str(event.get("context", "general")))
+            buffer["latency_ms"].append(latency)
+            pending = len(buffer["ts"])
+        if pending >= self.batch_size:
+            self._wake.set()
+
+    def flush(self):
+        """Write buffered events to their day partitions."""
+        with self._lock:
+            batch, self._buffer = self._buffer, self._empty_buffer()
+        if not batch["ts"]:
+            return
+
+        try:
+            days = [_day(ts) for ts in batch["ts"]]
+        except (ValueError, OverflowError, OSError) as e:
+            logger.error(f"Dropping {len(batch['ts'])} chat analytics events with an unusable timestamp: {e}")
+            return
+        for day in sorted(set(days)):
+            rows = [i for i, d in enumerate(days) if d == day]
+            columns = {column: [batch[column][i] for i in rows] for column in EVENT_COLUMNS}
+            try:
+                self._write_part(day, columns)
+                self.events_written += len(rows)
+            except Exception as e:
+                logger.error(f"Error writing chat analytics partition {day}: {e}")
+
+    def close(self):
+        self._stopped.set()
+        self._wake.set()
+        self._thread.join(timeout=10)
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            # One bad batch must not end the thread; later events would pile up unwritten
+            try:
+                self.flush()
+                if time.monotonic() - self._last_compaction >= self.compact_interval:
+                    self._last_compaction = time.monotonic()
+                    self.compact()
+            except Exception as e:
+                logger.error(f"Error flushing chat analytics: {e}", exc_info=True)
+        try:
+            self.flush()
+        except Exception as e:
+            logger.error(f"Error flushing chat analytics on close: {e}", exc_info=True)
+
+    def compact(self):
+        """Merge the part files of closed days, and of partitions over compact_threshold parts."""
+        today = _day(time.time())
+        for partition in self._partitions(None, None):
+            parts = sorted(path for path in glob.glob(os.path.join(partition, "part-*")) if not path.endswith(".tmp"))
+            day = os.path.basename(partition)[4:]
+            if len(parts) > 1 and (day < today or len(parts) > self.compact_threshold):
+                try:
+                    self._compact_partition(day, parts)
+                except Exception as e:
+                    logger.error(f"Error compacting chat analytics partition {day}: {e}")
+
+    def _compact_partition(self, day: str, parts: List[str]):
+        columns = {column: [] for column in EVENT_COLUMNS}
+        for path in parts:
+            for column, values in self._read_part(path, EVENT_COLUMNS).items():
+                columns[column].extend(values)
+        # Swap under the files lock so a summary never counts both the parts and the merged file
+        with self._files_lock:
+            self._write_part(day, columns)
+            for path in parts:
+                os.remove(path)
+        with self._cache_lock:
+            for path in parts:
+                self._file_cache.pop(path, None)
+        logger.info(f"Compacted {len(parts)} chat analytics parts for {day}")
+
+    def _write_part(self, day: str, columns: Dict[str, list]):
+        partition = os.path.join(self.root_dir, f"day={day}")
+        os.makedirs(partition, exist_ok=True)
+        self._sequence += 1
+        name = f"part-{time.time_ns()}-{self._sequence}"
+        # Write to a temp name and rename so readers never see partial files
+        if self.fmt == "jsonl":
+            path = os.path.join(partition, f"{name}.jsonl")
+            with open(path + ".tmp", "w") as file:
+                for i in range(len(columns["ts"])):
+                    file.write(json.dumps({column: columns[column][i] for column in EVENT_COLUMNS}) + "\n")
+        else:
+            table = pa.table({
+                "ts": pa.array(columns["ts"], type=pa.float64()),
+                "type": pa.array(columns["type"], type=pa.string()),
+                "message": pa.array(columns["message"], type=pa.string()),
+                "user_id": pa.array(columns["user_id"], type=pa.string()),
+                "context": pa.array(columns["context"], type=pa.string()),
+                "latency_ms": pa.array(columns["latency_ms"], type=pa.float64()),
+            })
+            extension = "parquet" if self.fmt == "parquet" else "arrow"
+            path = os.path.join(partition, f"{name}.{extension}")
+            if self.fmt == "parquet":
+                pq.write_table(table, path + ".tmp")
+            else:
+                feather.write_feather(table, path + ".tmp")
+        os.replace(path + ".tmp", path)
+
+    # ---- Query API ----
+
+    def _partitions(self, start_day: Optional[str], end_day: Optional[str]) -> List[str]:
+        """Day partitions in range, chosen from directory names alone."""
+        selected = []
+        for partition in sorted(glob.glob(os.path.join(self.root_dir, "day=*"))):
+            day = os.path.basename(partition)[4:]
+            if (start_day and day < start_day) or (end_day and day > end_day):
+                continue
+            selected.append(partition)
+        return selected
+
+    def _read_part(self, path: str, columns: List[str]) -> Dict[str, list]:
+        """Selected columns of one part file as lists."""
+        if path.endswith(".jsonl"):
+            values = {column: [] for column in columns}
+            with open(path) as file:
+                for line in file:
+                    row = json.loads(line)
+                    for column in columns:
+                        values[column].append(row[column])
+            return values
+        # Only the requested columns are read
+        if path.endswith(".parquet"):
+            table = pq.read_table(path, columns=columns)
+        else:
+            table = feather.read_table(path, columns=columns, memory_map=True)
+        return {
+            column: table.column(column).to_numpy(zero_copy_only=False) if column == "latency_ms" else table.column(column).to_pylist()
+            for column in columns
+        }
+
+    def _file_aggregate(self, path: str) -> Dict[str, Any]:
+        """Counts, query frequencies and latencies of one immutable part file (cached)."""
+        with self._cache_lock:
+            cached = self._file_cache.get(path)
+            if cached is not None:
+                self._file_cache.move_to_end(path)
+                return cached
+
+        values = self._read_part(path, ["type", "message", "latency_ms"])
+        aggregate = self._aggregate(values["type"], values["message"], values["latency_ms"])
+        with self._cache_lock:
+            self._file_cache[path] = aggregate
+            while len(self._file_cache) > self.cache_files:
+                self._file_cache.popitem(last=False)
+        return aggregate
+
+    @staticmethod
+    def _aggregate(types: List[str], messages: List[str], latencies) -> Dict[str, Any]:
+        latencies = np.asarray(latencies, dtype=np.float64)
+        return {
+            "events": len(types),
+            "types": Counter(types),
+            "queries": Counter(
+                " ".join(message.lower().split())
+                for event_type, message in zip(types, messages)
+                if event_type in ("user", "query") and message
+            ),
+            "latencies": latencies[~np.isnan(latencies)],
+        }
+
+    def summary(self, start_day: Optional[str] = None, end_day: Optional[str] = None, top_n: int = 10) -> Dict[str, Any]:
+        """Event counts, top queries and latency percentiles for a day range."""
+        aggregates = []
+        partitions = self._partitions(start_day, end_day)
+        with self._files_lock:
+            for partition in partitions:
+                for path in glob.glob(os.path.join(partition, "part-*")):
+                    if not path.endswith(".tmp"):
+                        aggregates.append(self._file_aggregate(path))
+
+        # Include events that haven't been flushed yet
+        with self._lock:
+            pending = {column: list(values) for column, values in self._buffer.items()}
+        if pending["ts"]:
+            keep = [
+                i for i, ts in enumerate(pending["ts"])
+                if (not start_day or _day(ts) >= start_day) and (not end_day or _day(ts) <= end_day)
+            ]
+            aggregates.append(self._aggregate(
+                [pending["type"][i] for i in keep],
+                [pending["message"][i] for i in keep],
+                [pending["latency_ms"][i] for i in keep]
+            ))
+
+        types = Counter()
+        queries = Counter()
+        for aggregate in aggregates:
+            types.update(aggregate["types"])
+            queries.update(aggregate["queries"])
+        latencies = np.concatenate([a["latencies"] for a in aggregates]) if aggregates else np.array([])
+
+        percentiles = {}
+        if latencies.size:
+            p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+            percentiles = {"p50": round(float(p50), 2), "p95": round(float(p95), 2), "p99": round(float(p99), 2)}
+
+        return {
+            "start_day": start_day,
+            "end_day": end_day,
+            "partitions": len(partitions),
+            "total_events": sum(a["events"] for a in aggregates),
+            "events_by_type": dict(types),
+            "top_queries": [{"query": q, "count": c} for q, c in queries.most_common(top_n)],
+            "latency_ms": percentiles,
+        }
+
+
+# Example usage: ingestion throughput and query time on synthetic events
+if __name__ == "__main__":
+    import random
+    import shutil
+    import tempfile
+
+    root = tempfile.mkdtemp()
+    sink = ChatAnalyticsSink(root_dir=root)
+    questions = ["Who is the mayor?", "When is trash pickup?", "How do I pay my water bill?", "Borough Hall hours"]
+
+    count = 100000
+    start = time.perf_counter()
+    now = time.time()
+    for i in range(count):
+        sink.record({
+            "timestamp": now - random.randint(0, 3) * 86400,
+            "type": "user",
+            "message": random.choice(questions),
+            "latency_ms": random.lognormvariate(6, 0.5)
+        })
+    elapsed = time.perf_counter() - start
+    sink.close()
+    print(f"Ingested {count} events in {elapsed:.2f}s ({count / elapsed:,.0f} events/s), format={sink.fmt}")
+
+    start = time.perf_counter()
+    result = sink.summary()
+    print(f"Summary (cold) in {(time.perf_counter() - start) * 1000:.1f} ms: {result['total_events']} events, latency {result['latency_ms']}")
+    start = time.perf_counter()
+    sink.summary(start_day=_day(now))
+    print(f"Summary (cached, one day) in {(time.perf_counter() - start) * 1000:.1f} ms")
+    shutil.rmtree(root)
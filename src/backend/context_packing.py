@@ -0,0 +1,208 @@
+import logging
+import os
+import re
+import threading
+from functools import lru_cache
+from typing import Any, Callable, List, Optional
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+logger = logging.getLogger(__name__)
+
+# Default prompt budget for retrieved context, in tokens of the target model
+CONTEXT_TOKEN_BUDGET = int(os.environ.get("CONTEXT_TOKEN_BUDGET", 1500))
+
+# Chunks whose word 3-gram Jaccard similarity is at least this are treated as duplicates
+DEDUPE_THRESHOLD = float(os.environ.get("CONTEXT_DEDUPE_THRESHOLD", 0.8))
+
+# Don't bother adding a truncated chunk with less room than this
+MIN_CHUNK_TOKENS = 48
+
+_WORD = re.compile(r"\w+")
+
+
+class TokenCounter:
+    """
+    Counts and truncates text in tokens of a target model.
+
+    The tiktoken encoding is loaded on first use, not at construction: the
+    first load downloads BPE files unless they are in TIKTOKEN_CACHE_DIR, and
+    an offline host falls back to the length estimate instead of failing.
+    """
+
+    def __init__(self, model: str):
+        self.model = model
+        self._encoding = None
+        self._loaded = tiktoken is None
+        self._lock = threading.Lock()
+
+    @property
+    def encoding(self):
+        if not self._loaded:
+            with self._lock:
+                if not self._loaded:
+                    self._encoding = self._load_encoding()
+                    self._loaded = True
+        return self._encoding
+
+    def _load_encoding(self):
+        try:
+            try:
+                return tiktoken.encoding_for_model(self.model)
+            except KeyError:
+                # Non-OpenAI models (e.g. Ollama mistral): cl100k is a close enough proxy
+                return tiktoken.get_encoding("cl100k_base")
+        except Exception as e:
+            logger.warning(f"Could not load a tiktoken encoding for {self.model} ({e}); estimating token counts from text length. "
+                           "Set TIKTOKEN_CACHE_DIR to a directory with cached encodings on offline hosts")
+            return None
+
+    def count(self, text: str) -> int:
+        if self.encoding is not None:
+            return len(self.encoding.encode(text, disallowed_special=()))
+        # Roughly four characters per token for English prose
+        return (len(text) + 3) // 4
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        if max_tokens <= 0:
+            return ""
+        if self.encoding is not None:
+            tokens = self.encoding.encode(text, disallowed_special=())
+            return text if len(tokens) <= max_tokens else self.encoding.decode(tokens[:max_tokens])
+        return text[:max_tokens * 4]
+
+
+@lru_cache(maxsize=8)
+def get_token_counter(model: str) -> TokenCounter:
+    if tiktoken is None:
+        logger.warning("tiktoken is not installed; estimating token counts from text length. Install with: pip install tiktoken")
+    return TokenCounter(model)
+
+
+def _shingles(text: str) -> frozenset:
+    words = _WORD.findall(text.lower())
+    if len(words) < 3:
+        return frozenset(words)
+    return frozenset(zip(words, words[1:], words[2:]))
+
+
+def _similarity(a: frozenset, b: frozenset) -> float:
+    if not a or not b:
+        return 1.0 if a == b else 0.0
+    return len(a & b) / len(a | b)
+
+
+class ContextPacker:
+    """
+    Selects retrieved chunks for an LLM prompt.
+
+    Chunks are taken in order of relevance score, near-duplicates of an
+    already selected chunk are dropped, and selection stops once the token
+    budget is reached (the last chunk may be truncated to fit). Selected
+    chunks keep their original relative order.
+    """
+
+    def __init__(self, model: str, token_budget: int = CONTEXT_TOKEN_BUDGET, dedupe_threshold: float = DEDUPE_THRESHOLD):
+        self.counter = get_token_counter(model)
+        self.token_budget = token_budget
+        self.dedupe_threshold = dedupe_threshold
+
+    def pack(
+        self,
+        chunks: List[Any],
+        text_of: Callable[[Any], str],
+        score_of: Optional[Callable[[Any], float]] = None,
+        with_text: Optional[Callable[[Any, str], Any]] = None
+    ) -> List[Any]:
+        """
+        Return the chunks to put in the prompt.
+
+        text_of/score_of read a chunk's text and relevance score (without a
+        score, the input order is taken as the ranking); with_text builds a
+        truncated copy of a chunk, and truncation is skipped when it is None.
+        """
+        if not chunks:
+            return []
+
+        order = list(range(len(chunks)))
+        if score_of is not None:
+            order.sort(key=lambda i: (-(score_of(chunks[i]) or 0.0), i))
+
+        selected = {}
+        kept_shingles = []
+        remaining = self.token_budget
+        for i in order:
+            text = text_of(chunks[i])
+            shingles = _shingles(text)
+            if any(_similarity(shingles, kept) >= self.dedupe_threshold for kept in kept_shingles):
+                continue
+
+            tokens = self.counter.count(text)
+            if tokens <= remaining:
+                selected[i] = chunks[i]
+                remaining -= tokens
+            elif with_text is not None and remaining >= MIN_CHUNK_TOKENS:
+                selected[i] = with_text(chunks[i], self.counter.truncate(text, remaining))
+                remaining = 0
+            else:
+                continue
+            kept_shingles.append(shingles)
+            if remaining <= 0:
+                break
+
+        return [selected[i] for i in sorted(selected)]
+
+
+# Example usage: prompt size before and after packing on a fixed eval set
+if __name__ == "__main__":
+    import time
+
+    filler = "The Borough of Phoenixville maintains records of council actions, ordinances and resolutions. " * 12
+    eval_set = [
+        {
+            "question": "What are the Borough Hall office hours?",
+            "answer": "8:00 AM to 4:30 PM",
+            "chunks": [
+                ("Borough Hall is open Monday through Friday from 8:00 AM to 4:30 PM, except on holidays. " + filler, 0.82),
+                ("Borough Hall is open Monday through Friday from 8:00 AM to 4:30 PM, except on holidays. " + filler, 0.81),
+                ("Borough Hall, 351 Bridge Street, Phoenixville, PA 19460. Call (610) 933-8801. " + filler, 0.74),
+            ] + [(f"Council meeting minutes, section {n}. " + filler, 0.5 - n * 0.02) for n in range(7)],
+        },
+        {
+            "question": "Who is the mayor of Phoenixville?",
+            "answer": "Peter Urscheler",
+            "chunks": [
+                ("The current Mayor of Phoenixville is Peter Urscheler, serving since January 2, 2018. " + filler, 0.88),
+                ("Mayor Peter Urscheler oversees a 31-person police force serving 17,500 residents. " + filler, 0.79),
+            ] + [(f"Zoning hearing board agenda item {n}. " + filler, 0.45 - n * 0.01) for n in range(8)],
+        },
+        {
+            "question": "When is trash collected?",
+            "answer": "once a week",
+            "chunks": [
+                ("Trash collection occurs once a week on your designated day. Recycling is every other week. " + filler, 0.77),
+            ] + [(f"Public works department bulletin {n}. " + filler, 0.55 - n * 0.03) for n in range(9)],
+        },
+    ]
+
+    for model in ("gpt-4", "mistral"):
+        packer = ContextPacker(model)
+        counter = packer.counter
+        before_total = after_total = retained = 0
+        elapsed = 0.0
+        for case in eval_set:
+            chunks = [{"content": text, "score": score} for text, score in case["chunks"]]
+            before_total += sum(counter.count(c["content"]) for c in chunks)
+            start = time.perf_counter()
+            packed = packer.pack(chunks, lambda c: c["content"], lambda c: c["score"], lambda c, t: dict(c, content=t))
+            elapsed += time.perf_counter() - start
+            after_total += sum(counter.count(c["content"]) for c in packed)
+            retained += any(case["answer"] in c["content"] for c in packed)
+        print(
+            f"{model}: context tokens {before_total} -> {after_total} "
+            f"({100 * (1 - after_total / before_total):.0f}% smaller), "
+            f"answer retained {retained}/{len(eval_set)}, packing {elapsed / len(eval_set) * 1000:.2f} ms/query"
+        )
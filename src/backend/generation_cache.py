@@ -0,0 +1,137 @@
+import hashlib
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Iterable, Iterator, Optional, Tuple
+
+from query_utils import normalize_query
+
+_TOKEN = re.compile(r"\S+\s*|\s+")
+
+
+def chunk_id(document: Any) -> str:
+    """
+    Stable id for a retrieved chunk: its vector id if the metadata carries one,
+    otherwise a hash of its text (so re-ingested, changed text gets a new id).
+    """
+    metadata = getattr(document, "metadata", None) or {}
+    explicit = metadata.get("id") or metadata.get("chunk_id")
+    if explicit:
+        return str(explicit)
+    text = getattr(document, "page_content", None) or getattr(document, "text", "")
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=12).hexdigest()
+
+
+def generation_key(model: str, prompt_version: str, question: str, documents: Iterable[Any]) -> Tuple:
+    """(model, prompt template version, normalized question, sorted chunk ids)."""
+    return (model, prompt_version, normalize_query(question), tuple(sorted(chunk_id(doc) for doc in documents)))
+
+
+def replay_tokens(text: str) -> Iterator[str]:
+    """Split a cached answer back into word-sized tokens for streaming."""
+    return iter(_TOKEN.findall(text))
+
+
+class GenerationCache:
+    """
+    LRU cache of generated answers, bounded by entry count and total bytes.
+
+    invalidate() drops everything (e.g. after ingest) and bumps the epoch;
+    answers whose generation started before the bump are not stored, so a
+    slow generation can't re-insert an answer based on the old documents.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = int(os.environ.get("GENERATION_CACHE_ENTRIES", 1000)),
+        max_bytes: int = int(os.environ.get("GENERATION_CACHE_BYTES", 16 * 1024 * 1024))
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.epoch = 0
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _size(key: Tuple, answer: str) -> int:
+        return len(answer.encode("utf-8")) + sum(len(str(part)) for part in key[:3]) + 24 * len(key[3])
+
+    def get(self, key: Hashable) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: Hashable, answer: str, epoch: Optional[int] = None):
+        """Store an answer; `epoch` is the value of .epoch read before generating it."""
+        if not answer:
+            return
+        size = self._size(key, answer)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if epoch is not None and epoch != self.epoch:
+                return
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.bytes -= previous[1]
+            self._entries[key] = (answer, size)
+            self.bytes += size
+            while len(self._entries) > self.max_entries or self.bytes > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self.bytes -= evicted
+
+    def invalidate(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+            self.epoch += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self.bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+                "epoch": self.epoch,
+            }
+
+
+# Example usage: repeated questions against a simulated multi-second generation
+if __name__ == "__main__":
+    import random
+    import time
+    from types import SimpleNamespace
+
+    documents = [SimpleNamespace(page_content=f"Chunk {i} of the trash collection ordinance.", metadata={}) for i in range(4)]
+    questions = ["When is trash collected?", "when is trash collected", "Is the pool open?", "Who do I call about potholes?"]
+    cache = GenerationCache(max_entries=100)
+
+    def generate(question):
+        time.sleep(0.2)  # stands in for several seconds of CPU-only Ollama generation
+        return f"Answer to {question}: trash is collected once a week."
+
+    random.seed(3)
+    start = time.perf_counter()
+    for i in range(40):
+        question = random.choice(questions)
+        key = generation_key("mistral", "1", question, documents)
+        if cache.get(key) is None:
+            epoch = cache.epoch
+            cache.put(key, generate(question), epoch)
+        if i == 20:
+            cache.invalidate()  # documents re-ingested
+    print(f"40 questions in {time.perf_counter() - start:.2f}s (uncached: {40 * 0.2:.1f}s)")
+    print(cache.stats())
+    print(list(replay_tokens("Trash is collected  once a week.")))
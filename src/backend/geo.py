@@ -0,0 +1,292 @@
+import json
+import logging
+import math
+import os
+import re
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Optional GeoJSON FeatureCollection from the borough's GIS export; every feature
+# needs a "layer" property ("locations", "zoning", "utilities" or "permits").
+# Without it only the built-in locations are served and the other layers are empty.
+GEO_DATA_PATH = os.environ.get("GEO_DATA_PATH")
+# Grid cell size in degrees (~550 m of latitude at 0.005)
+GEO_GRID_CELL_DEG = float(os.environ.get("GEO_GRID_CELL_DEG", 0.005))
+
+BBox = Tuple[float, float, float, float]  # min_lng, min_lat, max_lng, max_lat
+
+BOROUGH_CENTER = {"lat": 40.1308, "lng": -75.5146, "zoom": 14}
+LOCATION_ZOOM = 17
+MAP_LAYERS = ("locations", "zoning", "utilities", "permits")
+
+
+def _rect(min_lng, min_lat, max_lng, max_lat):
+    return [[[min_lng, min_lat], [max_lng, min_lat], [max_lng, max_lat], [min_lng, max_lat], [min_lng, min_lat]]]
+
+
+def _point(layer, lng, lat, **properties):
+    return {"type": "Feature", "properties": {"layer": layer, **properties},
+            "geometry": {"type": "Point", "coordinates": [lng, lat]}}
+
+
+def _polygon(layer, coordinates, **properties):
+    return {"type": "Feature", "properties": {"layer": layer, **properties},
+            "geometry": {"type": "Polygon", "coordinates": coordinates}}
+
+
+# Built-in map markers for well-known borough locations
+BOROUGH_LOCATIONS = [
+    _point("locations", -75.5146, 40.1308, name="Borough Hall", address="351 Bridge St", aliases=["borough hall", "town hall"]),
+    _point("locations", -75.5157, 40.1318, name="Police Department", address="140 Church St", aliases=["police"]),
+    _point("locations", -75.5171, 40.1334, name="Fire Department", address="Main St & Church St", aliases=["fire", "fire station"]),
+    _point("locations", -75.5189, 40.1301, name="Public Library", address="183 2nd Ave", aliases=["library"]),
+    _point("locations", -75.5221, 40.1282, name="Reeves Park", address="148 3rd Ave", aliases=["reeves park"]),
+    _point("locations", -75.5004, 40.1509, name="Black Rock Sanctuary", address="Black Rock Rd", aliases=["black rock"]),
+]
+
+# Made-up zoning, utility and permit features for the demo below and benchmarks
+# only; never served as borough data
+SAMPLE_FEATURES = BOROUGH_LOCATIONS + [
+    _polygon("zoning", _rect(-75.5200, 40.1290, -75.5100, 40.1340), district="TC", name="Town Center"),
+    _polygon("zoning", _rect(-75.5300, 40.1200, -75.5100, 40.1290), district="R-2", name="Residential Medium Density"),
+    _polygon("zoning", _rect(-75.5300, 40.1290, -75.5200, 40.1400), district="R-1", name="Residential Low Density"),
+    _polygon("zoning", _rect(-75.5100, 40.1200, -75.4950, 40.1340), district="MU", name="Mixed Use"),
+    _polygon("zoning", _rect(-75.5200, 40.1340, -75.4950, 40.1400), district="LI", name="Light Industrial"),
+    _polygon("zoning", _rect(-75.5100, 40.1400, -75.4900, 40.1560), district="C", name="Conservation"),
+    _polygon("utilities", _rect(-75.5300, 40.1200, -75.4950, 40.1400), service="water", name="Water service area"),
+    _polygon("utilities", _rect(-75.5250, 40.1220, -75.5000, 40.1380), service="sewer", name="Sewer service area"),
+    _point("permits", -75.5162, 40.1312, permit_id="BP-2024-0141", kind="Renovation", status="Issued"),
+    _point("permits", -75.5235, 40.1268, permit_id="BP-2024-0152", kind="Deck", status="Issued"),
+    _point("permits", -75.5120, 40.1255, permit_id="BP-2024-0167", kind="Demolition", status="Under review"),
+    _point("permits", -75.5048, 40.1330, permit_id="BP-2024-0173", kind="New construction", status="Issued"),
+]
+
+# Which map layer a question is about, checked in this order
+LAYER_PATTERNS = [
+    ("zoning", re.compile(r"zoning|zoned|\bzone\b", re.IGNORECASE)),
+    ("utilities", re.compile(r"utility|utilities|water service|sewer", re.IGNORECASE)),
+    ("permits", re.compile(r"permit", re.IGNORECASE)),
+]
+
+
+def _bbox_of(geometry: Dict[str, Any]) -> BBox:
+    if geometry["type"] == "Point":
+        lng, lat = geometry["coordinates"]
+        return lng, lat, lng, lat
+    rings = geometry["coordinates"] if geometry["type"] == "Polygon" else [r for p in geometry["coordinates"] for r in p]
+    lngs = [c[0] for ring in rings for c in ring]
+    lats = [c[1] for ring in rings for c in ring]
+    return min(lngs), min(lats), max(lngs), max(lats)
+
+
+def _in_ring(lng: float, lat: float, ring: List[List[float]]) -> bool:
+    inside = False
+    x1, y1 = ring[-1][0], ring[-1][1]
+    for x2, y2 in ((c[0], c[1]) for c in ring):
+        if (y1 > lat) != (y2 > lat) and lng < (x2 - x1) * (lat - y1) / (y2 - y1) + x1:
+            inside = not inside
+        x1, y1 = x2, y2
+    return inside
+
+
+def contains(geometry: Dict[str, Any], lng: float, lat: float) -> bool:
+    """Point-in-polygon for Polygon/MultiPolygon geometries (holes respected)."""
+    polygons = [geometry["coordinates"]] if geometry["type"] == "Polygon" else geometry["coordinates"] if geometry["type"] == "MultiPolygon" else []
+    for rings in polygons:
+        if _in_ring(lng, lat, rings[0]) and not any(_in_ring(lng, lat, hole) for hole in rings[1:]):
+            return True
+    return False
+
+
+def _overlaps(a: BBox, b: BBox) -> bool:
+    return a[0] <= b[2] and b[0] <= a[2] and a[1] <= b[3] and b[1] <= a[3]
+
+
+class GridIndex:
+    """Uniform grid over lng/lat; each cell lists the features whose bbox touches it."""
+
+    def __init__(self, cell_size: float = GEO_GRID_CELL_DEG):
+        self.cell_size = cell_size
+        self._cells: Dict[Tuple[int, int], List[int]] = {}
+
+    def _cell_range(self, bbox: BBox):
+        size = self.cell_size
+        return (range(math.floor(bbox[0] / size), math.floor(bbox[2] / size) + 1),
+                range(math.floor(bbox[1] / size), math.floor(bbox[3] / size) + 1))
+
+    def insert(self, item: int, bbox: BBox):
+        xs, ys = self._cell_range(bbox)
+        for x in xs:
+            for y in ys:
+                self._cells.setdefault((x, y), []).append(item)
+
+    def at(self, lng: float, lat: float) -> List[int]:
+        return self._cells.get((math.floor(lng / self.cell_size), math.floor(lat / self.cell_size)), [])
+
+    def search(self, bbox: BBox) -> Iterable[int]:
+        xs, ys = self._cell_range(bbox)
+        if len(xs) * len(ys) > len(self._cells):
+            # Query box covers more cells than are populated; walk the populated ones instead
+            cells = (items for (x, y), items in self._cells.items() if x in xs and y in ys)
+        else:
+            cells = (self._cells.get((x, y), ()) for x in xs for y in ys)
+        seen = set()
+        for items in cells:
+            for item in items:
+                if item not in seen:
+                    seen.add(item)
+                    yield item
+
+
+class GeoIndex:
+    """
+    Borough locations and map layer features, loaded once and indexed by layer.
+
+    Place names are matched with one precompiled regex, point lookups go
+    through a per-layer GridIndex, and the base map_data payload of every
+    layer is built up front. Lookups and map_data hand out fresh dicts, so
+    callers may modify them without touching the shared tables; GeoJSON
+    slices reference the loaded features and are meant to be serialized.
+    """
+
+    def __init__(self, features: Optional[List[Dict[str, Any]]] = None, cell_size: float = GEO_GRID_CELL_DEG, source: Optional[str] = None):
+        self.features = features if features is not None else BOROUGH_LOCATIONS
+        # Path of the GIS export the features came from; None for built-in or in-memory data
+        self.source = source
+        self._bboxes = [_bbox_of(f["geometry"]) for f in self.features]
+        self._grids = {layer: GridIndex(cell_size) for layer in MAP_LAYERS}
+        self._layer_features: Dict[str, List[int]] = {layer: [] for layer in MAP_LAYERS}
+        for i, feature in enumerate(self.features):
+            layer = feature["properties"].get("layer")
+            if layer not in self._grids:
+                logger.warning(f"Skipping feature with unknown layer {layer!r}")
+                continue
+            self._grids[layer].insert(i, self._bboxes[i])
+            self._layer_features[layer].append(i)
+
+        self._locations = {}
+        for i in self._layer_features["locations"]:
+            properties = self.features[i]["properties"]
+            lng, lat = self.features[i]["geometry"]["coordinates"]
+            location = {"name": properties["name"], "address": properties.get("address"), "lat": lat, "lng": lng}
+            for alias in [properties["name"], properties.get("address")] + properties.get("aliases", []):
+                if alias:
+                    self._locations[alias.lower()] = location
+        names = sorted(self._locations, key=len, reverse=True)
+        self._location_pattern = re.compile(r"\b(" + "|".join(map(re.escape, names)) + r")\b", re.IGNORECASE) if names else None
+
+        self._map_data = {layer: self._layer_map_data(layer) for layer in MAP_LAYERS}
+
+    def _layer_map_data(self, layer: str) -> Dict[str, Any]:
+        items = self._layer_features[layer]
+        bounds = None
+        if items:
+            boxes = [self._bboxes[i] for i in items]
+            bounds = [min(b[0] for b in boxes), min(b[1] for b in boxes), max(b[2] for b in boxes), max(b[3] for b in boxes)]
+        return {**BOROUGH_CENTER, "layer": layer, "bounds": bounds, "feature_count": len(items)}
+
+    @classmethod
+    def from_file(cls, path: str, cell_size: float = GEO_GRID_CELL_DEG) -> "GeoIndex":
+        with open(path) as f:
+            return cls(json.load(f)["features"], cell_size, source=path)
+
+    def find_location(self, text: str) -> Optional[Dict[str, Any]]:
+        """The first known place (name, alias or address) mentioned in `text`."""
+        if self._location_pattern is None:
+            return None
+        match = self._location_pattern.search(text)
+        return dict(self._locations[match.group(1).lower()]) if match else None
+
+    def features_at(self, layer: str, lng: float, lat: float) -> List[Dict[str, Any]]:
+        """Properties of the polygons of `layer` containing the point."""
+        point = (lng, lat, lng, lat)
+        return [dict(self.features[i]["properties"]) for i in self._grids[layer].at(lng, lat)
+                if _overlaps(self._bboxes[i], point) and contains(self.features[i]["geometry"], lng, lat)]
+
+    def zone_at(self, lng: float, lat: float) -> Optional[Dict[str, Any]]:
+        zones = self.features_at("zoning", lng, lat)
+        return zones[0] if zones else None
+
+    def features_in_bbox(self, layer: str, bbox: Optional[BBox] = None) -> Dict[str, Any]:
+        """GeoJSON FeatureCollection of the features of `layer` whose bbox intersects `bbox`."""
+        if bbox is None:
+            items = self._layer_features[layer]
+        else:
+            items = sorted(i for i in self._grids[layer].search(bbox) if _overlaps(self._bboxes[i], bbox))
+        return {"type": "FeatureCollection", "features": [self.features[i] for i in items]}
+
+    def map_data(self, layer: str = "locations", location: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """map_data payload for `layer`, centred on `location` if given."""
+        data = dict(self._map_data[layer])
+        if location is not None:
+            data.update(lat=location["lat"], lng=location["lng"], zoom=LOCATION_ZOOM, location=location["name"])
+        return data
+
+    def stats(self) -> Dict[str, Any]:
+        return {layer: len(items) for layer, items in self._layer_features.items()}
+
+
+def detect_layer(text: str) -> Optional[str]:
+    """Map layer a question asks about, or None."""
+    for layer, pattern in LAYER_PATTERNS:
+        if pattern.search(text):
+            return layer
+    return None
+
+
+def parse_bbox(value: str) -> BBox:
+    """Parse "min_lng,min_lat,max_lng,max_lat"; raises ValueError."""
+    parts = [float(p) for p in value.split(",")]
+    if len(parts) != 4 or parts[0] > parts[2] or parts[1] > parts[3]:
+        raise ValueError("bbox must be min_lng,min_lat,max_lng,max_lat")
+    return parts[0], parts[1], parts[2], parts[3]
+
+
+def load_geo_index() -> GeoIndex:
+    """GeoIndex from GEO_DATA_PATH, falling back to the built-in locations with empty layers."""
+    if GEO_DATA_PATH:
+        try:
+            return GeoIndex.from_file(GEO_DATA_PATH)
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Could not load GEO_DATA_PATH {GEO_DATA_PATH}, serving built-in locations only: {e}")
+    return GeoIndex()
+
+
+# Example usage: lookup latency, linear scan vs grid index
+if __name__ == "__main__":
+    import random
+    import time
+
+    random.seed(7)
+    # A borough-sized GIS export: 2,000 parcels' worth of zoning polygons and 5,000 permits
+    features = list(SAMPLE_FEATURES)
+    for n in range(2000):
+        lng, lat = random.uniform(-75.54, -75.49), random.uniform(40.11, 40.16)
+        features.append(_polygon("zoning", _rect(lng, lat, lng + 0.0008, lat + 0.0006), district=f"P-{n}", name=f"Parcel {n}"))
+    for n in range(5000):
+        features.append(_point("permits", random.uniform(-75.54, -75.49), random.uniform(40.11, 40.16), permit_id=f"BP-{n}"))
+    geo = GeoIndex(features)
+
+    points = [(random.uniform(-75.54, -75.49), random.uniform(40.11, 40.16)) for _ in range(2000)]
+    zoning = [f for f in features if f["properties"]["layer"] == "zoning"]
+
+    def timed(fn, items):
+        start = time.perf_counter()
+        for item in items:
+            fn(item)
+        return (time.perf_counter() - start) / len(items) * 1e6
+
+    scan = timed(lambda p: [f for f in zoning if contains(f["geometry"], *p)], points)
+    grid = timed(lambda p: geo.features_at("zoning", *p), points)
+    print(f"zone at point  : scan {scan:8.1f} us, grid {grid:6.1f} us")
+
+    boxes = [(lng, lat, lng + 0.005, lat + 0.004) for lng, lat in points[:500]]
+    permits = [(f, _bbox_of(f["geometry"])) for f in features if f["properties"]["layer"] == "permits"]
+    scan = timed(lambda b: [f for f, fb in permits if _overlaps(fb, b)], boxes)
+    grid = timed(lambda b: geo.features_in_bbox("permits", b), boxes)
+    print(f"permits in bbox: scan {scan:8.1f} us, grid {grid:6.1f} us")
+
+    questions = ["Where is the library?", "Show me the zoning map near Reeves Park", "sewer lines", "Where is city hall?"] * 500
+    print(f"find_location  : {timed(geo.find_location, questions):.1f} us")
+    print(geo.find_location("What zone is 351 Bridge St in?"), geo.zone_at(-75.5146, 40.1308))
@@ -1,5 +1,6 @@
-from fastapi import FastAPI, HTTPException, Body
+from fastapi import FastAPI, HTTPException, Body, Depends
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 import uvicorn
 import logging
 import time
@@ -11,6 +12,15 @@ from sentence_transformers import SentenceTransformer
 import numpy as np
 import asyncio
 
+from warmup import WarmupState, run_warmup
+from tracing import tracer, TracingMiddleware
+from profiling import allocation_profiler, require_admin, sampling_profiler
+from query_utils import normalize_query
+from request_coalescing import render_coalescing_metrics
+from retrieval_types import RetrievedChunk
+from status_snapshot import StatusRefresher
+from query_planner import queued_branches
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -30,12 +40,21 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Per-request trace ids and stage timings, exported on /metrics; the profiling
+# windows are long by design and would skew the route histograms
+app.add_middleware(TracingMiddleware, exclude_paths=("/metrics", "/admin/profile/cpu", "/admin/profile/memory"))
+
 # Global variables
 pinecone_available = False
 pinecone_client = None
 query_handler = None
 use_simulation = os.environ.get("USE_SIMULATION", "true").lower() == "true"
 embeddings_model = None
+warmup_state = WarmupState()
+
+# Limits for /query-batch
+MAX_BATCH_SIZE = int(os.environ.get("MAX_BATCH_SIZE", 500))
+BATCH_CONCURRENCY = int(os.environ.get("BATCH_CONCURRENCY", 8))
 
 # Use on_event for backward compatibility
 @app.on_event("startup")
@@ -133,14 +152,114 @@ async def startup_db_client():
         logger.error(f"Error connecting to Pinecone: {e}")
         logger.warning("Running in simulation mode due to errors")
 
+def build_warmup_stages() -> Dict[str, Any]:
+    """Map warm-up stages to the code paths this worker will serve from."""
+    stages = {}
+
+    def embed(text):
+        if embeddings_model is not None:
+            embeddings_model.encode(text)
+        if query_handler is not None:
+            query_handler._generate_embedding(text)
+
+    def retrieve(text):
+        query_handler.index.query(
+            vector=query_handler._generate_embedding(text),
+            top_k=query_handler.retrieval_policy.fetch_k,
+            include_metadata=True,
+            namespace=query_handler.active_namespace()
+        )
+
+    def generate(text):
+        if query_handler is not None and pinecone_available and not use_simulation:
+            query_handler._generate_answer(text, [RetrievedChunk(
+                "warmup",
+                1.0,
+                "Borough Hall is located at 351 Bridge Street, Phoenixville, PA 19460.",
+                {"source": "warmup"}
+            )])
+        else:
+            simulate_response(text)
+
+    if embeddings_model is not None or query_handler is not None:
+        stages["embed"] = embed
+    if query_handler is not None and pinecone_available and not use_simulation:
+        stages["retrieve"] = retrieve
+    stages["generate"] = generate
+    return stages
+
+def collect_index_status() -> Dict[str, Any]:
+    """Pinecone index stats for /status; polled by status_refresher, never on the request path."""
+    stats = query_handler.index.describe_index_stats()
+    return {
+        "vector_count": stats.total_vector_count,
+        "dimension": stats.dimension,
+        "index_fullness": stats.index_fullness,
+        "namespaces": list(stats.namespaces.keys()) if hasattr(stats, 'namespaces') else []
+    }
+
+# Refreshes the index stats snapshot every STATUS_REFRESH_INTERVAL seconds
+status_refresher = StatusRefresher("pinecone", collect_index_status)
+
+# Registered after startup_db_client so the model and handler are in place
+@app.on_event("startup")
+async def start_warmup():
+    # Run off the event loop; /status reports not-ready until this completes
+    loop = asyncio.get_running_loop()
+    loop.run_in_executor(None, run_warmup, warmup_state, build_warmup_stages())
+    if query_handler is not None and pinecone_available and not use_simulation:
+        status_refresher.start()
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
     logger.info("Shutting down API")
+    status_refresher.stop()
 
 @app.get("/")
 async def root():
     return {"message": "Nova AI Hybrid API is running"}
 
+@app.get("/metrics")
+async def metrics():
+    """Per-stage latency histograms in the Prometheus text format."""
+    body = tracer.render_prometheus()
+    if query_handler is not None:
+        body += render_coalescing_metrics(query_handler.inflight)
+    return PlainTextResponse(body, media_type="text/plain; version=0.0.4")
+
+@app.get("/admin/profile/cpu", dependencies=[Depends(require_admin)])
+async def profile_cpu(seconds: float = 10.0, interval_ms: float = 5.0, idle: bool = False):
+    """Sample every thread's stack for `seconds`; collapsed stacks for flamegraph.pl or speedscope."""
+    try:
+        profile = await asyncio.to_thread(sampling_profiler.profile, seconds, interval_ms / 1000, idle)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return PlainTextResponse(profile.collapsed(), headers={"X-Profile-Samples": str(profile.samples)})
+
+@app.get("/admin/profile/memory", dependencies=[Depends(require_admin)])
+async def profile_memory(seconds: float = 30.0, top: int = 25, frames: int = 1):
+    """tracemalloc growth by source line, and net allocations per route, over the next `seconds`."""
+    try:
+        return await asyncio.to_thread(allocation_profiler.window, seconds, top, frames)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+@app.get("/admin/profile/slow", dependencies=[Depends(require_admin)])
+async def slow_requests(limit: int = 50):
+    """Stage timelines of captured requests over the slow threshold, newest first."""
+    threshold = tracer.slow_threshold
+    return {"threshold_ms": threshold * 1000 if threshold is not None else None, "requests": tracer.slow(limit)}
+
+@app.post("/admin/profile/slow", dependencies=[Depends(require_admin)])
+async def set_slow_threshold(threshold_ms: Optional[float] = None):
+    """Capture requests slower than `threshold_ms` from now on; omit it to stop capturing."""
+    tracer.set_slow_threshold(threshold_ms)
+    return await slow_requests(limit=0)
+
 @app.get("/status")
 async def status():
     """Get the current status of the API and connections"""
@@ -152,23 +271,38 @@ async def status():
             "simulation_mode": not pinecone_available or use_simulation,
             "pinecone_available": pinecone_available,
             "embeddings_model": os.environ.get("EMBEDDINGS_MODEL_NAME", "all-MiniLM-L6-v2") if embeddings_model else "None",
-            "timestamp": time.time()
+            "timestamp": time.time(),
+            "ready": warmup_state.ready,
+            "warmup": warmup_state.as_dict()
         }
         
         # Add Pinecone information if available
         if pinecone_available and not use_simulation:
             try:
-                # Add Pinecone-specific info
+                # Add Pinecone-specific info; index stats come from the background snapshot
                 status_info.update({
                     "pinecone_status": "connected",
                     "pinecone_index": os.environ.get('PINECONE_INDEX_NAME', 'unknown'),
-                    "pinecone_environment": os.environ.get('PINECONE_ENVIRONMENT', 'unknown')
+                    "pinecone_environment": os.environ.get('PINECONE_ENVIRONMENT', 'unknown'),
+                    **status_refresher.snapshot()
                 })
             except Exception as e:
                 logger.error(f"Error getting Pinecone status: {e}")
                 status_info["pinecone_status"] = "error"
         
-        return status_info
+        # Live counters, all in memory
+        status_info["queues"] = {"planner_queued": queued_branches()}
+        if query_handler is not None:
+            handler_stats = query_handler.stats()
+            status_info["queues"]["queries_in_flight"] = handler_stats["in_flight"]
+            status_info["caches"] = {
+                "embedding": handler_stats["embedding_cache"],
+                "reranker": handler_stats["reranker"],
+            }
+            status_info["planner_wins"] = handler_stats["planner_wins"]
+        
+        # Report 503 until warm so load balancers only route to hot workers
+        return JSONResponse(content=status_info, status_code=200 if warmup_state.ready else 503)
     except Exception as e:
         logger.error(f"Error checking status: {e}")
         return {
@@ -209,29 +343,16 @@ async def query(request: dict = Body(...)):
             # Create context filter based on the selected context
             context_filter = create_context_filter(context)
             
-            # Execute query using Pinecone
-            response_data = query_handler.query(
+            # Execute query using Pinecone (in a worker thread so concurrent
+            # requests overlap and identical ones can be coalesced)
+            response_data = await asyncio.to_thread(
+                query_handler.query,
                 query_text=query_text,
-                top_k=5,
                 context_filter=context_filter
             )
             
             # Prepare source documents for response (remove score if present)
-            source_docs = []
-            for doc in response_data.get("source_documents", []):
-                # Create a clean copy without the score
-                if isinstance(doc, dict):
-                    doc_copy = {
-                        "content": doc.get("content", ""),
-                        "source": doc.get("source", "Unknown Source")
-                    }
-                else:
-                    # Handle the case where doc might be an object with attributes
-                    doc_copy = {
-                        "content": getattr(doc, "content", getattr(doc, "page_content", "")),
-                        "source": getattr(doc, "source", "Unknown Source")
-                    }
-                source_docs.append(doc_copy)
+            source_docs = format_source_documents(response_data.get("source_documents", []))
             
             result = response_data["result"]
         else:
@@ -272,6 +393,120 @@ async def query(request: dict = Body(...)):
         }
     
 
+@app.post("/query-batch")
+async def query_batch(request: dict = Body(...)):
+    """
+    Answer many queries in one call.
+    
+    Accepts {"queries": [...], "context": "general", "top_k": 5}, where each
+    query is a string or {"query": ..., "context": ...}. Identical questions
+    are answered once, all embeddings are computed in a single call, and
+    results stream back as newline-delimited JSON in completion order, one
+    line per input with its "index" plus the usual /query response fields.
+    """
+    items = request.get("queries")
+    if not items or not isinstance(items, list):
+        raise HTTPException(status_code=400, detail="queries must be a non-empty list")
+    if len(items) > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_SIZE} queries per batch")
+    
+    default_context = request.get("context", "general")
+    top_k = int(request["top_k"]) if request.get("top_k") else None
+    
+    # Parse into (text, context) per input position
+    parsed = []
+    for item in items:
+        if isinstance(item, dict):
+            parsed.append((str(item.get("query", "")).strip(), item.get("context", default_context)))
+        else:
+            parsed.append((str(item).strip(), default_context))
+    
+    # Group identical questions (after normalization) within the same context
+    groups = {}
+    for i, (text, context) in enumerate(parsed):
+        if text:
+            groups.setdefault((normalize_query(text), context), []).append(i)
+    unique = list(groups)
+    
+    using_pinecone = pinecone_available and query_handler and not use_simulation
+    logger.info(f"Processing batch of {len(items)} queries ({len(unique)} unique)")
+    
+    async def answer(n: int, embedding: Optional[List[float]]):
+        text, context = parsed[groups[unique[n]][0]]
+        start_time = time.time()
+        try:
+            if using_pinecone:
+                response_data = await asyncio.to_thread(
+                    query_handler.query, text, top_k, create_context_filter(context), embedding
+                )
+                result = response_data["result"]
+                source_docs = format_source_documents(response_data.get("source_documents", []))
+            else:
+                result = simulate_response(text, context)
+                source_docs = [{"content": "This is a simulated response.", "source": "simulation.txt"}]
+        except Exception as e:
+            logger.error(f"Error processing batch query '{text}': {e}")
+            result = "Sorry, I wasn’t able to process your request due to an internal error."
+            source_docs = [{"content": "Backend processing error", "source": "fallback_system.txt"}]
+        return n, {
+            "result": result,
+            "processing_time": time.time() - start_time,
+            "source_documents": source_docs
+        }
+    
+    async def generate():
+        for i, (text, _) in enumerate(parsed):
+            if not text:
+                yield json.dumps({"index": i, "query": text, "result": "Query cannot be empty", "processing_time": 0, "source_documents": []}) + "\n"
+        
+        # One embedding call for every question not already cached
+        embeddings = [None] * len(unique)
+        if using_pinecone and unique:
+            with tracer.span("embedding"):
+                embeddings = await asyncio.to_thread(
+                    query_handler.embed_batch, [parsed[groups[key][0]][0] for key in unique]
+                )
+        
+        semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+        
+        async def bounded(n):
+            async with semaphore:
+                return await answer(n, embeddings[n])
+        
+        tasks = [asyncio.create_task(bounded(n)) for n in range(len(unique))]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                n, response = await next_done
+                for i in groups[unique[n]]:
+                    yield json.dumps({"index": i, "query": parsed[i][0], **response}) + "\n"
+        finally:
+            # Stop outstanding work if the client disconnects
+            for task in tasks:
+                task.cancel()
+    
+    return StreamingResponse(generate(), media_type="application/x-ndjson")
+
+def format_source_documents(documents) -> List[Dict[str, str]]:
+    """Convert handler source documents to the {content, source} response shape."""
+    source_docs = []
+    for doc in documents:
+        # Create a clean copy without the score
+        if hasattr(doc, "to_response"):
+            doc_copy = doc.to_response()
+        elif isinstance(doc, dict):
+            doc_copy = {
+                "content": doc.get("content", ""),
+                "source": doc.get("source", "Unknown Source")
+            }
+        else:
+            # Handle the case where doc might be an object with attributes
+            doc_copy = {
+                "content": getattr(doc, "content", getattr(doc, "page_content", "")),
+                "source": getattr(doc, "source", "Unknown Source")
+            }
+        source_docs.append(doc_copy)
+    return source_docs
+
 def simulate_response(query_text: str, context: str = "general") -> str:
     """Provide a simulated response when Pinecone is not available"""
     
@@ -0,0 +1,223 @@
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Where the per-index pointer files live; shared by the API processes and ingest
+# workers, so it defaults to the absolute directory of the ingest job database
+INDEX_POINTER_DIR = os.environ.get("INDEX_POINTER_DIR") or os.path.dirname(
+    os.path.abspath(os.environ.get("INGEST_JOBS_DB", __file__))
+)
+# The index queries read. Readers and the ingest job must name the pointer file
+# after the same index, so they all take this default rather than their own.
+GENERATIONS_INDEX_NAME = os.environ.get("PINECONE_INDEX_NAME", "phoenixville-municipal-code")
+# Retired generations kept (for rollback) before their namespaces are deleted
+INDEX_GENERATIONS_KEEP = int(os.environ.get("INDEX_GENERATIONS_KEEP", 1))
+# A retired generation is never deleted sooner than this, so in-flight queries can finish
+INDEX_GC_GRACE_SECONDS = float(os.environ.get("INDEX_GC_GRACE_SECONDS", 300))
+
+
+def new_generation_name() -> str:
+    """Namespace for a fresh index generation, e.g. gen-20240501T120000-3fa2c1."""
+    return f"gen-{time.strftime('%Y%m%dT%H%M%S', time.gmtime())}-{uuid.uuid4().hex[:6]}"
+
+
+class IndexGenerations:
+    """
+    Blue/green pointer to the namespace of `index_name` that queries should read.
+
+    Ingest writes a complete new generation into its own namespace, then
+    flip() swaps the pointer with an atomic file rename. Readers see either
+    the old or the new generation, never a half-populated one. active() only
+    re-reads the pointer file when its mtime changes, and checks at most
+    every `check_interval` seconds, so it is cheap on the query path. None
+    means the default namespace (indexes ingested before generations
+    existed).
+    """
+
+    def __init__(
+        self,
+        index_name: str,
+        pointer_dir: str = INDEX_POINTER_DIR,
+        check_interval: float = 1.0,
+        keep: int = INDEX_GENERATIONS_KEEP,
+        grace_seconds: float = INDEX_GC_GRACE_SECONDS
+    ):
+        self.index_name = index_name
+        self.path = os.path.join(pointer_dir, f"{index_name}.generation.json")
+        self.check_interval = check_interval
+        self.keep = keep
+        self.grace_seconds = grace_seconds
+        self._lock = threading.Lock()
+        self._state = {"active": None, "retired": [], "flipped_at": None}
+        self._mtime = None
+        self._checked_at = 0.0
+
+    def _load(self) -> Dict[str, Any]:
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return self._state
+        if mtime != self._mtime:
+            try:
+                with open(self.path) as f:
+                    self._state = json.load(f)
+                self._mtime = mtime
+            except (OSError, ValueError) as e:
+                logger.error(f"Error reading index pointer {self.path}, keeping {self._state['active']}: {e}")
+        return self._state
+
+    def _save(self, state: Dict[str, Any]):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".index-pointer-", suffix=".part")
+        with os.fdopen(fd, "w") as f:
+            json.dump(state, f, indent=1)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        self._state, self._mtime = state, os.stat(self.path).st_mtime_ns
+
+    def active(self) -> Optional[str]:
+        """Namespace queries should read right now."""
+        now = time.monotonic()
+        if now - self._checked_at >= self.check_interval:
+            with self._lock:
+                self._checked_at = now
+                self._load()
+        return self._state["active"]
+
+    def flip(self, namespace: str) -> Optional[str]:
+        """Point queries at `namespace`; returns the generation it replaced."""
+        with self._lock:
+            state = self._load()
+            previous = state["active"]
+            if previous == namespace:
+                return previous
+            retired = [g for g in state["retired"] if g["namespace"] != namespace]
+            if previous is not None:
+                retired.append({"namespace": previous, "retired_at": time.time()})
+            self._save({"active": namespace, "retired": retired, "flipped_at": time.time()})
+            self._checked_at = time.monotonic()
+        logger.info(f"Index generation flipped: {previous or '(default namespace)'} -> {namespace}")
+        return previous
+
+    def collect_garbage(self, index: Any) -> List[str]:
+        """Delete namespaces of retired generations beyond `keep` that are past the grace period."""
+        with self._lock:
+            state = self._load()
+            retired = sorted(state["retired"], key=lambda g: g["retired_at"])
+            kept = retired[-self.keep:] if self.keep > 0 else []
+            cutoff = time.time() - self.grace_seconds
+            doomed = [g for g in retired if g not in kept and g["retired_at"] < cutoff]
+            if not doomed:
+                return []
+            deleted = []
+            for generation in doomed:
+                try:
+                    index.delete(delete_all=True, namespace=generation["namespace"])
+                    deleted.append(generation["namespace"])
+                except Exception as e:
+                    logger.error(f"Error deleting index generation {generation['namespace']}: {e}")
+            self._save({**state, "retired": [g for g in retired if g["namespace"] not in deleted]})
+        if deleted:
+            logger.info(f"Deleted retired index generations: {deleted}")
+        return deleted
+
+    def stats(self) -> Dict[str, Any]:
+        state = self._state
+        return {
+            "active": state["active"],
+            "retired": [g["namespace"] for g in state["retired"]],
+            "flipped_at": state["flipped_at"],
+        }
+
+
+def wait_until_visible(index: Any, namespace: str, expected: int, timeout: float = 120.0, interval: float = 2.0) -> int:
+    """Block until `namespace` reports `expected` vectors (upserts are eventually consistent)."""
+    deadline = time.monotonic() + timeout
+    while True:
+        summary = index.describe_index_stats().namespaces.get(namespace)
+        count = summary.vector_count if summary is not None else 0
+        if count >= expected:
+            return count
+        if time.monotonic() >= deadline:
+            raise TimeoutError(f"Namespace {namespace} has {count} of {expected} vectors after {timeout:.0f}s")
+        time.sleep(interval)
+
+
+# Example usage: queries during a re-index, in place vs blue/green
+if __name__ == "__main__":
+    from types import SimpleNamespace
+
+    class FakeIndex:
+        """In-memory stand-in for a Pinecone index with namespaces."""
+
+        def __init__(self):
+            self.namespaces = {}
+
+        def upsert(self, vectors, namespace=None):
+            self.namespaces.setdefault(namespace, {}).update((v["id"], v) for v in vectors)
+
+        def delete(self, delete_all=False, namespace=None):
+            self.namespaces.pop(namespace, None)
+
+        def query(self, namespace=None, **kwargs):
+            return len(self.namespaces.get(namespace, {}))
+
+        def describe_index_stats(self):
+            return SimpleNamespace(namespaces={ns: SimpleNamespace(vector_count=len(v)) for ns, v in self.namespaces.items()})
+
+    documents = 1000
+    index = FakeIndex()
+    index.upsert([{"id": str(i)} for i in range(documents)], namespace=None)
+    pointer_dir = tempfile.mkdtemp()
+    generations = IndexGenerations("demo", pointer_dir, check_interval=0.0, grace_seconds=0.0, keep=0)
+
+    def reindex(namespace, clear_first):
+        if clear_first:
+            index.delete(delete_all=True, namespace=namespace)
+        for start in range(0, documents, 100):
+            index.upsert([{"id": str(i)} for i in range(start, start + 100)], namespace=namespace)
+            time.sleep(0.01)
+
+    for name, blue_green in (("in place", False), ("blue/green", True)):
+        visible = []
+        stop = threading.Event()
+
+        def reader():
+            while not stop.is_set():
+                visible.append(index.query(namespace=generations.active()))
+                time.sleep(0.001)
+
+        thread = threading.Thread(target=reader)
+        thread.start()
+        if blue_green:
+            namespace = new_generation_name()
+            reindex(namespace, clear_first=False)
+            wait_until_visible(index, namespace, documents, interval=0.01)
+            generations.flip(namespace)
+            generations.collect_garbage(index)
+        else:
+            reindex(generations.active(), clear_first=True)
+        stop.set()
+        thread.join()
+        partial = sum(1 for count in visible if count < documents)
+        print(f"{name:10s}: {len(visible)} queries during re-index, {partial} saw a partial index (min {min(visible)} of {documents} docs)")
+
+    start = time.perf_counter()
+    pointer = IndexGenerations("demo", pointer_dir)
+    for _ in range(100000):
+        pointer.active()
+    print(f"active() costs {(time.perf_counter() - start) * 10:.2f} us")
+
+    # A second re-index retires the first generation, which is then garbage-collected
+    namespace = new_generation_name()
+    reindex(namespace, clear_first=False)
+    generations.flip(namespace)
+    print(f"deleted {generations.collect_garbage(index)}; namespaces now: {list(index.namespaces)}")
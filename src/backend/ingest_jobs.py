@@ -0,0 +1,535 @@
+import hashlib
+import json
+import logging
+import math
+import multiprocessing
+import os
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional
+
+from index_generations import GENERATIONS_INDEX_NAME, IndexGenerations, new_generation_name, wait_until_visible
+from warmup import get_warmup_config
+
+logger = logging.getLogger(__name__)
+
+# Absolute by default, so the API and workers share one database whatever their working directory
+INGEST_JOBS_DB = os.environ.get("INGEST_JOBS_DB", os.path.join(os.path.dirname(os.path.abspath(__file__)), "ingest_jobs.db"))
+# Worker processes started by the API; 0 to run them separately
+INGEST_WORKERS = int(os.environ.get("INGEST_WORKERS", 1))
+# Documents embedded and upserted between checkpoints
+INGEST_BATCH_SIZE = int(os.environ.get("INGEST_BATCH_SIZE", 100))
+# How long a finished ingest may wait for its vectors to become queryable before flipping
+INDEX_VISIBILITY_TIMEOUT = float(os.environ.get("INDEX_VISIBILITY_TIMEOUT", 300))
+# A running job whose heartbeat is older than this is taken over by another worker
+INGEST_JOB_STALE_SECONDS = float(os.environ.get("INGEST_JOB_STALE_SECONDS", 120))
+INGEST_MAX_ATTEMPTS = int(os.environ.get("INGEST_MAX_ATTEMPTS", 3))
+# Workers run at a lower CPU priority so queries keep their latency during ingest
+INGEST_WORKER_NICE = int(os.environ.get("INGEST_WORKER_NICE", 10))
+
+HEARTBEAT_INTERVAL = 5.0
+POLL_INTERVAL = 1.0
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    status TEXT NOT NULL,
+    params TEXT NOT NULL DEFAULT '{}',
+    checkpoint INTEGER NOT NULL DEFAULT 0,
+    progress TEXT NOT NULL DEFAULT '{}',
+    result TEXT,
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    cancel_requested INTEGER NOT NULL DEFAULT 0,
+    worker TEXT,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    heartbeat_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at);
+CREATE INDEX IF NOT EXISTS jobs_finished ON jobs (finished_at);
+CREATE TABLE IF NOT EXISTS watermarks (
+    name TEXT PRIMARY KEY,
+    value REAL NOT NULL
+);
+"""
+
+class JobCancelled(Exception):
+    """Raised inside a job at its next checkpoint after cancel() was requested."""
+
+
+class JobStore:
+    """
+    sqlite-backed job queue shared by the API and the worker processes.
+
+    Jobs move queued -> running -> succeeded/failed/cancelled. Workers record
+    a checkpoint after every batch and a heartbeat while running; a job whose
+    worker stops heartbeating is claimed again and resumes from its last
+    checkpoint, up to `max_attempts` times.
+    """
+
+    def __init__(self, path: str = INGEST_JOBS_DB, stale_after: float = INGEST_JOB_STALE_SECONDS, max_attempts: int = INGEST_MAX_ATTEMPTS):
+        self.path = path
+        self.stale_after = stale_after
+        self.max_attempts = max_attempts
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+
+    @contextmanager
+    def _connect(self):
+        # One short-lived connection per call: safe across threads and processes
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _as_dict(row: Optional[sqlite3.Row]) -> Optional[Dict[str, Any]]:
+        if row is None:
+            return None
+        job = dict(row)
+        for key in ("params", "progress", "result"):
+            job[key] = json.loads(job[key]) if job[key] else None
+        job["cancel_requested"] = bool(job["cancel_requested"])
+        return job
+
+    def submit(self, kind: str, params: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        job_id = uuid.uuid4().hex
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, kind, status, params, created_at) VALUES (?, ?, 'queued', ?, ?)",
+                (job_id, kind, json.dumps(params or {}), time.time())
+            )
+        return self.get(job_id)
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._connect() as conn:
+            return self._as_dict(conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone())
+
+    def list(self, limit: int = 50, status: Optional[str] = None) -> List[Dict[str, Any]]:
+        with self._connect() as conn:
+            if status:
+                rows = conn.execute("SELECT * FROM jobs WHERE status = ? ORDER BY created_at DESC LIMIT ?", (status, limit))
+            else:
+                rows = conn.execute("SELECT * FROM jobs ORDER BY created_at DESC LIMIT ?", (limit,))
+            return [self._as_dict(row) for row in rows.fetchall()]
+
+    def finished_since(self, since: float) -> List[Dict[str, Any]]:
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT * FROM jobs WHERE finished_at > ? ORDER BY finished_at", (since,)
+            ).fetchall()
+            return [self._as_dict(row) for row in rows]
+
+    def get_watermark(self, name: str) -> Optional[float]:
+        with self._connect() as conn:
+            row = conn.execute("SELECT value FROM watermarks WHERE name = ?", (name,)).fetchone()
+            return row["value"] if row else None
+
+    def set_watermark(self, name: str, value: float):
+        """Record progress under `name`; a watermark never moves backwards."""
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO watermarks (name, value) VALUES (?, ?)"
+                " ON CONFLICT (name) DO UPDATE SET value = MAX(value, excluded.value)",
+                (name, value)
+            )
+
+    def claim(self, worker: str) -> Optional[Dict[str, Any]]:
+        """Take the oldest queued job, or a running one whose worker died."""
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                # Abandoned jobs that were being cancelled, or were abandoned too
+                # many times, are finished rather than retried
+                conn.execute(
+                    "UPDATE jobs SET status = 'cancelled', finished_at = ? "
+                    "WHERE status = 'running' AND heartbeat_at < ? AND cancel_requested = 1",
+                    (now, now - self.stale_after)
+                )
+                conn.execute(
+                    "UPDATE jobs SET status = 'failed', error = 'Worker died ' || attempts || ' times', finished_at = ? "
+                    "WHERE status = 'running' AND heartbeat_at < ? AND attempts >= ?",
+                    (now, now - self.stale_after, self.max_attempts)
+                )
+                row = conn.execute(
+                    "SELECT id FROM jobs WHERE (status = 'queued' OR (status = 'running' AND heartbeat_at < ?)) "
+                    "AND cancel_requested = 0 ORDER BY created_at LIMIT 1",
+                    (now - self.stale_after,)
+                ).fetchone()
+                if row is None:
+                    conn.execute("COMMIT")
+                    return None
+                conn.execute(
+                    "UPDATE jobs SET status = 'running', worker = ?, attempts = attempts + 1, "
+                    "started_at = COALESCE(started_at, ?), heartbeat_at = ? WHERE id = ?",
+                    (worker, now, now, row["id"])
+                )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        return self.get(row["id"])
+
+    def heartbeat(self, job_id: str, checkpoint: Optional[int] = None, progress: Optional[Dict[str, Any]] = None) -> bool:
+        """Record liveness (and optionally progress); returns True if cancellation was requested."""
+        with self._connect() as conn:
+            if checkpoint is None:
+                conn.execute("UPDATE jobs SET heartbeat_at = ? WHERE id = ?", (time.time(), job_id))
+            else:
+                conn.execute(
+                    "UPDATE jobs SET heartbeat_at = ?, checkpoint = ?, progress = ? WHERE id = ?",
+                    (time.time(), checkpoint, json.dumps(progress or {}), job_id)
+                )
+            row = conn.execute("SELECT cancel_requested FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            return bool(row and row["cancel_requested"])
+
+    def finish(self, job_id: str, status: str, result: Any = None, error: Optional[str] = None):
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ? WHERE id = ?",
+                (status, json.dumps(result) if result is not None else None, error, time.time(), job_id)
+            )
+
+    def cancel(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Cancel a queued job now; a running one stops at its next checkpoint."""
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = 'cancelled', cancel_requested = 1, finished_at = ? WHERE id = ? AND status = 'queued'",
+                (time.time(), job_id)
+            )
+            conn.execute("UPDATE jobs SET cancel_requested = 1 WHERE id = ? AND status = 'running'", (job_id,))
+        return self.get(job_id)
+
+
+class JobContext:
+    """Handed to job handlers: resume point, checkpointing and cancellation."""
+
+    def __init__(self, store: JobStore, job: Dict[str, Any]):
+        self.store = store
+        self.job = job
+        self.cancelled = threading.Event()
+        # Batches completed by earlier attempts
+        self.resume_from = job["checkpoint"]
+
+    @property
+    def progress(self) -> Dict[str, Any]:
+        return self.job["progress"] or {}
+
+    def checkpoint(self, position: int, progress: Optional[Dict[str, Any]] = None):
+        """Persist progress after a completed batch; raises JobCancelled if cancel was requested."""
+        if self.store.heartbeat(self.job["id"], position, progress):
+            self.cancelled.set()
+        self.job["checkpoint"], self.job["progress"] = position, progress
+        self.raise_if_cancelled()
+
+    def raise_if_cancelled(self):
+        if self.cancelled.is_set():
+            raise JobCancelled()
+
+
+def _ingest_embeddings():
+    from lanchain_pinecone_adapter import CustomHuggingFaceEmbeddings
+    try:
+        return CustomHuggingFaceEmbeddings()
+    except Exception as e:
+        logger.error(f"Error with custom embeddings: {e}")
+        from langchain.embeddings import HuggingFaceEmbeddings
+        return HuggingFaceEmbeddings(model_name=os.environ.get("EMBEDDINGS_MODEL_NAME", "text-embedding-ada-002"))
+
+
+def vector_id(document: Any) -> str:
+    """Deterministic id, so a batch re-run after a crash overwrites instead of duplicating."""
+    key = f"{document.metadata.get('source', '')}\0{document.page_content}"
+    return hashlib.blake2b(key.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def _as_list(vector: Any) -> List[float]:
+    return vector.tolist() if hasattr(vector, "tolist") else list(vector)
+
+
+def _upsert_batch(index: Any, documents: List[Any], embeddings: Any, namespace: str):
+    values = embeddings.embed_documents([doc.page_content for doc in documents])
+    index.upsert(vectors=[
+        {"id": vector_id(doc), "values": _as_list(vector), "metadata": {**doc.metadata, "text": doc.page_content}}
+        for doc, vector in zip(documents, values)
+    ], namespace=namespace)
+
+
+def _warm_generation(index: Any, namespace: str, embeddings: Any):
+    """Query the new namespace before it takes traffic, so the first real queries aren't cold."""
+    for query in get_warmup_config()["queries"]:
+        index.query(vector=_as_list(embeddings.embed_query(query)), top_k=5, include_metadata=True, namespace=namespace)
+
+
+def _drop_generation(index: Any, namespace: str):
+    try:
+        index.delete(delete_all=True, namespace=namespace)
+    except Exception as e:
+        logger.error(f"Error deleting unfinished index generation {namespace}; delete it by hand: {e}")
+
+
+def run_ingest_job(ctx: JobContext) -> Dict[str, Any]:
+    """
+    process_documents -> embed + upsert into a new index generation in
+    checkpointed batches -> wait until visible -> warm -> flip -> GC.
+    """
+    from pinecone_ingest import process_documents, initialize_pinecone
+
+    texts = process_documents()
+    if not texts:
+        return {"status": "no_documents", "documents_processed": 0}
+
+    index = initialize_pinecone()
+    batch_size = ctx.job["params"].get("batch_size", INGEST_BATCH_SIZE)
+    total_batches = math.ceil(len(texts) / batch_size)
+    start = ctx.resume_from
+    namespace = ctx.progress.get("namespace")
+    # Only resume if the source documents split into the same chunks as before
+    if start and (ctx.progress.get("documents") != len(texts) or ctx.progress.get("batch_size") != batch_size):
+        logger.warning("Source documents changed since the last checkpoint; restarting ingest from the beginning")
+        # Never the default namespace: that holds vectors from before generations existed
+        if namespace:
+            _drop_generation(index, namespace)
+        start, namespace = 0, None
+    namespace = namespace or new_generation_name()
+
+    # check_interval=0 so the failure path below sees whether the flip landed
+    generations = IndexGenerations(ctx.job["params"].get("index_name") or GENERATIONS_INDEX_NAME, check_interval=0.0)
+    try:
+        embeddings = _ingest_embeddings()
+        for batch in range(start, total_batches):
+            ctx.raise_if_cancelled()
+            _upsert_batch(index, texts[batch * batch_size:(batch + 1) * batch_size], embeddings, namespace)
+            ctx.checkpoint(batch + 1, {
+                "batches_done": batch + 1,
+                "total_batches": total_batches,
+                "documents": len(texts),
+                "batch_size": batch_size,
+                "namespace": namespace,
+            })
+
+        wait_until_visible(index, namespace, len({vector_id(doc) for doc in texts}), timeout=INDEX_VISIBILITY_TIMEOUT)
+        _warm_generation(index, namespace, embeddings)
+        previous = generations.flip(namespace)
+    except Exception:
+        # Cancelled, timed out or failed before going live: queries never read
+        # this generation and a failed job is not retried, so drop it
+        if generations.active() != namespace:
+            _drop_generation(index, namespace)
+        raise
+    deleted = generations.collect_garbage(index)
+    return {
+        "status": "success",
+        "documents_processed": len(texts),
+        "namespace": namespace,
+        "previous_namespace": previous,
+        "deleted_generations": deleted,
+    }
+
+
+def run_analyze_job(ctx: JobContext) -> Dict[str, Any]:
+    """Run the municipal document extractor script and keep its output."""
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "pinecone_municipal_doc_extractor.py")
+    process = subprocess.Popen([sys.executable, script], stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    while True:
+        try:
+            stdout, stderr = process.communicate(timeout=HEARTBEAT_INTERVAL)
+            break
+        except subprocess.TimeoutExpired:
+            if ctx.cancelled.is_set():
+                process.kill()
+                process.communicate()
+                raise JobCancelled()
+    return {"status": "success" if process.returncode == 0 else "error", "output": stdout, "error": stderr}
+
+
+# Job kind -> handler(ctx) returning a JSON-serializable result
+JOB_HANDLERS: Dict[str, Callable[[JobContext], Any]] = {
+    "ingest": run_ingest_job,
+    "analyze": run_analyze_job,
+}
+
+
+def run_job(store: JobStore, job: Dict[str, Any]):
+    """Execute one claimed job, heartbeating on a side thread until it ends."""
+    ctx = JobContext(store, job)
+    done = threading.Event()
+
+    def heartbeat():
+        while not done.wait(HEARTBEAT_INTERVAL):
+            if store.heartbeat(job["id"]):
+                ctx.cancelled.set()
+
+    beat = threading.Thread(target=heartbeat, name=f"job-heartbeat-{job['id'][:8]}", daemon=True)
+    beat.start()
+    try:
+        handler = JOB_HANDLERS.get(job["kind"])
+        if handler is None:
+            raise ValueError(f"Unknown job kind: {job['kind']}")
+        result = handler(ctx)
+        store.finish(job["id"], "succeeded", result=result)
+    except JobCancelled:
+        store.finish(job["id"], "cancelled", error="Cancelled at checkpoint")
+    except Exception as e:
+        logger.error(f"Job {job['id']} ({job['kind']}) failed: {e}", exc_info=True)
+        store.finish(job["id"], "failed", error=str(e))
+    finally:
+        done.set()
+        beat.join()
+
+
+def worker_main(db_path: str = INGEST_JOBS_DB, stop: Optional[Any] = None, nice: int = INGEST_WORKER_NICE, stale_after: float = INGEST_JOB_STALE_SECONDS):
+    """Worker process loop: claim jobs and run them until `stop` is set."""
+    logging.basicConfig(level=logging.INFO)
+    if nice:
+        try:
+            os.nice(nice)
+        except (AttributeError, OSError):
+            pass
+    store = JobStore(db_path, stale_after=stale_after)
+    worker = f"{os.uname().nodename if hasattr(os, 'uname') else 'local'}:{os.getpid()}"
+    while stop is None or not stop.is_set():
+        job = store.claim(worker)
+        if job is None:
+            time.sleep(POLL_INTERVAL)
+            continue
+        logger.info(f"Worker {worker} running job {job['id']} ({job['kind']}) from checkpoint {job['checkpoint']}")
+        run_job(store, job)
+
+
+class WorkerPool:
+    """Starts and stops job worker processes next to the API."""
+
+    def __init__(self, db_path: str = INGEST_JOBS_DB, workers: int = INGEST_WORKERS, start_method: str = "spawn", stale_after: float = INGEST_JOB_STALE_SECONDS):
+        self.db_path = db_path
+        self.workers = workers
+        self.stale_after = stale_after
+        self._context = multiprocessing.get_context(start_method)
+        self._stop = self._context.Event()
+        self._processes = []
+
+    def start(self):
+        for i in range(self.workers):
+            process = self._context.Process(target=worker_main, args=(self.db_path, self._stop, INGEST_WORKER_NICE, self.stale_after), name=f"ingest-worker-{i}", daemon=True)
+            process.start()
+            self._processes.append(process)
+
+    def stop(self, timeout: float = 5.0):
+        """Ask workers to exit; a job still running is resumed from its checkpoint by the next worker."""
+        self._stop.set()
+        for process in self._processes:
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+        self._processes = []
+
+
+class JobWatcher:
+    """
+    Calls `on_finished(job)` in this process for every job that finishes, polling the store.
+
+    The finished_at of the last job handled is saved in the store under
+    `name`, so after a restart the watcher also reports jobs that finished
+    while the process was down. The first run starts from the current time.
+    """
+
+    def __init__(self, store: JobStore, on_finished: Callable[[Dict[str, Any]], None], interval: float = 2.0, name: str = "job_watcher"):
+        self.store = store
+        self.on_finished = on_finished
+        self.interval = interval
+        self.name = name
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="job-watcher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    def _resume_point(self) -> float:
+        since = self.store.get_watermark(self.name)
+        if since is None:
+            since = time.time()
+            self.store.set_watermark(self.name, since)
+        return since
+
+    def poll(self, since: float) -> float:
+        """Hand every job finished after `since` to on_finished; returns the new watermark."""
+        for job in self.store.finished_since(since):
+            try:
+                self.on_finished(job)
+            except Exception as e:
+                logger.error(f"Error handling finished job {job['id']}: {e}")
+            since = max(since, job["finished_at"])
+            self.store.set_watermark(self.name, since)
+        return since
+
+    def _run(self):
+        since = None
+        while True:
+            try:
+                if since is None:
+                    since = self._resume_point()
+                since = self.poll(since)
+            except Exception as e:
+                logger.error(f"Error watching jobs: {e}")
+            if self._stopped.wait(self.interval):
+                return
+
+
+# Example usage: a worker killed mid-job, resumed from its checkpoint, plus cancellation
+if __name__ == "__main__":
+    import tempfile
+
+    def demo_batches(ctx):
+        for batch in range(ctx.resume_from, 10):
+            time.sleep(0.1)  # embed + upsert one batch
+            ctx.checkpoint(batch + 1, {"batches_done": batch + 1, "total_batches": 10, "resumed_from": ctx.resume_from})
+        return {"documents_processed": 1000}
+
+    JOB_HANDLERS["demo"] = demo_batches
+    HEARTBEAT_INTERVAL = 0.2
+    db_path = os.path.join(tempfile.mkdtemp(), "jobs.db")
+    store = JobStore(db_path, stale_after=1.0)
+    job = store.submit("demo")
+
+    # fork so the child sees the demo handler registered above
+    crashing = WorkerPool(db_path, workers=1, start_method="fork", stale_after=1.0)
+    crashing.start()
+    time.sleep(0.55)
+    for process in crashing._processes:
+        process.kill()  # simulated crash
+    print(f"after crash: {store.get(job['id'])['status']}, checkpoint {store.get(job['id'])['checkpoint']}")
+
+    time.sleep(1.1)  # heartbeat goes stale
+    pool = WorkerPool(db_path, workers=1, start_method="fork", stale_after=1.0)
+    pool.start()
+    while store.get(job["id"])["status"] == "running":
+        time.sleep(0.1)
+    finished = store.get(job["id"])
+    print(f"resumed: {finished['status']}, attempts {finished['attempts']}, progress {finished['progress']}")
+
+    second = store.submit("demo")
+    time.sleep(1.5)
+    store.cancel(second["id"])
+    while store.get(second["id"])["status"] == "running":
+        time.sleep(0.1)
+    cancelled = store.get(second["id"])
+    print(f"cancelled: {cancelled['status']} at checkpoint {cancelled['checkpoint']}")
+    pool.stop()
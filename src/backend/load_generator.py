@@ -0,0 +1,488 @@
+import argparse
+import asyncio
+import importlib
+import json
+import logging
+import os
+import platform
+import random
+import socket
+import sys
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import httpx
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from benchmark_harness import STUB_APPS, WARMUP_QUERIES, BenchConfig, add_stub_arguments, build_workload, git_commit, summarize
+
+logger = logging.getLogger(__name__)
+
+
+class Endpoint:
+    """How to call one route and which responses count as served."""
+
+    def __init__(self, method: str, path: str, body: Optional[Callable[[str, int], Dict[str, Any]]] = None,
+                 stream: bool = False, ok_statuses=(200,)):
+        self.method = method
+        self.path = path
+        self.body = body
+        self.stream = stream
+        self.ok_statuses = set(ok_statuses)
+
+
+ENDPOINTS = {
+    "query": Endpoint("POST", "/query", lambda q, n: {"query": q, "context": "general"}),
+    "query-stream": Endpoint("POST", "/query-stream", lambda q, n: {"query": q}, stream=True),
+    # 503 is the not-yet-warm answer load balancers poll for, not a failure
+    "status": Endpoint("GET", "/status", ok_statuses=(200, 503)),
+    "log-chat": Endpoint("POST", "/log-chat", lambda q, n: {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "type": "user_message",
+        "message": q,
+        "user_id": f"load-{n % 50}",
+        "context": "general",
+    }),
+}
+
+# Default request mix per app; only pinecone_api serves /query-stream and /log-chat
+APP_MIXES = {
+    "simple_ai_api": "query=9,status=1",
+    "hybrid_ai_api": "query=9,status=1",
+    "pinecone_api": "query=5,query-stream=3,status=1,log-chat=1",
+}
+
+
+def parse_mix(text: str) -> Dict[str, float]:
+    """'query=6,status=1' -> {'query': 6.0, 'status': 1.0}"""
+    mix = {}
+    for part in text.split(","):
+        if not part.strip():
+            continue
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in ENDPOINTS:
+            raise ValueError(f"Unknown endpoint {name!r}; choose from {', '.join(ENDPOINTS)}")
+        mix[name] = float(weight) if weight.strip() else 1.0
+    if not mix or sum(mix.values()) <= 0:
+        raise ValueError(f"Empty request mix: {text!r}")
+    return mix
+
+
+def arrival_times(process: str, rate: float, duration: float, rng: random.Random,
+                  burst_factor: float = 4.0, burst_period: float = 2.0) -> List[float]:
+    """
+    Send offsets (seconds) for an open-loop run at a mean of `rate` requests/s.
+
+    "poisson" spaces requests by exponential gaps. "bursty" is an on/off
+    Poisson process: each `burst_period` starts with an ON window of
+    1/burst_factor of the period at burst_factor x the rate, then goes quiet,
+    so the mean rate is unchanged but queues see bursts.
+    """
+    if rate <= 0:
+        return []
+    if process == "poisson":
+        burst_factor = 1.0
+    elif process != "bursty":
+        raise ValueError(f"Unknown arrival process {process!r}")
+    on_window = burst_period / burst_factor
+    times, t = [], 0.0
+    while True:
+        t += rng.expovariate(rate * burst_factor)
+        if burst_factor > 1.0 and t % burst_period >= on_window:
+            # Skip the quiet part of the cycle; memorylessness keeps this Poisson within ON windows
+            t = (t // burst_period + 1) * burst_period + rng.expovariate(rate * burst_factor)
+        if t >= duration:
+            return times
+        times.append(t)
+
+
+class StreamParser:
+    """Incremental parser for the concatenated or newline-delimited JSON events of /query-stream."""
+
+    def __init__(self):
+        self.decoder = json.JSONDecoder()
+        self.buffer = ""
+
+    def feed(self, text: str) -> List[Any]:
+        self.buffer += text
+        events, pos = [], 0
+        while True:
+            while pos < len(self.buffer) and self.buffer[pos].isspace():
+                pos += 1
+            if pos >= len(self.buffer):
+                break
+            try:
+                event, pos = self.decoder.raw_decode(self.buffer, pos)
+            except json.JSONDecodeError:
+                # Partial event; wait for the next chunk
+                break
+            events.append(event)
+        self.buffer = self.buffer[pos:]
+        return events
+
+
+class EndpointStats:
+    """Outcomes for one endpoint. Times are measured from the scheduled send time."""
+
+    def __init__(self):
+        self.latencies = []
+        self.ttfb = []
+        self.ttlt = []
+        self.tokens = []
+        self.errors = {}
+
+    def error(self, kind: str):
+        self.errors[kind] = self.errors.get(kind, 0) + 1
+
+    def report(self, elapsed: float) -> Dict[str, Any]:
+        errors = sum(self.errors.values())
+        result = {
+            "requests": len(self.latencies) + errors,
+            "ok": len(self.latencies),
+            "errors": errors,
+            "error_kinds": dict(self.errors),
+            "throughput_rps": round(len(self.latencies) / elapsed, 2) if elapsed else 0.0,
+            "latency_ms": summarize(self.latencies),
+            "ttfb_ms": summarize(self.ttfb),
+        }
+        if self.ttlt:
+            result["ttlt_ms"] = summarize(self.ttlt)
+            result["tokens_per_stream"] = round(sum(self.tokens) / len(self.tokens), 1)
+        return result
+
+
+class Phase:
+    """One run at a fixed offered load."""
+
+    def __init__(self, mix: Dict[str, float]):
+        self.stats = {name: EndpointStats() for name in mix}
+        self.dispatch_lag = []
+        self.elapsed = 0.0
+        # Rate actually sent; Poisson draws wander around the nominal rate
+        self.sent_rps = None
+
+    def report(self, offered_rps: Optional[float]) -> Dict[str, Any]:
+        endpoints = {name: stats.report(self.elapsed) for name, stats in self.stats.items()}
+        ok = sum(e["ok"] for e in endpoints.values())
+        errors = sum(e["errors"] for e in endpoints.values())
+        return {
+            "offered_rps": offered_rps,
+            "sent_rps": self.sent_rps,
+            "achieved_rps": round(ok / self.elapsed, 2) if self.elapsed else 0.0,
+            "requests": ok + errors,
+            "errors": errors,
+            "error_rate": round(errors / (ok + errors), 4) if ok + errors else 0.0,
+            "elapsed_s": round(self.elapsed, 3),
+            # How late the generator itself was; large values mean the client, not the server, is saturated
+            "dispatch_lag_ms": summarize(self.dispatch_lag),
+            "endpoints": endpoints,
+        }
+
+
+async def issue(client: httpx.AsyncClient, name: str, query: str, n: int, scheduled: float, phase: Phase):
+    """Send one request and record TTFB, completion and (for streams) time to the last token."""
+    endpoint, stats = ENDPOINTS[name], phase.stats[name]
+    body = endpoint.body(query, n) if endpoint.body else None
+    try:
+        async with client.stream(endpoint.method, endpoint.path, json=body) as response:
+            first_byte = last_token = None
+            parser, tokens = StreamParser() if endpoint.stream else None, 0
+            async for chunk in response.aiter_text():
+                now = time.perf_counter()
+                if first_byte is None:
+                    first_byte = now
+                if parser is None:
+                    continue
+                for event in parser.feed(chunk):
+                    if isinstance(event, dict):
+                        if event.get("token"):
+                            tokens += 1
+                            last_token = now
+                        if event.get("done"):
+                            last_token = now
+            done = time.perf_counter()
+        if response.status_code not in endpoint.ok_statuses:
+            stats.error(f"http_{response.status_code}")
+            return
+        stats.latencies.append(done - scheduled)
+        stats.ttfb.append((first_byte or done) - scheduled)
+        if parser is not None:
+            stats.ttlt.append((last_token or done) - scheduled)
+            stats.tokens.append(tokens)
+    except Exception as e:
+        stats.error(type(e).__name__)
+
+
+class Workload:
+    """Endpoint and question picker shared by every phase."""
+
+    def __init__(self, mix: Dict[str, float], seed: int = 0, skew: float = 1.1, queries: Optional[List[str]] = None):
+        self.names = list(mix)
+        self.weights = [mix[name] for name in self.names]
+        self.rng = random.Random(seed)
+        self.queries = build_workload(4096, seed, skew, queries)
+        self.count = 0
+
+    def next(self) -> Tuple[str, str, int]:
+        self.count += 1
+        return self.rng.choices(self.names, self.weights)[0], self.queries[self.count % len(self.queries)], self.count
+
+
+async def open_loop(client: httpx.AsyncClient, workload: Workload, offsets: List[float], duration: float,
+                    concurrency: int) -> Phase:
+    """Send at the scheduled offsets whether or not earlier requests have finished (no coordinated omission)."""
+    phase = Phase(dict.fromkeys(workload.names))
+    limit = asyncio.Semaphore(concurrency)
+    tasks = []
+
+    async def send(name, query, n, scheduled):
+        # Time spent waiting for a connection slot counts against the request
+        async with limit:
+            await issue(client, name, query, n, scheduled, phase)
+
+    start = time.perf_counter()
+    for offset in offsets:
+        scheduled = start + offset
+        delay = scheduled - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        phase.dispatch_lag.append(max(0.0, time.perf_counter() - scheduled))
+        tasks.append(asyncio.create_task(send(*workload.next(), scheduled)))
+    await asyncio.gather(*tasks)
+    # The schedule may end in a quiet spell; rates are over the whole window
+    phase.elapsed = max(duration, time.perf_counter() - start)
+    return phase
+
+
+async def closed_loop(client: httpx.AsyncClient, workload: Workload, duration: float, concurrency: int) -> Phase:
+    """`concurrency` virtual users, each sending its next request as soon as the last one finishes."""
+    phase = Phase(dict.fromkeys(workload.names))
+    start = time.perf_counter()
+    deadline = start + duration
+
+    async def user():
+        while time.perf_counter() < deadline:
+            await issue(client, *workload.next(), time.perf_counter(), phase)
+
+    await asyncio.gather(*(user() for _ in range(concurrency)))
+    phase.elapsed = time.perf_counter() - start
+    return phase
+
+
+def slo_breach(report: Dict[str, Any], slo_ms: float, max_error_rate: float, min_goodput: float) -> Optional[str]:
+    """Why a phase counts as saturated, or None. Streams are judged on time to first byte."""
+    if report["error_rate"] > max_error_rate:
+        return f"error rate {report['error_rate']:.2%} > {max_error_rate:.2%}"
+    if report["sent_rps"] and report["achieved_rps"] < min_goodput * report["sent_rps"]:
+        return f"served {report['achieved_rps']} of {report['sent_rps']} req/s sent"
+    for name, stats in report["endpoints"].items():
+        latency = stats["ttfb_ms"] if ENDPOINTS[name].stream else stats["latency_ms"]
+        if latency.get("p95", 0) > slo_ms:
+            return f"{name} p95 {latency['p95']:.0f} ms > {slo_ms:.0f} ms"
+    return None
+
+
+async def run_load(base_url: str, args: argparse.Namespace, workload: Workload) -> Dict[str, Any]:
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    timeout = httpx.Timeout(args.timeout, pool=None)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=timeout) as client:
+        if args.warmup:
+            for query in WARMUP_QUERIES:
+                await issue(client, "query", query, 0, time.perf_counter(), Phase({"query": 1}))
+
+        if args.arrival == "closed":
+            phase = await closed_loop(client, workload, args.duration, args.concurrency)
+            return {"run": phase.report(None)}
+
+        rng = random.Random(args.seed)
+
+        async def phase_at(rate, duration):
+            offsets = arrival_times(args.arrival, rate, duration, rng, args.burst_factor, args.burst_period)
+            phase = await open_loop(client, workload, offsets, duration, args.concurrency)
+            phase.sent_rps = round(len(offsets) / duration, 2)
+            return phase.report(round(rate, 2))
+
+        if not args.saturate:
+            return {"run": await phase_at(args.rate, args.duration)}
+
+        # Step the offered load up until a step breaks the SLO; the last passing step is the saturation point
+        steps, rate, last_good, limit = [], args.rate, None, None
+        for _ in range(args.max_steps):
+            report = await phase_at(rate, args.step_duration)
+            limit = slo_breach(report, args.slo_ms, args.max_error_rate, args.min_goodput)
+            report["breach"] = limit
+            steps.append(report)
+            print_phase(f"{rate:.1f} req/s", report)
+            if limit:
+                break
+            last_good = report
+            rate *= args.step_factor
+        return {
+            "saturation": {
+                "max_rps": last_good["offered_rps"] if last_good else None,
+                "achieved_rps": last_good["achieved_rps"] if last_good else None,
+                "limited_by": limit or f"not reached after {args.max_steps} steps",
+            },
+            "steps": steps,
+        }
+
+
+class InProcessServer:
+    """Serve an ASGI app with uvicorn on a free localhost port from a background thread."""
+
+    def __init__(self, app, lifespan: str = "on"):
+        import uvicorn
+
+        # asyncio only sets TCP_NODELAY on accepted sockets whose proto is TCP; with proto 0, Nagle and
+        # delayed ACKs add ~40 ms to every keep-alive request
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM, socket.IPPROTO_TCP)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind(("127.0.0.1", 0))
+        self.url = f"http://127.0.0.1:{self.sock.getsockname()[1]}"
+        config = uvicorn.Config(app, lifespan=lifespan, log_level="warning", access_log=False)
+        self.server = uvicorn.Server(config)
+        self.thread = threading.Thread(target=self.server.run, kwargs={"sockets": [self.sock]}, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        deadline = time.time() + 60
+        while not self.server.started:
+            if not self.thread.is_alive() or time.time() > deadline:
+                raise RuntimeError("In-process server failed to start")
+            time.sleep(0.05)
+        return self
+
+    def __exit__(self, *exc):
+        self.server.should_exit = True
+        self.thread.join(timeout=10)
+        self.sock.close()
+
+
+@contextmanager
+def serve_target(args: argparse.Namespace) -> Iterator[Tuple[str, Callable[[], Any]]]:
+    """Yield (base URL, cache stats callable) for --url or an in-process --app."""
+    if args.url:
+        yield args.url.rstrip("/"), lambda: None
+        return
+    # Keep in-process targets off the network: simulated answers and no model downloads
+    os.environ.setdefault("USE_SIMULATION", "true")
+    os.environ.setdefault("HF_HUB_OFFLINE", "1")
+    with ExitStack() as stack:
+        if args.stubs and args.app in STUB_APPS:
+            app, caches = stack.enter_context(STUB_APPS[args.app](BenchConfig(args)))
+        else:
+            app, caches = importlib.import_module(args.app).app, lambda: None
+        # The API modules configure chatty loggers on import
+        logging.getLogger().setLevel(logging.ERROR)
+        lifespan = args.lifespan if args.lifespan != "auto" else ("off" if args.stubs else "on")
+        server = stack.enter_context(InProcessServer(app, lifespan))
+        yield server.url, caches
+
+
+def print_phase(label: str, report: Dict[str, Any]):
+    print(f"\n{label}: {report['achieved_rps']} req/s served, {report['errors']} errors "
+          f"({report['error_rate']:.2%}) in {report['elapsed_s']} s")
+    for name, stats in report["endpoints"].items():
+        latency = stats["latency_ms"]
+        if not latency.get("count"):
+            print(f"  {name:13s} no successful requests {stats['error_kinds']}")
+            continue
+        print(f"  {name:13s} n={stats['ok']:<6d} p50 {latency['p50']:9.1f}  p95 {latency['p95']:9.1f}  p99 {latency['p99']:9.1f} ms"
+              + (f"  errors {stats['error_kinds']}" if stats["errors"] else ""))
+        if "ttlt_ms" in stats:
+            print(f"  {'':13s} TTFB p50 {stats['ttfb_ms']['p50']:.1f} p95 {stats['ttfb_ms']['p95']:.1f} ms, "
+                  f"last token p50 {stats['ttlt_ms']['p50']:.1f} p95 {stats['ttlt_ms']['p95']:.1f} ms, "
+                  f"{stats['tokens_per_stream']} tokens/stream")
+    lag = report["dispatch_lag_ms"]
+    if lag.get("count") and lag["p99"] > 50:
+        print(f"  warning: generator fell behind schedule (dispatch lag p99 {lag['p99']:.0f} ms); results understate capacity")
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Open- or closed-loop HTTP load against the query APIs.")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--url", help="Base URL of a running server")
+    target.add_argument("--app", choices=sorted(APP_MIXES), help="Serve this API module in-process on localhost")
+    parser.add_argument("--stubs", action="store_true",
+                        help="Back --app with the local index and stub LLMs from benchmark_harness instead of simulation mode")
+    parser.add_argument("--lifespan", choices=["auto", "on", "off"], default="auto",
+                        help="Run the app's startup hooks (auto: off with --stubs, since they connect to the real backends)")
+    parser.add_argument("--mix", help="Endpoint weights, e.g. 'query=6,query-stream=3,status=1,log-chat=1' (default depends on --app)")
+    parser.add_argument("--arrival", choices=["poisson", "bursty", "closed"], default="poisson",
+                        help="Open-loop Poisson or on/off bursts at --rate, or closed-loop users (--concurrency)")
+    parser.add_argument("--rate", type=float, default=10.0, help="Mean offered requests/s (the starting rate with --saturate)")
+    parser.add_argument("--burst-factor", type=float, default=4.0, help="Peak-to-mean rate ratio of bursty arrivals")
+    parser.add_argument("--burst-period", type=float, default=2.0, help="Seconds per on/off cycle of bursty arrivals")
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds of load")
+    parser.add_argument("--concurrency", type=int, default=64, help="Maximum requests in flight (virtual users when closed)")
+    parser.add_argument("--timeout", type=float, default=60.0, help="Per-request timeout in seconds")
+    parser.add_argument("--workload", help="File with one question per line (default: the sample questions)")
+    parser.add_argument("--skew", type=float, default=1.1, help="Zipf exponent of question popularity (0 = uniform)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-warmup", dest="warmup", action="store_false", help="Skip the warm-up queries")
+    parser.add_argument("--saturate", action="store_true", help="Step up the rate until the SLO breaks and report the last passing rate")
+    parser.add_argument("--step-duration", type=float, default=10.0, help="Seconds per --saturate step")
+    parser.add_argument("--step-factor", type=float, default=1.5, help="Rate multiplier between --saturate steps")
+    parser.add_argument("--max-steps", type=int, default=12)
+    parser.add_argument("--slo-ms", type=float, default=2000.0, help="p95 latency (time to first byte for streams) a step must meet")
+    parser.add_argument("--max-error-rate", type=float, default=0.01)
+    parser.add_argument("--min-goodput", type=float, default=0.9, help="Served/offered rate a step must sustain")
+    add_stub_arguments(parser)
+    parser.add_argument("--output", help="Write results as JSON")
+    args = parser.parse_args(argv)
+    if args.saturate and args.arrival == "closed":
+        parser.error("--saturate needs an open-loop --arrival (poisson or bursty)")
+    return args
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.ERROR)
+    try:
+        mix = parse_mix(args.mix or APP_MIXES.get(args.app, APP_MIXES["pinecone_api"]))
+    except ValueError as e:
+        raise SystemExit(str(e))
+    queries = None
+    if args.workload:
+        with open(args.workload) as f:
+            queries = [line.strip() for line in f if line.strip()]
+    workload = Workload(mix, args.seed, args.skew, queries)
+
+    with serve_target(args) as (base_url, caches):
+        results = asyncio.run(run_load(base_url, args, workload))
+        results["caches"] = caches()
+    results = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "python": platform.python_version(),
+            "target": args.url or f"{args.app} (in-process{', stubs' if args.stubs else ''})",
+        },
+        "config": vars(args),
+        **results,
+    }
+
+    if "run" in results:
+        print_phase(f"{args.arrival} @ {args.rate} req/s" if args.arrival != "closed" else f"closed loop x{args.concurrency}",
+                    results["run"])
+    else:
+        saturation = results["saturation"]
+        print(f"\nSaturation: {saturation['max_rps']} req/s offered ({saturation['achieved_rps']} served); "
+              f"next step limited by {saturation['limited_by']}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.output}")
+    return 0
+
+
+# Example usage:
+#   python load_generator.py --app hybrid_ai_api --rate 50 --duration 20
+#   python load_generator.py --app pinecone_api --stubs --arrival bursty --rate 5 --saturate --slo-ms 1500
+#   python load_generator.py --url http://localhost:8000 --mix "query=1,status=1" --arrival closed --concurrency 32
+if __name__ == "__main__":
+    sys.exit(main())
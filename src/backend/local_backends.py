@@ -0,0 +1,538 @@
+import hashlib
+import json
+import logging
+import os
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from typing import Any, Dict, Iterator, List, Optional, Sequence
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+_WORD = re.compile(r"[a-z0-9]+")
+
+
+class HashEmbedder:
+    """
+    Deterministic bag-of-words embeddings (feature hashing), with an optional
+    per-call delay standing in for model time.
+
+    Texts that share words land near each other, so retrieval over a local
+    index behaves plausibly without downloading a model. Implements the
+    LangChain Embeddings methods (embed_query/embed_documents).
+    """
+
+    def __init__(self, dim: int = 384, latency: float = 0.0):
+        self.dim = dim
+        self.latency = latency
+        self._buckets = {}
+
+    def _bucket(self, word: str):
+        bucket = self._buckets.get(word)
+        if bucket is None:
+            digest = int.from_bytes(hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest(), "little")
+            bucket = self._buckets[word] = (digest % self.dim, 1.0 if digest >> 63 else -1.0)
+        return bucket
+
+    def _embed(self, text: str) -> List[float]:
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for word in _WORD.findall(text.lower()):
+            position, sign = self._bucket(word)
+            vector[position] += sign
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if self.latency:
+            time.sleep(self.latency)
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+def minilm_embedder(target_dim: int = 1024):
+    """The real padded MiniLM model used in production, or None if sentence-transformers is missing."""
+    try:
+        from lanchain_pinecone_adapter import CustomHuggingFaceEmbeddings
+    except ImportError as e:
+        logger.warning(f"MiniLM embeddings unavailable, use HashEmbedder instead: {e}")
+        return None
+    return CustomHuggingFaceEmbeddings(target_dim=target_dim)
+
+
+def _matches_filter(metadata: Dict[str, Any], flt: Optional[Dict[str, Any]]) -> bool:
+    """Subset of Pinecone metadata filters: equality, $eq, $ne, $in, $nin, $contains, $and, $or."""
+    if not flt:
+        return True
+    for key, condition in flt.items():
+        if key == "$and":
+            if not all(_matches_filter(metadata, c) for c in condition):
+                return False
+            continue
+        if key == "$or":
+            if not any(_matches_filter(metadata, c) for c in condition):
+                return False
+            continue
+        value = metadata.get(key)
+        if not isinstance(condition, dict):
+            condition = {"$eq": condition}
+        for op, operand in condition.items():
+            if op == "$eq" and value != operand:
+                return False
+            if op == "$ne" and value == operand:
+                return False
+            if op == "$in" and value not in operand:
+                return False
+            if op == "$nin" and value in operand:
+                return False
+            if op == "$contains" and (value is None or operand not in value):
+                return False
+    return True
+
+
+class _Namespace:
+    def __init__(self):
+        self.ids = []
+        self.positions = {}
+        self.values = []
+        self.metadata = []
+        self._matrix = None
+
+    def upsert(self, vector_id: str, values: Sequence[float], metadata: Optional[Dict[str, Any]]):
+        position = self.positions.get(vector_id)
+        if position is None:
+            self.positions[vector_id] = len(self.ids)
+            self.ids.append(vector_id)
+            self.values.append(values)
+            self.metadata.append(metadata or {})
+        else:
+            self.values[position] = values
+            self.metadata[position] = metadata or {}
+        self._matrix = None
+
+    def matrix(self) -> np.ndarray:
+        if self._matrix is None:
+            matrix = np.asarray(self.values, dtype=np.float32).reshape(len(self.values), -1)
+            norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+            self._matrix = matrix / np.where(norms == 0, 1, norms)
+        return self._matrix
+
+
+class LocalIndex:
+    """
+    In-memory, exact (brute-force cosine) stand-in for a Pinecone index.
+
+    Supports the calls the backend makes: upsert, query (namespaces,
+    metadata filters, include_metadata), fetch, delete and
+    describe_index_stats. `query_latency` adds a fixed delay per query to
+    mimic the network round trip to the hosted service.
+    """
+
+    def __init__(self, dimension: int, query_latency: float = 0.0):
+        self.dimension = dimension
+        self.query_latency = query_latency
+        self._lock = threading.Lock()
+        self._namespaces: Dict[str, _Namespace] = {}
+
+    def upsert(self, vectors, namespace: Optional[str] = None, **kwargs):
+        with self._lock:
+            ns = self._namespaces.setdefault(namespace or "", _Namespace())
+            for vector in vectors:
+                if isinstance(vector, dict):
+                    ns.upsert(vector["id"], vector["values"], vector.get("metadata"))
+                else:
+                    ns.upsert(vector[0], vector[1], vector[2] if len(vector) > 2 else None)
+        return {"upserted_count": len(vectors)}
+
+    def query(self, vector=None, top_k: int = 10, namespace: Optional[str] = None, filter: Optional[Dict] = None,
+              include_metadata: bool = False, include_values: bool = False, id: Optional[str] = None, **kwargs):
+        if self.query_latency:
+            time.sleep(self.query_latency)
+        with self._lock:
+            ns = self._namespaces.get(namespace or "")
+            if ns is None or not ns.ids:
+                return SimpleNamespace(matches=[], namespace=namespace or "")
+            if vector is None:
+                vector = ns.values[ns.positions[id]]
+            matrix, ids, metadata, values = ns.matrix(), ns.ids, ns.metadata, ns.values
+        query = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        scores = matrix @ (query / norm if norm else query)
+        if filter:
+            allowed = np.fromiter((_matches_filter(m, filter) for m in metadata), dtype=bool, count=len(metadata))
+            scores = np.where(allowed, scores, -np.inf)
+        k = min(top_k, len(ids))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        matches = [
+            SimpleNamespace(
+                id=ids[i],
+                score=float(scores[i]),
+                metadata=metadata[i] if include_metadata else None,
+                values=list(values[i]) if include_values else []
+            )
+            for i in top if scores[i] != -np.inf
+        ]
+        return SimpleNamespace(matches=matches, namespace=namespace or "")
+
+    def fetch(self, ids: List[str], namespace: Optional[str] = None, **kwargs):
+        with self._lock:
+            ns = self._namespaces.get(namespace or "") or _Namespace()
+            vectors = {
+                vector_id: SimpleNamespace(id=vector_id, values=ns.values[ns.positions[vector_id]], metadata=ns.metadata[ns.positions[vector_id]])
+                for vector_id in ids if vector_id in ns.positions
+            }
+        return SimpleNamespace(vectors=vectors, namespace=namespace or "")
+
+    def delete(self, ids: Optional[List[str]] = None, delete_all: bool = False, namespace: Optional[str] = None, **kwargs):
+        with self._lock:
+            if delete_all:
+                self._namespaces.pop(namespace or "", None)
+                return {}
+            old = self._namespaces.get(namespace or "")
+            if old is None:
+                return {}
+            doomed = set(ids or [])
+            ns = self._namespaces[namespace or ""] = _Namespace()
+            for vector_id, values, metadata in zip(old.ids, old.values, old.metadata):
+                if vector_id not in doomed:
+                    ns.upsert(vector_id, values, metadata)
+        return {}
+
+    def describe_index_stats(self, **kwargs):
+        with self._lock:
+            namespaces = {name: SimpleNamespace(vector_count=len(ns.ids)) for name, ns in self._namespaces.items()}
+        return SimpleNamespace(
+            dimension=self.dimension,
+            index_fullness=0.0,
+            total_vector_count=sum(ns.vector_count for ns in namespaces.values()),
+            namespaces=namespaces
+        )
+
+
+class LocalPinecone:
+    """Stand-in for pinecone.Pinecone serving LocalIndex instances by name."""
+
+    def __init__(self, indexes: Dict[str, LocalIndex]):
+        self.indexes = indexes
+
+    def Index(self, name: str) -> LocalIndex:
+        return self.indexes[name]
+
+    def list_indexes(self):
+        names = list(self.indexes)
+        return SimpleNamespace(names=lambda: names)
+
+
+def stub_answer_tokens(prompt: str, answer_tokens: int) -> List[str]:
+    """Deterministic answer for a prompt, as word-sized tokens."""
+    words = _WORD.findall(prompt.lower())[-12:] or ["answer"]
+    return [f"{words[i % len(words)]} " for i in range(answer_tokens)]
+
+
+def paced(tokens: List[str], tokens_per_second: float, ttft: float) -> Iterator[str]:
+    """Yield tokens at a fixed rate after an initial time-to-first-token delay."""
+    time.sleep(ttft)
+    interval = 1.0 / tokens_per_second if tokens_per_second else 0.0
+    for n, token in enumerate(tokens):
+        if n and interval:
+            time.sleep(interval)
+        yield token
+
+
+class _StubStream:
+    def __init__(self, tokens: Iterator[str]):
+        self._tokens = tokens
+        self.closed = False
+
+    def __iter__(self):
+        for token in self._tokens:
+            if self.closed:
+                return
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=token), finish_reason=None)])
+
+    def close(self):
+        self.closed = True
+
+
+class StubOpenAI:
+    """
+    Stand-in for openai.OpenAI covering embeddings.create and
+    chat.completions.create (streamed or not).
+
+    Embeddings come from `embedder`; completions are generated at
+    `tokens_per_second` after `ttft` seconds.
+    """
+
+    def __init__(self, embedder: HashEmbedder, tokens_per_second: float = 50.0, ttft: float = 0.3, answer_tokens: int = 60):
+        self.embedder = embedder
+        self.tokens_per_second = tokens_per_second
+        self.ttft = ttft
+        self.answer_tokens = answer_tokens
+        self.embedding_calls = 0
+        self.completion_calls = 0
+        self.embeddings = SimpleNamespace(create=self._create_embeddings)
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create_completion))
+
+    def _create_embeddings(self, model: str, input, **kwargs):
+        self.embedding_calls += 1
+        texts = [input] if isinstance(input, str) else list(input)
+        return SimpleNamespace(data=[SimpleNamespace(embedding=e) for e in self.embedder.embed_documents(texts)])
+
+    def _create_completion(self, model: str, messages: List[Dict[str, str]], stream: bool = False, **kwargs):
+        self.completion_calls += 1
+        tokens = paced(stub_answer_tokens(messages[-1]["content"], self.answer_tokens), self.tokens_per_second, self.ttft)
+        if stream:
+            return _StubStream(tokens)
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content="".join(tokens)))])
+
+
+class StubOllamaServer:
+    """
+    Local HTTP server speaking Ollama's streaming /api/generate protocol.
+
+    Generates `answer_tokens` tokens at `tokens_per_second` after `ttft`
+    seconds and serves at most `parallel` generations at once, queueing the
+    rest like OLLAMA_NUM_PARALLEL.
+    """
+
+    def __init__(self, tokens_per_second: float = 30.0, ttft: float = 0.5, answer_tokens: int = 60, parallel: int = 1):
+        self.tokens_per_second = tokens_per_second
+        self.ttft = ttft
+        self.answer_tokens = answer_tokens
+        self._slots = threading.Semaphore(parallel)
+        self.generations = 0
+        self._server = None
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_port}"
+
+    def start(self) -> "StubOllamaServer":
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _chunk(self, payload: Dict[str, Any]):
+                data = json.dumps(payload).encode() + b"\n"
+                self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+                self.wfile.flush()
+
+            def do_POST(self):
+                payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-ndjson")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                with stub._slots:
+                    stub.generations += 1
+                    tokens = stub_answer_tokens(payload.get("prompt", ""), stub.answer_tokens)
+                    for token in paced(tokens, stub.tokens_per_second, stub.ttft):
+                        self._chunk({"model": payload.get("model"), "response": token, "done": False})
+                    self._chunk({"model": payload.get("model"), "response": "", "done": True, "eval_count": len(tokens)})
+                self.wfile.write(b"0\r\n\r\n")
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+# Sample municipal corpus: (topic, title, questions, answer passages). Each
+# question's relevant chunks are the answer passages of its topic.
+SAMPLE_TOPICS = [
+    ("trash", "Trash and Recycling Collection", ["When is trash picked up?", "What day is recycling collected in my ward?"], [
+        "Household trash is collected weekly. The North and East wards are collected on Monday, the South and West wards on Tuesday.",
+        "Recycling is collected every other Wednesday borough-wide. Place single-stream recycling carts at the curb by 6 a.m.",
+        "Bulk items such as furniture require a bulk pickup sticker, available at Borough Hall for $10 per item.",
+    ]),
+    ("water", "Water and Sewer Billing", ["How do I pay my water bill?", "When are water bills due?"], [
+        "Water and sewer bills are issued quarterly and are due 30 days after the billing date. A 10% penalty applies to late payments.",
+        "Water bills can be paid online, by mail, or in person at the Borough Hall finance office, 351 Bridge Street.",
+    ]),
+    ("permits", "Building Permits", ["Do I need a permit to build a deck?", "How long does a building permit take?"], [
+        "A building permit is required for decks more than 30 inches above grade, additions, and structural renovations.",
+        "Building permit applications are reviewed within 15 business days. Incomplete applications are returned to the applicant.",
+        "Permit fees are based on construction cost: $50 for the first $1,000 and $12 for each additional $1,000.",
+    ]),
+    ("parking", "Parking Regulations", ["Where can I park overnight?", "How do I get a residential parking permit?"], [
+        "Overnight parking on Bridge Street is prohibited between 2 a.m. and 6 a.m. for street sweeping.",
+        "Residential parking permits cost $25 per year and are issued by the Parking Authority with proof of residency.",
+    ]),
+    ("council", "Borough Council Meetings", ["When does borough council meet?", "How can I speak at a council meeting?"], [
+        "Borough Council meets on the second Tuesday of each month at 7 p.m. in Council Chambers at Borough Hall.",
+        "Residents may comment during the public comment period. Sign in before the meeting begins; comments are limited to five minutes.",
+    ]),
+    ("snow", "Snow Removal", ["How soon must I shovel my sidewalk?", "Where do I move my car during a snow emergency?"], [
+        "Property owners must clear sidewalks within 24 hours after snowfall ends. Violations carry a $100 fine.",
+        "During a declared snow emergency, vehicles must be moved off designated snow emergency routes, including Main Street and Gay Street.",
+    ]),
+    ("parks", "Parks and Recreation", ["How do I reserve a pavilion at Reeves Park?", "When is the pool open?"], [
+        "Pavilions at Reeves Park can be reserved through the Parks and Recreation office. Residents pay $40 per day, non-residents $80.",
+        "The community pool is open from Memorial Day to Labor Day, noon to 7 p.m. daily. Season passes are sold in May.",
+    ]),
+    ("taxes", "Property Taxes", ["When are property taxes due?", "Is there a discount for paying taxes early?"], [
+        "Borough real estate tax bills are mailed in March. Paying by April 30 earns a 2% discount; the face amount is due by June 30.",
+        "After June 30 a 10% penalty is added. Delinquent taxes are turned over to the county tax claim bureau in January.",
+    ]),
+    ("mayor", "Office of the Mayor", ["Who is the mayor of Phoenixville?", "How do I contact the mayor?"], [
+        "The current Mayor of Phoenixville is Peter Urscheler, who has been serving since January 2, 2018.",
+        "The Mayor's office is located at Borough Hall, 351 Bridge Street. Call (610) 933-8801 to reach the office.",
+    ]),
+    ("zoning", "Zoning and Land Use", ["What can I build in a residential zone?", "How do I apply for a zoning variance?"], [
+        "Residential districts permit single-family and two-family dwellings. Accessory structures must be at least 5 feet from property lines.",
+        "Zoning variance applications go to the Zoning Hearing Board, which meets monthly. The application fee is $750.",
+    ]),
+]
+
+_FILLER = [
+    "The Borough of Phoenixville adopted this section as part of its codified ordinances.",
+    "Questions about this chapter may be directed to the Borough Manager's office during business hours.",
+    "Amendments to this section take effect upon publication as required by the Borough Code.",
+    "Definitions used in this chapter are found in Chapter 1, General Provisions.",
+    "The Borough reserves the right to update fees by resolution of Council.",
+    "Records related to this section are retained in accordance with the municipal records manual.",
+]
+
+
+def sample_corpus(num_chunks: int = 2000, seed: int = 0) -> List[Dict[str, Any]]:
+    """
+    Answer passages for SAMPLE_TOPICS plus topical distractor chunks, as
+    {"id", "text", "metadata"} records. Distractors mention the topic title
+    but not the facts, so retrieval has to rank the answers above them.
+    """
+    rng = random.Random(seed)
+    records = []
+    for topic, title, _, passages in SAMPLE_TOPICS:
+        for n, passage in enumerate(passages):
+            records.append(_record(f"{topic}-answer-{n}", f"{title}. {passage}", title, topic))
+    n = 0
+    while len(records) < num_chunks:
+        topic, title, _, _ = SAMPLE_TOPICS[n % len(SAMPLE_TOPICS)]
+        text = f"{title}, section {n}. " + " ".join(rng.sample(_FILLER, 3))
+        records.append(_record(f"{topic}-filler-{n}", text, title, topic))
+        n += 1
+    return records
+
+
+def _record(chunk_id: str, text: str, title: str, topic: str) -> Dict[str, Any]:
+    return {
+        "id": chunk_id,
+        "text": text,
+        "metadata": {
+            "text": text,
+            "source": f"{topic}.txt",
+            "source_title": title,
+            "source_url": f"https://www.phoenixville.org/DocumentCenter/{topic}",
+            "topic": topic,
+        },
+    }
+
+
+# Document types the ingest accepts, and the LangChain loader for each; PDFs
+# need PyMuPDF (requirements.txt)
+CORPUS_LOADERS = {".pdf": "PyMuPDFLoader", ".txt": "TextLoader", ".md": "TextLoader"}
+CORPUS_CHUNK_SIZE = int(os.environ.get("CHUNK_SIZE", 500))
+CORPUS_CHUNK_OVERLAP = int(os.environ.get("CHUNK_OVERLAP", 50))
+
+
+def load_corpus(directory: str, chunk_size: int = CORPUS_CHUNK_SIZE, chunk_overlap: int = CORPUS_CHUNK_OVERLAP) -> List[Dict[str, Any]]:
+    """
+    Load and split the documents under `directory` into corpus records.
+
+    Documents go through the same LangChain loaders and recursive splitter
+    as ingest, and each chunk's id is ingest_jobs.vector_id(), so results
+    line up with the vector ids production upserts. Pass `directory` the way
+    ingest sees it (e.g. "source_documents"), since the id includes the
+    source path.
+    """
+    from langchain import document_loaders
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+    from ingest_jobs import vector_id
+
+    splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    records = []
+    for root, _, files in os.walk(directory):
+        for name in sorted(files):
+            loader = CORPUS_LOADERS.get(os.path.splitext(name)[1].lower())
+            if loader is None:
+                continue
+            path = os.path.join(root, name)
+            documents = getattr(document_loaders, loader)(path).load()
+            for chunk in splitter.split_documents(documents):
+                metadata = {**chunk.metadata, "text": chunk.page_content, "source_title": name, "topic": os.path.splitext(name)[0]}
+                records.append({"id": vector_id(chunk), "text": chunk.page_content, "metadata": metadata})
+    return records
+
+
+def sample_questions() -> List[Dict[str, Any]]:
+    """Labelled questions for SAMPLE_TOPICS: {"query", "topic", "relevant": [chunk ids]}."""
+    return [
+        {"query": question, "topic": topic, "relevant": [f"{topic}-answer-{n}" for n in range(len(passages))]}
+        for topic, _, questions, passages in SAMPLE_TOPICS
+        for question in questions
+    ]
+
+
+def build_index(records: List[Dict[str, Any]], embedder, query_latency: float = 0.0, namespace: Optional[str] = None,
+                batch_size: int = 256) -> LocalIndex:
+    """Embed `records` with `embedder` and load them into a new LocalIndex."""
+    index = None
+    for start in range(0, len(records), batch_size):
+        batch = records[start:start + batch_size]
+        vectors = embedder.embed_documents([r["text"] for r in batch])
+        if index is None:
+            index = LocalIndex(len(vectors[0]), query_latency)
+        index.upsert([{"id": r["id"], "values": v, "metadata": r["metadata"]} for r, v in zip(batch, vectors)], namespace=namespace)
+    return index or LocalIndex(getattr(embedder, "dim", 0), query_latency)
+
+
+# Example usage: retrieval over the sample corpus and a streamed stub completion
+if __name__ == "__main__":
+    embedder = HashEmbedder(dim=384)
+    start = time.perf_counter()
+    index = build_index(sample_corpus(5000), embedder)
+    print(f"indexed {index.describe_index_stats().total_vector_count} chunks in {time.perf_counter() - start:.2f}s")
+
+    hits = 0
+    questions = sample_questions()
+    start = time.perf_counter()
+    for question in questions:
+        matches = index.query(vector=embedder.embed_query(question["query"]), top_k=5, include_metadata=True).matches
+        hits += any(m.id in question["relevant"] for m in matches)
+    print(f"{hits}/{len(questions)} questions have a relevant chunk in the top 5 "
+          f"({(time.perf_counter() - start) / len(questions) * 1000:.2f} ms per query)")
+
+    client = StubOpenAI(embedder, tokens_per_second=100, ttft=0.1, answer_tokens=20)
+    start = time.perf_counter()
+    first = None
+    for chunk in client.chat.completions.create(model="gpt-4", messages=[{"role": "user", "content": "When is trash picked up?"}], stream=True):
+        first = first or time.perf_counter() - start
+    print(f"stub completion: first token {first * 1000:.0f} ms, last token {(time.perf_counter() - start) * 1000:.0f} ms")
+
+    import requests
+    with StubOllamaServer(tokens_per_second=100, ttft=0.1, answer_tokens=20) as server:
+        response = requests.post(f"{server.url}/api/generate", json={"model": "mistral", "prompt": "Who is the mayor?"}, stream=True)
+        lines = [json.loads(line) for line in response.iter_lines() if line]
+        print(f"stub ollama: {len(lines)} lines, done={lines[-1]['done']}")
@@ -0,0 +1,245 @@
+import csv
+import io
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Fraction of per-match debug lines that are actually emitted
+MATCH_LOG_SAMPLE_RATE = float(os.environ.get("LOG_MATCH_SAMPLE_RATE", 0.01))
+
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+_listener = None
+
+
+def setup_logging(log_file: Optional[str] = "app.log", level: int = logging.INFO) -> logging.handlers.QueueListener:
+    """
+    Route all logging through a queue so request handlers never block on I/O.
+
+    The root logger gets a single QueueHandler; a background QueueListener
+    writes to stdout and a size-rotated log file. Any handlers installed
+    earlier by logging.basicConfig are replaced.
+    """
+    global _listener
+    if _listener is not None:
+        return _listener
+
+    formatter = logging.Formatter(LOG_FORMAT)
+    handlers = [logging.StreamHandler(sys.stdout)]
+    if log_file:
+        handlers.append(logging.handlers.RotatingFileHandler(
+            log_file,
+            maxBytes=int(os.environ.get("LOG_MAX_BYTES", 10 * 1024 * 1024)),
+            backupCount=int(os.environ.get("LOG_BACKUP_COUNT", 5))
+        ))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+    root.setLevel(level)
+
+    _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    return _listener
+
+
+def stop_logging():
+    """Flush queued log records and stop the background listener."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def sampled(rate: float = MATCH_LOG_SAMPLE_RATE) -> bool:
+    """Return True for roughly `rate` of calls; used to thin out hot-path debug logs."""
+    return rate >= 1.0 or (rate > 0 and random.random() < rate)
+
+
+class BatchedRecordWriter:
+    """
+    Append-only CSV/JSONL writer that batches rows on a background thread.
+
+    write() only enqueues the row. The writer thread appends everything that
+    has queued up every `flush_interval` seconds (or as soon as `batch_size`
+    rows are waiting), fsyncs at most every `fsync_interval` seconds and
+    rotates the file once it exceeds `max_bytes`.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        fieldnames: Optional[List[str]] = None,
+        fmt: str = "csv",
+        batch_size: int = 500,
+        flush_interval: float = 1.0,
+        fsync_interval: float = 5.0,
+        max_bytes: int = 50 * 1024 * 1024,
+        backup_count: int = 5
+    ):
+        if fmt not in ("csv", "jsonl"):
+            raise ValueError(f"Unsupported chat log format: {fmt}")
+        if fmt == "csv" and not fieldnames:
+            raise ValueError("fieldnames are required for CSV output")
+
+        self.path = path
+        self.fieldnames = fieldnames
+        self.fmt = fmt
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.fsync_interval = fsync_interval
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+
+        self._queue = queue.SimpleQueue()
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._last_fsync = time.monotonic()
+        self.rows_written = 0
+        self.batches_written = 0
+
+        self._thread = threading.Thread(target=self._run, name="chat-log-writer", daemon=True)
+        self._thread.start()
+
+    def write(self, row: Dict[str, Any]):
+        """Queue a row for writing; never blocks on disk."""
+        self._queue.put(row)
+        if self._queue.qsize() >= self.batch_size:
+            self._wake.set()
+
+    def close(self):
+        """Write any queued rows, fsync and stop the writer thread."""
+        self._stopped.set()
+        self._wake.set()
+        self._thread.join(timeout=10)
+
+    def _drain(self) -> List[Dict[str, Any]]:
+        rows = []
+        while True:
+            try:
+                rows.append(self._queue.get_nowait())
+            except queue.Empty:
+                return rows
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self._flush(self._drain())
+        self._flush(self._drain(), force_fsync=True)
+
+    def _encode(self, rows: List[Dict[str, Any]], write_header: bool) -> str:
+        buffer = io.StringIO()
+        if self.fmt == "csv":
+            writer = csv.DictWriter(buffer, fieldnames=self.fieldnames, extrasaction="ignore")
+            if write_header:
+                writer.writeheader()
+            writer.writerows(rows)
+        else:
+            for row in rows:
+                buffer.write(json.dumps(row, default=str))
+                buffer.write("\n")
+        return buffer.getvalue()
+
+    def _rotate(self):
+        for i in range(self.backup_count - 1, 0, -1):
+            source = f"{self.path}.{i}"
+            if os.path.exists(source):
+                os.replace(source, f"{self.path}.{i + 1}")
+        os.replace(self.path, f"{self.path}.1")
+
+    def _flush(self, rows: List[Dict[str, Any]], force_fsync: bool = False):
+        if not rows:
+            return
+        try:
+            if self.max_bytes and os.path.exists(self.path) and os.path.getsize(self.path) >= self.max_bytes:
+                self._rotate()
+
+            write_header = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+            data = self._encode(rows, write_header)
+            with open(self.path, mode="a", newline="") as file:
+                file.write(data)
+                file.flush()
+                now = time.monotonic()
+                if force_fsync or now - self._last_fsync >= self.fsync_interval:
+                    os.fsync(file.fileno())
+                    self._last_fsync = now
+
+            self.rows_written += len(rows)
+            self.batches_written += 1
+        except Exception as e:
+            logger.error(f"Error writing {len(rows)} rows to {self.path}: {e}")
+
+
+# Example usage: measure the latency logging adds to a request handler
+if __name__ == "__main__":
+    import tempfile
+
+    iterations = 2000
+    workdir = tempfile.mkdtemp()
+    devnull = open(os.devnull, "w")
+
+    def time_calls(fn) -> float:
+        start = time.perf_counter()
+        for i in range(iterations):
+            fn(i)
+        return (time.perf_counter() - start) / iterations * 1e6
+
+    # Before: synchronous stdout + FileHandler, CSV opened and appended per call
+    sync_logger = logging.getLogger("bench.sync")
+    sync_logger.propagate = False
+    sync_logger.setLevel(logging.INFO)
+    sync_logger.addHandler(logging.StreamHandler(devnull))
+    sync_logger.addHandler(logging.FileHandler(os.path.join(workdir, "sync.log")))
+
+    sync_csv = os.path.join(workdir, "sync_chat_logs.csv")
+
+    def sync_request(i):
+        sync_logger.info(f"Logging interaction: {i}")
+        file_exists = os.path.isfile(sync_csv)
+        with open(sync_csv, mode="a", newline="") as file:
+            writer = csv.DictWriter(file, fieldnames=["timestamp", "type", "message", "user_id"])
+            if not file_exists:
+                writer.writeheader()
+            writer.writerow({"timestamp": time.time(), "type": "user", "message": f"question {i}", "user_id": "anonymous"})
+
+    # After: queue handler + batched CSV writer
+    log_queue = queue.SimpleQueue()
+    async_logger = logging.getLogger("bench.async")
+    async_logger.propagate = False
+    async_logger.setLevel(logging.INFO)
+    async_logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    listener = logging.handlers.QueueListener(
+        log_queue, logging.StreamHandler(devnull), logging.FileHandler(os.path.join(workdir, "async.log"))
+    )
+    listener.start()
+    chat_writer = BatchedRecordWriter(
+        os.path.join(workdir, "async_chat_logs.csv"),
+        fieldnames=["timestamp", "type", "message", "user_id"]
+    )
+
+    def async_request(i):
+        async_logger.info(f"Logging interaction: {i}")
+        chat_writer.write({"timestamp": time.time(), "type": "user", "message": f"question {i}", "user_id": "anonymous"})
+
+    before = time_calls(sync_request)
+    after = time_calls(async_request)
+    listener.stop()
+    chat_writer.close()
+
+    print(f"Synchronous logging:  {before:8.1f} us per request")
+    print(f"Queued logging:       {after:8.1f} us per request")
+    print(f"Chat rows written: {chat_writer.rows_written} in {chat_writer.batches_written} batches")
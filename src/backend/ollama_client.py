@@ -0,0 +1,283 @@
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from langchain.llms import Ollama
+from langchain.llms.ollama import _stream_response_to_generation_chunk
+from langchain.callbacks.manager import CallbackManagerForLLMRun
+from langchain.schema.output import GenerationChunk
+
+logger = logging.getLogger(__name__)
+
+OLLAMA_BASE_URL = os.environ.get("OLLAMA_BASE_URL", "http://localhost:11434")
+# Match the server's OLLAMA_NUM_PARALLEL; extra generations queue here instead of thrashing the CPU
+OLLAMA_MAX_CONCURRENCY = int(os.environ.get("OLLAMA_MAX_CONCURRENCY", os.environ.get("OLLAMA_NUM_PARALLEL", 1)))
+# How long a generation may wait for a free slot before giving up
+OLLAMA_QUEUE_TIMEOUT = float(os.environ.get("OLLAMA_QUEUE_TIMEOUT", 30.0))
+# How long the server keeps the model loaded after a request
+OLLAMA_KEEP_ALIVE = os.environ.get("OLLAMA_KEEP_ALIVE", "30m")
+
+
+class OllamaOverloadedError(RuntimeError):
+    """No generation slot became free before the request's deadline."""
+
+
+class GenerationCancelled(RuntimeError):
+    """Raised from a streaming callback to stop a generation and free its slot."""
+
+
+class OllamaClient:
+    """
+    Shared HTTP client for a local Ollama server.
+
+    Keeps a persistent connection pool and allows at most `max_concurrency`
+    generations in flight; callers beyond that wait in line until a slot is
+    free or their deadline passes.
+    """
+
+    def __init__(
+        self,
+        base_url: str = OLLAMA_BASE_URL,
+        max_concurrency: int = OLLAMA_MAX_CONCURRENCY,
+        queue_timeout: float = OLLAMA_QUEUE_TIMEOUT,
+        keep_alive: Optional[str] = OLLAMA_KEEP_ALIVE,
+        request_timeout: float = 300.0
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.max_concurrency = max_concurrency
+        self.queue_timeout = queue_timeout
+        self.keep_alive = keep_alive
+        self.request_timeout = request_timeout
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(max_concurrency, 1) * 2)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.waiting = 0
+        self.completed = 0
+        self.rejected = 0
+        self.total_wait = 0.0
+
+    @contextmanager
+    def stream(self, payload: Dict[str, Any], deadline: Optional[float] = None) -> Iterator[Iterator[str]]:
+        """
+        POST /api/generate and provide an iterator over the streamed JSON lines.
+
+        `deadline` is a time.monotonic() value; by default the request may wait
+        `queue_timeout` seconds for a slot. The slot and the connection are
+        released when the with block exits, however it exits.
+        """
+        if deadline is None:
+            deadline = time.monotonic() + self.queue_timeout
+        if self.keep_alive is not None:
+            payload = {**payload, "keep_alive": self.keep_alive}
+
+        with self._lock:
+            self.waiting += 1
+        start = time.monotonic()
+        acquired = self._slots.acquire(timeout=max(deadline - start, 0))
+        waited = time.monotonic() - start
+        with self._lock:
+            self.waiting -= 1
+            if acquired:
+                self.in_flight += 1
+                self.total_wait += waited
+            else:
+                self.rejected += 1
+        if not acquired:
+            logger.warning(f"Rejected Ollama generation after waiting {waited:.1f}s for a slot")
+            raise OllamaOverloadedError(f"No Ollama slot free after {waited:.1f}s ({self.max_concurrency} in flight)")
+
+        response = None
+        try:
+            response = self.session.post(
+                f"{self.base_url}/api/generate",
+                json=payload,
+                stream=True,
+                timeout=self.request_timeout
+            )
+            response.encoding = "utf-8"
+            if response.status_code != 200:
+                raise ValueError(
+                    f"Ollama call failed with status code {response.status_code}."
+                    f" Details: {response.json().get('error')}"
+                )
+            yield response.iter_lines(decode_unicode=True)
+        finally:
+            if response is not None:
+                response.close()
+            self._slots.release()
+            with self._lock:
+                self.in_flight -= 1
+                self.completed += 1
+
+    def generate_stream(self, payload: Dict[str, Any], deadline: Optional[float] = None) -> Iterator[str]:
+        """Generator form of stream(); the slot is held until it is exhausted or closed."""
+        with self.stream(payload, deadline) as lines:
+            yield from lines
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            admitted = self.completed + self.in_flight
+            return {
+                "max_concurrency": self.max_concurrency,
+                "in_flight": self.in_flight,
+                "waiting": self.waiting,
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "avg_wait_ms": round(self.total_wait / admitted * 1000, 1) if admitted else 0.0,
+            }
+
+
+_client = None
+_clients: Dict[str, OllamaClient] = {}
+_client_lock = threading.Lock()
+
+
+def get_ollama_client(base_url: Optional[str] = None) -> OllamaClient:
+    """
+    The process-wide Ollama client, created on first use. Servers other than
+    the default one get their own client (and concurrency limit) per base URL.
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = OllamaClient()
+    if base_url is None or base_url.rstrip("/") == _client.base_url:
+        return _client
+    base_url = base_url.rstrip("/")
+    with _client_lock:
+        client = _clients.get(base_url)
+        if client is None:
+            client = _clients[base_url] = OllamaClient(base_url=base_url)
+    return client
+
+
+class PooledOllama(Ollama):
+    """
+    LangChain Ollama LLM that sends requests through the shared OllamaClient.
+
+    `base_url` defaults to the shared client's server (OLLAMA_BASE_URL). The
+    generation slot is released as soon as streaming stops, including when a
+    callback raises (e.g. GenerationCancelled after the client went away).
+    """
+
+    base_url: Optional[str] = None
+
+    def _open_stream(self, prompt: str, stop: Optional[List[str]] = None, **kwargs: Any):
+        if self.stop is not None and stop is not None:
+            raise ValueError("`stop` found in both the input and default params.")
+        elif self.stop is not None:
+            stop = self.stop
+        elif stop is None:
+            stop = []
+        params = {**self._default_params, "stop": stop, **kwargs}
+        return get_ollama_client(self.base_url).stream({"prompt": prompt, **params})
+
+    def _create_stream(self, prompt: str, stop: Optional[List[str]] = None, **kwargs: Any) -> Iterator[str]:
+        with self._open_stream(prompt, stop, **kwargs) as lines:
+            yield from lines
+
+    def _stream_with_aggregation(
+        self,
+        prompt: str,
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        verbose: bool = False,
+        **kwargs: Any
+    ) -> GenerationChunk:
+        final_chunk = None
+        with self._open_stream(prompt, stop, **kwargs) as lines:
+            for line in lines:
+                if not line:
+                    continue
+                chunk = _stream_response_to_generation_chunk(line)
+                final_chunk = chunk if final_chunk is None else final_chunk + chunk
+                if run_manager:
+                    run_manager.on_llm_new_token(chunk.text, verbose=verbose)
+        if final_chunk is None:
+            raise ValueError("No data received from Ollama stream.")
+        return final_chunk
+
+    def _stream(
+        self,
+        prompt: str,
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any
+    ) -> Iterator[GenerationChunk]:
+        with self._open_stream(prompt, stop, **kwargs) as lines:
+            for line in lines:
+                if not line:
+                    continue
+                chunk = _stream_response_to_generation_chunk(line)
+                yield chunk
+                if run_manager:
+                    run_manager.on_llm_new_token(chunk.text, verbose=self.verbose)
+
+
+# Example usage: concurrency limiting, connection reuse and deadlines against a local stub server
+if __name__ == "__main__":
+    import json
+    from concurrent.futures import ThreadPoolExecutor
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    server_state = {"active": 0, "max_active": 0, "connections": set(), "keep_alive": set()}
+    state_lock = threading.Lock()
+
+    class StubOllama(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def do_POST(self):
+            payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            with state_lock:
+                server_state["active"] += 1
+                server_state["max_active"] = max(server_state["max_active"], server_state["active"])
+                server_state["connections"].add(self.client_address)
+                server_state["keep_alive"].add(payload.get("keep_alive"))
+            body = b"".join(
+                json.dumps({"response": f"token{i} ", "done": i == 4}).encode() + b"\n" for i in range(5)
+            )
+            time.sleep(0.2)  # prompt evaluation + generation
+            with state_lock:
+                server_state["active"] -= 1
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubOllama)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    _client = OllamaClient(base_url=f"http://127.0.0.1:{server.server_port}", max_concurrency=2, queue_timeout=1.0)
+    llm = PooledOllama(model="mistral")
+
+    def ask(i):
+        try:
+            return llm(f"question {i}")
+        except OllamaOverloadedError:
+            return None
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        answers = list(pool.map(ask, range(16)))
+    elapsed = time.perf_counter() - start
+
+    print(f"16 requests in {elapsed:.2f}s: {sum(a is not None for a in answers)} answered, {answers.count(None)} rejected at the deadline")
+    print(f"max concurrent at server: {server_state['max_active']}, client connections used: {len(server_state['connections'])}, keep_alive sent: {server_state['keep_alive']}")
+    print(_client.stats())
+    server.shutdown()
@@ -1,37 +1,76 @@
 #!/usr/bin/env python3
 from contextlib import asynccontextmanager
-from fastapi import FastAPI, HTTPException, Body, UploadFile, File
+from fastapi import FastAPI, HTTPException, Body, UploadFile, File, Request, Depends
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse, Response
+from fastapi.responses import FileResponse, Response, JSONResponse, PlainTextResponse
 from pydantic import BaseModel
 import uvicorn
 import os
 import sys
-import shutil
 import random
 import logging
 from datetime import datetime
 from typing import List, Optional
 import pinecone
-from PIL import Image, ImageDraw
-import io
 
 from starlette.responses import StreamingResponse
 import json
 import asyncio
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler(sys.stdout),
-        logging.FileHandler('app.log')
-    ]
-)
+from warmup import WarmupState, run_warmup
+from tracing import tracer, TracingMiddleware
+from profiling import allocation_profiler, require_admin, sampling_profiler
+from log_pipeline import setup_logging, stop_logging, BatchedRecordWriter
+from chat_analytics import ChatAnalyticsSink
+from query_utils import normalize_query
+from request_coalescing import StreamCoalescer, coalescing_key, render_coalescing_metrics
+from status_snapshot import StatusRefresher
+from upload_store import IngestManifest, UploadSizeLimitMiddleware, save_uploads
+from ingest_jobs import JobStore, JobWatcher, WorkerPool
+from index_generations import GENERATIONS_INDEX_NAME, IndexGenerations
+from ollama_client import GenerationCancelled, get_ollama_client
+from query_planner import queued_branches
+from geo import MAP_LAYERS, detect_layer, load_geo_index, parse_bbox
+from placeholder_images import PlaceholderCache, PLACEHOLDER_CACHE_CONTROL, etag_matches, validate_dimensions
+
+# Logging is queued (stdout and a rotating app.log are written in the background)
+# and set up in lifespan, like the chat log writers below
 logger = logging.getLogger(__name__)
 
+# Chat interaction log, appended in batches off the request path
+CHAT_LOG_FIELDS = ['timestamp', 'type', 'message', 'user_id']
+CHAT_LOG_FORMAT = os.environ.get("CHAT_LOG_FORMAT", "csv")
+
+# The chat log writer and the columnar, day-partitioned analytics copy for the
+# admin dashboard start threads and open files, so they are created in lifespan
+chat_log_writer = None
+chat_analytics = None
+
+def open_chat_logs():
+    """Start the chat log writer and the analytics sink."""
+    global chat_log_writer, chat_analytics
+    chat_log_writer = BatchedRecordWriter(
+        os.environ.get("CHAT_LOG_FILE", "chat_logs.csv" if CHAT_LOG_FORMAT == "csv" else "chat_logs.jsonl"),
+        fieldnames=CHAT_LOG_FIELDS,
+        fmt=CHAT_LOG_FORMAT,
+        fsync_interval=float(os.environ.get("CHAT_LOG_FSYNC_INTERVAL", 5.0))
+    )
+    chat_analytics = ChatAnalyticsSink(
+        os.environ.get("ANALYTICS_DIR", "analytics"),
+        fmt=os.environ.get("ANALYTICS_FORMAT", "parquet")
+    )
+
+def close_chat_logs():
+    """Flush and close the chat log writer and the analytics sink."""
+    global chat_log_writer, chat_analytics
+    if chat_log_writer is not None:
+        chat_log_writer.close()
+        chat_log_writer = None
+    if chat_analytics is not None:
+        chat_analytics.close()
+        chat_analytics = None
+
 # Models
 class QueryRequest(BaseModel):
     query: str
@@ -52,9 +91,19 @@ class PaymentRequest(BaseModel):
     payment_method: str
     email: str
 
-class IngestResponse(BaseModel):
+class JobResponse(BaseModel):
+    id: str
+    kind: str
     status: str
-    documents_processed: int
+    checkpoint: int
+    progress: Optional[dict] = None
+    result: Optional[dict] = None
+    error: Optional[str] = None
+    attempts: int
+    cancel_requested: bool
+    created_at: float
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
 
 # Constants
 MAP_KEYWORDS = [
@@ -64,6 +113,32 @@ MAP_KEYWORDS = [
     "permit status"
 ]
 
+PAYMENT_KEYWORDS = [
+    "pay water bill", "water bill payment", "pay my water",
+    "how do i pay my water", "pay utility bill", "water payment"
+]
+
+QUERY_ERROR_RESPONSE = {
+    "result": "I can only answer questions about Phoenixville Borough services and resources. Please try a different question related to municipal services.",
+    "processing_time": 0,
+    "source_documents": []
+}
+
+# In-flight /query-stream generations, shared by identical concurrent questions
+stream_coalescer = StreamCoalescer("query_stream")
+stream_tasks = set()
+
+# Uploaded documents and their content hashes, used to skip duplicate uploads
+SOURCE_DIRECTORY = os.environ.get('SOURCE_DIRECTORY', 'source_documents')
+upload_manifest = IngestManifest(SOURCE_DIRECTORY)
+
+# Encoded placeholder PNGs by size; the frontend asks for the same few sizes over and over
+placeholder_cache = PlaceholderCache()
+
+# Limits for /query-batch
+MAX_BATCH_SIZE = int(os.environ.get("MAX_BATCH_SIZE", 500))
+BATCH_CONCURRENCY = int(os.environ.get("BATCH_CONCURRENCY", 4))
+
 FORM_KEYWORDS = [
     "permit", "application", "form", "apply for", "how do i get a", 
     "need a permit", "building permit", "construction permit", 
@@ -81,21 +156,37 @@ FORM_MAPPINGS = {
     # ... other form mappings
 }
 
-LOCATION_MAPPINGS = {
-    # Location mappings as defined in your original file
-    "borough hall": {"lat": 40.1308, "lng": -75.5146, "zoom": 18, "layer": "locations"},
-    # ... other location mappings
+# Form portal replies, built once per form
+FORM_PORTALS = {
+    details["form_id"]: f"<form_portal>Here's the {details['title']} you requested. You can fill it out directly or download it for submission to the Borough offices.|{details['form_id']}|{details['title']}</form_portal>"
+    for details in FORM_MAPPINGS.values()
 }
 
+# Borough locations and map layers (zoning, utilities, permits), indexed once for map replies and /api/geo
+geo_index = load_geo_index()
+
+MAP_MESSAGES = {
+    "zoning": "Here's the zoning map for Phoenixville Borough. The colored areas represent different zoning districts.",
+    "utilities": "Here's the utility service map for Phoenixville Borough. The shaded areas show water and sewer service coverage.",
+    "permits": "Here's a map showing recent permits issued in Phoenixville Borough. Click on the markers for details about each permit.",
+    "locations": "Here's an interactive map of Phoenixville Borough. You can toggle between different map layers using the controls below the map.",
+}
+
+# Warm-up progress, reported on /status
+warmup_state = WarmupState()
+
 # Load Pinecone configuration
 pinecone_api_key = os.environ.get('PINECONE_API_KEY', 'pcsk_1MfLA_QRmNnRSR4pumc7thAYp6eqHkxGF3Jhmbs9X66SN2i1Rr4akBzmERV5NCjyBhE8e')
 pinecone_environment = os.environ.get('PINECONE_ENVIRONMENT', 'us-east-1')
-index_name = os.environ.get('PINECONE_INDEX_NAME', 'open-ai-database')
+# Same index (and generation pointer file) as the query path and the ingest job
+index_name = GENERATIONS_INDEX_NAME
 
 # Import your privateGPT modules
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+# Query pipeline pieces used by jobs, warm-up and /status; None if the import below fails
+create_qa_chain = get_warmup_stages = query_inflight = generation_cache = reranker = None
 try:
-    from pinecone_new_private_gpt import create_qa_chain, process_query
+    from pinecone_new_private_gpt import create_qa_chain, process_query, get_warmup_stages, embed_queries, query_inflight, generation_cache, reranker
     from pinecone_ingest import process_documents, initialize_pinecone, does_index_exist, add_embeddings_to_pinecone
     from langchain.embeddings import HuggingFaceEmbeddings
     # Import our custom embeddings adapter
@@ -125,53 +216,33 @@ def get_form_type(query: str) -> dict:
 
 def generate_form_response(query: str) -> dict:
     form_details = get_form_type(query)
-    
-    # Create contextual message based on the query and form type
-    message = f"Here's the {form_details['title']} you requested. You can fill it out directly or download it for submission to the Borough offices."
-    
-    # Create a form portal tag similar to the payment portal
-    form_portal = f"<form_portal>{message}|{form_details['form_id']}|{form_details['title']}</form_portal>"
-    
-    # Return the response object
     return {
-        "result": form_portal,
+        "result": FORM_PORTALS[form_details["form_id"]],
         "processing_time": 0.1,
         "source_documents": [],
-        "form_data": form_details
+        "form_data": dict(form_details)
     }
 
 def is_map_query(query: str) -> bool:
     query_lower = query.lower()
     return any(keyword in query_lower for keyword in MAP_KEYWORDS)
 
-def get_location_focus(query: str) -> dict:
-    query_lower = query.lower()
-    
-    for location, coords in LOCATION_MAPPINGS.items():
-        if location in query_lower:
-            return coords
-    
-    # Default to center of Phoenixville
-    return {"lat": 40.1308, "lng": -75.5146, "zoom": 14, "layer": "locations"}
-
 def generate_map_response(query: str) -> dict:
-    location_focus = get_location_focus(query)
-    
-    # Create contextual message based on the query and location
-    if "zoning" in query.lower():
-        message = "Here's the zoning map for Phoenixville Borough. The colored areas represent different zoning districts."
-        location_focus["layer"] = "zoning"
-    elif "utility" in query.lower() or "water service" in query.lower() or "sewer" in query.lower():
-        message = "Here's the utility service map for Phoenixville Borough. The shaded areas show water and sewer service coverage."
-        location_focus["layer"] = "utilities"
-    elif "permit" in query.lower():
-        message = "Here's a map showing recent permits issued in Phoenixville Borough. Click on the markers for details about each permit."
-        location_focus["layer"] = "permits"
-    elif any(place in query.lower() for place in ["borough hall", "police", "fire", "library", "reeves park", "black rock"]):
-        place = next((place for place in ["borough hall", "police", "fire", "library", "reeves park", "black rock"] if place in query.lower()), "")
-        message = f"Here's the location of {place.title()} in Phoenixville Borough. You can click on the marker for more details."
+    layer = detect_layer(query)
+    location = geo_index.find_location(query)
+    map_data = geo_index.map_data(layer or "locations", location)
+    
+    # Create contextual message based on the layer and location
+    if layer is None and location is not None:
+        message = f"Here's the location of {location['name']} in Phoenixville Borough. You can click on the marker for more details."
     else:
-        message = "Here's an interactive map of Phoenixville Borough. You can toggle between different map layers using the controls below the map."
+        message = MAP_MESSAGES[layer or "locations"]
+    # Only name a district from real GIS data (GEO_DATA_PATH), never from placeholders
+    if layer == "zoning" and location is not None and geo_index.source is not None:
+        zone = geo_index.zone_at(location["lng"], location["lat"])
+        if zone is not None:
+            message += f" {location['name']} is in the {zone['name']} ({zone['district']}) district."
+            map_data["zone"] = zone
     
     # Create a map portal tag similar to the payment portal
     map_portal = f"<map_portal>{message}</map_portal>"
@@ -181,18 +252,113 @@ def generate_map_response(query: str) -> dict:
         "result": map_portal,
         "processing_time": 0.1,
         "source_documents": [],
-        "map_data": location_focus
+        "map_data": map_data
+    }
+
+def route_special_query(clean_query: str) -> Optional[dict]:
+    """Return the payment, form or map response for a query, or None for a regular query."""
+    # Classify the query before touching the retrieval pipeline
+    with tracer.span("routing"):
+        is_payment = any(keyword in clean_query.lower() for keyword in PAYMENT_KEYWORDS)
+        is_form = not is_payment and is_form_query(clean_query)
+        is_map = not is_payment and not is_form and is_map_query(clean_query)
+    
+    # If the query contains payment keywords, return the payment portal indicator
+    if is_payment:
+        return {
+            "result": "<payment_portal>I can help you pay your water bill right here. Please use the secure payment form below:</payment_portal>",
+            "processing_time": 0.1,
+            "source_documents": []
+        }
+    
+    # Check if this is a form-related query
+    if is_form:
+        return generate_form_response(clean_query)
+    
+    # Check if this is a map-related query
+    if is_map:
+        return generate_map_response(clean_query)
+    
+    return None
+
+def format_query_result(result: dict) -> dict:
+    """Convert a process_query result into the QueryResponse shape."""
+    response = {
+        "result": str(result.get("result", "I don't have that information in my database.")),
+        "processing_time": result.get("processing_time", 0)
+    }
+    
+    # Include source documents if available
+    source_docs = []
+    if "source_documents" in result and result["source_documents"]:
+        for doc in result["source_documents"]:
+            if hasattr(doc, 'page_content') and hasattr(doc, 'metadata'):
+                source_docs.append({
+                    "content": str(doc.page_content),
+                    "source": str(doc.metadata.get("source", "Unknown Source"))
+                })
+        
+    response["source_documents"] = source_docs
+    return response
+
+def collect_index_status() -> dict:
+    """Pinecone index stats and the active generation for /status; polled by status_refresher, never on the request path."""
+    index_generations.active()
+    generation = index_generations.stats()
+    pc = pinecone.Pinecone(api_key=pinecone_api_key)
+    if index_name not in pc.list_indexes().names():
+        return {"database_initialized": False, "index_generation": generation}
+    stats = pc.Index(index_name).describe_index_stats()
+    return {
+        "database_initialized": True,
+        "index_generation": generation,
+        "vector_count": stats.total_vector_count,
+        "dimension": stats.dimension,
+        "index_fullness": stats.index_fullness,
+        "namespaces": list(stats.namespaces.keys()) if hasattr(stats, 'namespaces') else []
     }
 
+# Refreshes the index stats snapshot every STATUS_REFRESH_INTERVAL seconds
+status_refresher = StatusRefresher("pinecone", collect_index_status)
+
+def on_job_finished(job: dict):
+    """Runs in the API process once a worker finishes a job."""
+    if job["kind"] != "ingest" or job["status"] != "succeeded":
+        return
+    logger.info(f"Ingest job {job['id']} finished: {job['result']}")
+    if create_qa_chain is not None:
+        # Reinitialize the QA chain to use the updated vectorstore
+        create_qa_chain()
+    if generation_cache is not None:
+        # Cached answers may be based on replaced chunks
+        generation_cache.invalidate()
+    # Pick up the new vector count and generation without waiting for the next poll
+    status_refresher.refresh()
+
+# Ingest and analysis run in worker processes; progress is kept in sqlite.
+# The store is opened on first use and the workers start in lifespan, so
+# importing this module doesn't create the database or spawn processes.
+index_generations = IndexGenerations(index_name)
+job_store = None
+worker_pool = None
+job_watcher = None
+
+def get_job_store() -> JobStore:
+    global job_store
+    if job_store is None:
+        job_store = JobStore()
+    return job_store
+
 # Application lifespan
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    global worker_pool, job_watcher
     # Startup code
+    setup_logging(os.environ.get("LOG_FILE", "app.log"))
+    open_chat_logs()
     try:
         # Initialize Pinecone
-        pinecone.init(api_key=pinecone_api_key, environment=pinecone_environment)
-
-
+        pc = pinecone.Pinecone(api_key=pinecone_api_key)
         
         # Check if the index exists
         indexes = pc.list_indexes()
@@ -212,15 +378,36 @@ async def lifespan(app: FastAPI):
     except Exception as e:
         logger.error(f"Error during startup: {e}", exc_info=True)
         logger.warning("Application will start, but you may need to create a Pinecone index first")
+    
+    # Exercise embed, retrieve and generate off the event loop; /status
+    # reports not-ready until this completes
+    stages = get_warmup_stages() if get_warmup_stages is not None else {}
+    asyncio.get_running_loop().run_in_executor(None, run_warmup, warmup_state, stages)
+    # Read (or rebuild, hashing every document) the upload manifest before the first upload needs it
+    asyncio.get_running_loop().run_in_executor(None, upload_manifest.load)
+    status_refresher.start()
+    worker_pool = WorkerPool()
+    worker_pool.start()
+    job_watcher = JobWatcher(get_job_store(), on_job_finished)
+    job_watcher.start()
         
     yield
     
     # Shutdown code (if needed)
     logger.info("Shutting down application")
+    status_refresher.stop()
+    job_watcher.stop()
+    worker_pool.stop()
+    close_chat_logs()
+    stop_logging()
 
 # Create the FastAPI app
 app = FastAPI(title="Phoenixville Municipal AI", lifespan=lifespan)
 
+# Cap upload request bodies before Starlette spools them to disk; added first so
+# the 413 still passes through CORS
+app.add_middleware(UploadSizeLimitMiddleware)
+
 # Add CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -230,6 +417,10 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Per-request trace ids and stage timings, exported on /metrics; the profiling
+# windows are long by design and would skew the route histograms
+app.add_middleware(TracingMiddleware, exclude_paths=("/metrics", "/admin/profile/cpu", "/admin/profile/memory"))
+
 # Mount static files
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
@@ -250,23 +441,53 @@ async def root():
 
 
 @app.get("/api/placeholder/{width}/{height}")
-async def placeholder_image(width: int, height: int):
-    """Generate a simple placeholder image with the requested dimensions."""
+async def placeholder_image(width: int, height: int, request: Request):
+    """Serve a gray placeholder PNG of the requested size, cached and ETag'd."""
     try:
-        # Create a simple gray placeholder image with a border
-        img = Image.new('RGB', (width, height), color=(200, 200, 200))
-        draw = ImageDraw.Draw(img)
-        draw.rectangle([(0, 0), (width-1, height-1)], outline=(100, 100, 100))
-        
-        # Convert to bytes
-        img_byte_arr = io.BytesIO()
-        img.save(img_byte_arr, format='PNG')
-        img_byte_arr.seek(0)
-        
-        return Response(content=img_byte_arr.getvalue(), media_type="image/png")
+        validate_dimensions(width, height)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    try:
+        content, etag = await placeholder_cache.aget(width, height)
     except Exception as e:
         logger.error(f"Error generating placeholder image: {e}")
         raise HTTPException(status_code=500, detail=str(e))
+    
+    headers = {"ETag": etag, "Cache-Control": PLACEHOLDER_CACHE_CONTROL}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=content, media_type="image/png", headers=headers)
+
+@app.get("/api/geo/locate")
+async def geo_locate(q: str):
+    """Where is a borough location (by name, alias or street address)."""
+    location = geo_index.find_location(q)
+    if location is None:
+        raise HTTPException(status_code=404, detail="Unknown location")
+    return location
+
+@app.get("/api/geo/zone")
+async def geo_zone(lat: Optional[float] = None, lng: Optional[float] = None, q: Optional[str] = None):
+    """Zoning district of a point, or of a location/address given as `q`."""
+    if q is not None:
+        location = geo_index.find_location(q)
+        if location is None:
+            raise HTTPException(status_code=404, detail="Unknown location")
+        lat, lng = location["lat"], location["lng"]
+    if lat is None or lng is None:
+        raise HTTPException(status_code=400, detail="Pass lat and lng, or q")
+    return {"lat": lat, "lng": lng, "zone": geo_index.zone_at(lng, lat), "utilities": geo_index.features_at("utilities", lng, lat)}
+
+@app.get("/api/geo/layers/{layer}")
+async def geo_layer(layer: str, bbox: Optional[str] = None):
+    """GeoJSON features of a map layer, optionally limited to bbox=min_lng,min_lat,max_lng,max_lat."""
+    if layer not in MAP_LAYERS:
+        raise HTTPException(status_code=404, detail=f"Unknown layer; expected one of {', '.join(MAP_LAYERS)}")
+    try:
+        box = parse_bbox(bbox) if bbox else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return JSONResponse(content=geo_index.features_in_bbox(layer, box), media_type="application/geo+json")
 
 @app.post("/query", response_model=QueryResponse)
 async def query(request: dict = Body(...)):
@@ -284,57 +505,101 @@ async def query(request: dict = Body(...)):
         # Implement streaming logic here if needed
         pass
     
-    # Check if this is a payment-related query
-    payment_keywords = ["pay water bill", "water bill payment", "pay my water", 
-                      "how do i pay my water", "pay utility bill", "water payment"]
+    # Payment, form and map queries are answered without the retrieval pipeline
+    special_response = route_special_query(clean_query)
+    if special_response is not None:
+        return special_response
     
-    # If the query contains payment keywords, return the payment portal indicator
-    if any(keyword in clean_query.lower() for keyword in payment_keywords):
-        return {
-            "result": "<payment_portal>I can help you pay your water bill right here. Please use the secure payment form below:</payment_portal>",
-            "processing_time": 0.1,
-            "source_documents": []
-        }
+    try:
+        # Only use the Pinecone database for responses (in a worker thread so
+        # concurrent requests overlap and identical ones can be coalesced)
+        result = await asyncio.to_thread(process_query, clean_query)
+        return format_query_result(result)
     
-    # Check if this is a form-related query
-    if is_form_query(clean_query):
-        return generate_form_response(clean_query)
+    except Exception as e:
+        logger.error(f"Error in query endpoint: {e}", exc_info=True)
+        return QUERY_ERROR_RESPONSE
+
+@app.post("/query-batch")
+async def query_batch(request: dict = Body(...)):
+    """
+    Answer many queries in one call.
     
-    # Check if this is a map-related query
-    if is_map_query(clean_query):
-        return generate_map_response(clean_query)
+    Accepts {"queries": ["...", ...]}. Identical questions are answered once,
+    all embeddings are computed in a single encode call, vector queries and
+    generation run concurrently, and results stream back as newline-delimited
+    JSON in completion order. Each line is a QueryResponse plus the "index"
+    and "query" of the input it answers.
+    """
+    items = request.get("queries")
+    if not items or not isinstance(items, list):
+        raise HTTPException(status_code=400, detail="queries must be a non-empty list")
+    if len(items) > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_SIZE} queries per batch")
     
-    try:
-        # Only use the Pinecone database for responses
-        result = process_query(clean_query)
+    queries = [str(item.get("query", "") if isinstance(item, dict) else item).strip() for item in items]
+    
+    # Group identical questions (after normalization)
+    groups = {}
+    for i, text in enumerate(queries):
+        if text:
+            groups.setdefault(normalize_query(text), []).append(i)
+    unique = list(groups)
+    logger.info(f"Processing batch of {len(queries)} queries ({len(unique)} unique)")
+    
+    def to_line(i, response):
+        return json.dumps({"index": i, "query": queries[i], **QueryResponse(**response).model_dump()}) + "\n"
+    
+    async def generate():
+        for i, text in enumerate(queries):
+            if not text:
+                yield to_line(i, {"result": "Query cannot be empty", "processing_time": 0, "source_documents": []})
         
-        # Format the response
-        response = {
-            "result": str(result.get("result", "I don't have that information in my database.")),
-            "processing_time": result.get("processing_time", 0)
-        }
+        # Special queries are answered immediately; the rest go through retrieval
+        pending = []
+        for key in unique:
+            text = queries[groups[key][0]]
+            special_response = route_special_query(text)
+            if special_response is not None:
+                for i in groups[key]:
+                    yield to_line(i, special_response)
+            else:
+                pending.append(key)
+        if not pending:
+            return
         
-        # Include source documents if available
-        source_docs = []
-        if "source_documents" in result and result["source_documents"]:
-            for doc in result["source_documents"]:
-                if hasattr(doc, 'page_content') and hasattr(doc, 'metadata'):
-                    source_docs.append({
-                        "content": str(doc.page_content),
-                        "source": str(doc.metadata.get("source", "Unknown Source"))
-                    })
-            
-        response["source_documents"] = source_docs
+        # One encode call for every remaining question
+        texts = [queries[groups[key][0]] for key in pending]
+        try:
+            with tracer.span("embedding"):
+                embeddings = await asyncio.to_thread(embed_queries, texts)
+        except Exception as e:
+            logger.error(f"Error embedding batch: {e}", exc_info=True)
+            embeddings = [None] * len(texts)
+        
+        semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+        
+        async def answer(n):
+            async with semaphore:
+                try:
+                    result = await asyncio.to_thread(process_query, texts[n], embeddings[n])
+                    return n, format_query_result(result)
+                except Exception as e:
+                    logger.error(f"Error in batch query '{texts[n]}': {e}", exc_info=True)
+                    return n, QUERY_ERROR_RESPONSE
         
-        return response
+        tasks = [asyncio.create_task(answer(n)) for n in range(len(pending))]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                n, response = await next_done
+                for i in groups[pending[n]]:
+                    yield to_line(i, response)
+        finally:
+            # Stop outstanding work if the client disconnects
+            for task in tasks:
+                task.cancel()
     
-    except Exception as e:
-        logger.error(f"Error in query endpoint: {e}", exc_info=True)
-        return {
-            "result": "I can only answer questions about Phoenixville Borough services and resources. Please try a different question related to municipal services.",
-            "processing_time": 0,
-            "source_documents": []
-        }
+    return StreamingResponse(generate(), media_type="application/x-ndjson")
 
 @app.post("/query-stream")
 async def query_stream(request: dict = Body(...)):
@@ -426,57 +691,71 @@ async def stream_llm_response(query):
             yield json.dumps({"token": fallback_response, "done": True})
             return
         
-        # Custom streaming callback handler
+        # Streaming callback handler that publishes every token to all
+        # subscribers of the shared stream as soon as it is generated
+        class PublishedTokens(list):
+            def __init__(self, broadcast):
+                super().__init__()
+                self.broadcast = broadcast
+            
+            def append(self, token):
+                # process_query_streaming also appends corrections and errors directly
+                super().append(token)
+                self.broadcast.publish(json.dumps({"token": token, "done": False}))
+        
         class StreamingHandler(BaseCallbackHandler):
-            def __init__(self):
-                self.tokens = []
-                self.total_tokens = 0
+            # Let GenerationCancelled reach the LLM so it closes the stream
+            raise_error = True
+            
+            def __init__(self, broadcast):
+                self.broadcast = broadcast
+                self.tokens = PublishedTokens(broadcast)
                 
             def on_llm_new_token(self, token, **kwargs):
-                # Add the token to our collection
-                response_json = json.dumps({"token": token, "done": False})
-                self.tokens.append(response_json)
-                self.total_tokens += 1
-
-            async def get_tokens(self):
-                if not self.tokens:
-                    # Return a fallback message if no tokens were generated
-                    yield json.dumps({
-                        "token": "I don't have specific information about that in my database. Please contact Borough Hall directly for the most accurate information.", 
-                        "done": True
-                    })
-                    return
-                    
-                for token in self.tokens:
-                    yield token
-                    # Small delay to simulate typing
-                    await asyncio.sleep(0.01)
-                # Send the done signal
-                yield json.dumps({"token": "", "done": True})
-
+                # Stop generating, and free the Ollama slot, once every client has disconnected
+                if self.broadcast.abandoned:
+                    raise GenerationCancelled("all clients disconnected")
+                self.tokens.append(token)
         
-        # Initialize the streaming handler
-        streaming_handler = StreamingHandler()
+        # Identical questions asked while a stream is in flight attach to it
+        key = coalescing_key(query)
+        broadcast, is_leader = stream_coalescer.join(key)
         
-        # Process the query with streaming enabled
-        try:
-            # This part will depend on your process_query implementation
-            # You'll need to modify it to use the streaming handler
-            from pinecone_new_private_gpt import process_query_streaming
-            
-            # Call the streaming version of process_query
-            result = await process_query_streaming(query, callback_handler=streaming_handler)
-            
-            # Log info about tokens
-            logger.info(f"Generated {streaming_handler.total_tokens} tokens for query: '{query}'")
+        if is_leader:
+            async def produce():
+                streaming_handler = StreamingHandler(broadcast)
+                try:
+                    from pinecone_new_private_gpt import process_query_streaming
+                    
+                    # process_query_streaming blocks on the LLM, so run it off the event loop
+                    await asyncio.to_thread(asyncio.run, process_query_streaming(query, callback_handler=streaming_handler))
+                    
+                    # Log info about tokens
+                    logger.info(f"Generated {len(streaming_handler.tokens)} tokens for query: '{query}'")
+                    
+                    if not streaming_handler.tokens:
+                        # Return a fallback message if no tokens were generated
+                        broadcast.publish(json.dumps({
+                            "token": "I don't have specific information about that in my database. Please contact Borough Hall directly for the most accurate information.", 
+                            "done": True
+                        }))
+                    else:
+                        # Send the done signal
+                        broadcast.publish(json.dumps({"token": "", "done": True}))
+                except Exception as e:
+                    logger.error(f"Error in streaming LLM response: {e}", exc_info=True)
+                    broadcast.publish(json.dumps({"token": f"I encountered an error processing your request: {str(e)}. Please try again.", "done": True}))
+                finally:
+                    stream_coalescer.finish(key, broadcast)
             
-            # Stream the tokens
-            async for token in streaming_handler.get_tokens():
-                yield token
-                
-        except Exception as e:
-            logger.error(f"Error in streaming LLM response: {e}", exc_info=True)
-            yield json.dumps({"token": f"I encountered an error processing your request: {str(e)}. Please try again.", "done": True})
+            # Generation runs independently of this client, so subscribers keep
+            # receiving tokens even if the first requester disconnects
+            task = asyncio.create_task(produce())
+            stream_tasks.add(task)
+            task.add_done_callback(stream_tasks.discard)
+        
+        async for token in broadcast.subscribe():
+            yield token
     
     except Exception as e:
         logger.error(f"Error setting up streaming: {e}", exc_info=True)
@@ -505,122 +784,88 @@ async def simulate_payment(request: PaymentRequest):
 async def upload_documents(files: List[UploadFile] = File(...)):
     """
     Upload one or more documents to be processed by the ingest system.
+
+    Files are streamed to disk off the event loop, hashed while writing and
+    renamed into place once complete. A file whose content is already in the
+    source directory is reported as a duplicate and not stored again.
     """
     try:
-        source_dir = os.environ.get('SOURCE_DIRECTORY', 'source_documents')
-        
-        # Create the directory if it doesn't exist
-        os.makedirs(source_dir, exist_ok=True)
-        
-        uploaded_files = []
-        
-        # Save each uploaded file
-        for file in files:
-            file_path = os.path.join(source_dir, file.filename)
-            
-            with open(file_path, "wb") as buffer:
-                shutil.copyfileobj(file.file, buffer)
-            
-            uploaded_files.append({
-                "filename": file.filename,
-                "size": os.path.getsize(file_path),
-                "path": file_path
-            })
+        uploaded_files = await save_uploads(files, upload_manifest)
+        stored = sum(1 for f in uploaded_files if f["status"] == "stored")
+        duplicates = sum(1 for f in uploaded_files if f["status"] == "duplicate")
+        rejected = len(uploaded_files) - stored - duplicates
+        if rejected == len(uploaded_files):
+            # 413 only when size was the problem; bad filenames are a client error
+            too_large = all(f.get("reason") == "too_large" for f in uploaded_files)
+            raise HTTPException(status_code=413 if too_large else 400, detail=[f["error"] for f in uploaded_files])
         
         return {
             "status": "success",
-            "message": f"Successfully uploaded {len(uploaded_files)} file(s)",
+            "message": f"Successfully uploaded {stored} file(s), {duplicates} duplicate(s), {rejected} rejected",
             "files": uploaded_files
         }
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error uploading documents: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.post("/ingest", response_model=IngestResponse)
+@app.post("/ingest", response_model=JobResponse, status_code=202)
 async def ingest():
+    """
+    Queue an ingest job (process documents, embed and upsert in checkpointed
+    batches) and return it immediately; poll GET /jobs/{id} for progress.
+    """
     try:
-        # Process documents from your source directory
-        texts = process_documents()
-        if not texts:
-            return {
-                "status": "no_documents",
-                "documents_processed": 0
-            }
-        
-        # Create embeddings using the specified model
-        logger.info("Creating embeddings...")
-        try:
-            # Try using our custom embeddings adapter for 1024 dimensions
-            embeddings = CustomHuggingFaceEmbeddings()
-            logger.info("Using custom 1024-dimensional embeddings compatible with llama-text-embed-v2")
-        except Exception as e:
-            # Fall back to standard embeddings if there's any issue
-            logger.error(f"Error with custom embeddings: {e}")
-            embeddings = HuggingFaceEmbeddings(
-                model_name=os.environ.get("EMBEDDINGS_MODEL_NAME", "text-embedding-ada-002")
-            )
-            logger.info("Using standard embeddings")
-        
-        # Initialize or get existing Pinecone index
-        pinecone.init(api_key=pinecone_api_key, environment=pinecone_environment)
-        index = initialize_pinecone()
-        
-        # We'll use our custom function to add vectors directly to Pinecone
-        add_embeddings_to_pinecone(texts, embeddings)
-        
-        logger.info("Vectors added to Pinecone successfully!")
-        
-        # Reinitialize the QA chain to use the updated vectorstore
-        create_qa_chain()
-        
-        return {
-            "status": "success",
-            "documents_processed": len(texts)
-        }
-    
+        return await asyncio.to_thread(get_job_store().submit, "ingest", {"index_name": index_name})
     except Exception as e:
-        logger.error(f"Error during ingestion: {e}", exc_info=True)
+        logger.error(f"Error queueing ingestion: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.post("/analyze-documents")
+@app.post("/analyze-documents", response_model=JobResponse, status_code=202)
 async def analyze_documents():
+    """Queue a run of the document extractor; its output is in the job result."""
     try:
-        import subprocess
-        result = subprocess.run(["python", "pinecone_municipal_doc_extractor.py"], 
-                               capture_output=True, text=True)
-        return {
-            "status": "success",
-            "output": result.stdout,
-            "error": result.stderr
-        }
+        return await asyncio.to_thread(get_job_store().submit, "analyze")
     except Exception as e:
-        logger.error(f"Error during document analysis: {e}", exc_info=True)
+        logger.error(f"Error queueing document analysis: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/jobs", response_model=List[JobResponse])
+async def list_jobs(status: Optional[str] = None, limit: int = 50):
+    return await asyncio.to_thread(get_job_store().list, limit, status)
+
+@app.get("/jobs/{job_id}", response_model=JobResponse)
+async def get_job(job_id: str):
+    job = await asyncio.to_thread(get_job_store().get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@app.post("/jobs/{job_id}/cancel", response_model=JobResponse)
+async def cancel_job(job_id: str):
+    """Cancel a queued job, or stop a running one after its current batch."""
+    job = await asyncio.to_thread(get_job_store().cancel, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
 @app.post("/log-chat")
 async def log_chat(log_data: dict):
     """
     Log chatbot interactions for analytics.
     """
+    if chat_log_writer is None:
+        return {"status": "error", "message": "Chat logging is not running"}
     try:
         logger.info(f"Logging interaction: {log_data}")
         
-        # Example of storing in a simple CSV for demonstration
-        import csv
-        
-        log_file = "chat_logs.csv"
-        file_exists = os.path.isfile(log_file)
+        # Add user_id if provided, otherwise use anonymous
+        log_data['user_id'] = log_data.get('user_id', 'anonymous')
         
-        with open(log_file, mode='a', newline='') as file:
-            fieldnames = ['timestamp', 'type', 'message', 'user_id']
-            writer = csv.DictWriter(file, fieldnames=fieldnames)
-            
-            if not file_exists:
-                writer.writeheader()
-            
-            # Add user_id if provided, otherwise use anonymous
-            log_data['user_id'] = log_data.get('user_id', 'anonymous')
-            writer.writerow(log_data)
+        # Queued; the writer appends and fsyncs in batches
+        chat_log_writer.write(log_data)
+        chat_analytics.record(log_data)
             
         return {"status": "success"}
     except Exception as e:
@@ -632,40 +877,88 @@ async def admin_dashboard():
     # In production, add authentication here
     return FileResponse("admin-dashboard.html")
 
-@app.get("/status")
-async def status():
-    # Initialize Pinecone
+@app.get("/admin/analytics")
+async def admin_analytics(start: Optional[str] = None, end: Optional[str] = None, top: int = 10):
+    """
+    Chat analytics for the admin dashboard: event counts, top queries and
+    latency percentiles between two days (YYYY-MM-DD, inclusive).
+    """
+    # In production, add authentication here
+    if chat_analytics is None:
+        raise HTTPException(status_code=503, detail="Chat analytics is not running")
     try:
-        pinecone.init(api_key=pinecone_api_key, environment=pinecone_environment)
-
-        
-        # Check if the index exists
-        indexes = pc.list_indexes()
-        index_exists = index_name in indexes.names()
-        
-        # If index exists, get stats
-        stats = None
-        if index_exists:
-            index = pinecone.Index(index_name)
-            stats = index.describe_index_stats()
-            
-        return {
-            "database_initialized": index_exists,
-            "model": os.environ.get("MODEL", "mistral"),
-            "embeddings_model": os.environ.get("EMBEDDINGS_MODEL_NAME", "text-embedding-ada-002"),
-            "vector_count": stats.total_vector_count if stats else 0,
-            "dimension": stats.dimension if stats else None,
-            "index_fullness": stats.index_fullness if stats else 0,
-            "namespaces": list(stats.namespaces.keys()) if stats and hasattr(stats, 'namespaces') else []
-        }
+        return await asyncio.to_thread(chat_analytics.summary, start, end, top)
     except Exception as e:
-        logger.error(f"Error checking Pinecone status: {e}")
-        return {
-            "database_initialized": False,
-            "model": os.environ.get("MODEL", "mistral"),
-            "embeddings_model": os.environ.get("EMBEDDINGS_MODEL_NAME", "text-embedding-ada-002"),
-            "error": str(e)
-        }
+        logger.error(f"Error computing chat analytics: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/metrics")
+async def metrics():
+    """Per-stage latency histograms in the Prometheus text format."""
+    body = tracer.render_prometheus()
+    flights = [flight for flight in (query_inflight, stream_coalescer) if flight is not None]
+    body += render_coalescing_metrics(*flights)
+    return PlainTextResponse(body, media_type="text/plain; version=0.0.4")
+
+@app.get("/admin/profile/cpu", dependencies=[Depends(require_admin)])
+async def profile_cpu(seconds: float = 10.0, interval_ms: float = 5.0, idle: bool = False):
+    """Sample every thread's stack for `seconds`; collapsed stacks for flamegraph.pl or speedscope."""
+    try:
+        profile = await asyncio.to_thread(sampling_profiler.profile, seconds, interval_ms / 1000, idle)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return PlainTextResponse(profile.collapsed(), headers={"X-Profile-Samples": str(profile.samples)})
+
+@app.get("/admin/profile/memory", dependencies=[Depends(require_admin)])
+async def profile_memory(seconds: float = 30.0, top: int = 25, frames: int = 1):
+    """tracemalloc growth by source line, and net allocations per route, over the next `seconds`."""
+    try:
+        return await asyncio.to_thread(allocation_profiler.window, seconds, top, frames)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+@app.get("/admin/profile/slow", dependencies=[Depends(require_admin)])
+async def slow_requests(limit: int = 50):
+    """Stage timelines of captured requests over the slow threshold, newest first."""
+    threshold = tracer.slow_threshold
+    return {"threshold_ms": threshold * 1000 if threshold is not None else None, "requests": tracer.slow(limit)}
+
+@app.post("/admin/profile/slow", dependencies=[Depends(require_admin)])
+async def set_slow_threshold(threshold_ms: Optional[float] = None):
+    """Capture requests slower than `threshold_ms` from now on; omit it to stop capturing."""
+    tracer.set_slow_threshold(threshold_ms)
+    return await slow_requests(limit=0)
+
+@app.get("/status")
+async def status():
+    # Index stats and generation come from the background snapshot; everything else is in-memory counters
+    status_info = {
+        "model": os.environ.get("MODEL", "mistral"),
+        "embeddings_model": os.environ.get("EMBEDDINGS_MODEL_NAME", "text-embedding-ada-002"),
+        **status_refresher.snapshot()
+    }
+    status_info.setdefault("database_initialized", False)
+    status_info.setdefault("index_generation", None)
+    status_info["queues"] = {
+        "ollama": get_ollama_client().stats(),
+        "planner_queued": queued_branches(),
+        "streams_in_flight": stream_coalescer.stats()["in_flight"],
+        "queries_in_flight": query_inflight.stats()["in_flight"] if query_inflight is not None else None,
+    }
+    status_info["caches"] = {
+        "generation": generation_cache.stats() if generation_cache is not None else None,
+        "reranker": reranker.stats() if reranker is not None else None,
+        "placeholder": placeholder_cache.stats(),
+    }
+    
+    # Report 503 until warm so load balancers only route to hot workers
+    status_info["ready"] = warmup_state.ready
+    status_info["warmup"] = warmup_state.as_dict()
+    return JSONResponse(content=status_info, status_code=200 if warmup_state.ready else 503)
 
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
@@ -3,8 +3,67 @@ from langchain.embeddings.base import Embeddings
 from langchain.schema import Document, BaseRetriever
 from typing import List, Optional, Any, Dict, Tuple, Iterable
 from pinecone import Pinecone
+import asyncio
+import functools
+import numpy as np
+import os
 import uuid
 
+from retrieval_types import chunks_from_matches
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+# Connection pool for the async query path
+ASYNC_POOL_SIZE = int(os.environ.get("PINECONE_ASYNC_POOL_SIZE", 20))
+ASYNC_TIMEOUT = float(os.environ.get("PINECONE_ASYNC_TIMEOUT", 10.0))
+
+
+def maximal_marginal_relevance(
+    query_embedding: np.ndarray,
+    embeddings: np.ndarray,
+    k: int = 4,
+    lambda_mult: float = 0.5
+) -> List[int]:
+    """
+    Greedy MMR selection over candidate embeddings, vectorized with numpy.
+
+    Each step scores every remaining candidate at once as
+    lambda_mult * sim(query) - (1 - lambda_mult) * max sim(selected);
+    the max-similarity vector is updated with a single matrix-vector
+    product per pick. Returns the indices of the selected candidates in
+    selection order.
+    """
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    if embeddings.ndim != 2 or len(embeddings) == 0 or k <= 0:
+        return []
+    query = np.asarray(query_embedding, dtype=np.float32).reshape(-1)
+
+    # Cosine similarity via normalized vectors
+    embeddings = embeddings / np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+    query = query / max(float(np.linalg.norm(query)), 1e-12)
+
+    relevance = embeddings @ query
+    max_similarity = np.full(len(embeddings), -np.inf, dtype=np.float32)
+    available = np.ones(len(embeddings), dtype=bool)
+    selected = []
+
+    for _ in range(min(k, len(embeddings))):
+        if selected:
+            scores = lambda_mult * relevance - (1 - lambda_mult) * max_similarity
+        else:
+            scores = relevance.copy()
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        available[best] = False
+        np.maximum(max_similarity, embeddings @ embeddings[best], out=max_similarity)
+
+    return selected
+
+
 class PineconeVectorStore(VectorStore):
     """Adapter for using Pinecone with LangChain, compatible with Pinecone SDK v2+"""
     
@@ -14,9 +73,17 @@ class PineconeVectorStore(VectorStore):
         index_name: str,
         embedding: Embeddings,
         text_key: str = "text",
-        namespace: Optional[str] = None
+        namespace: Optional[str] = None,
+        index: Any = None,
+        async_client: Any = None
     ):
-        """Initialize with Pinecone client"""
+        """
+        Initialize with Pinecone client.
+        
+        `index` and `async_client` may be passed in to reuse an existing index
+        handle or httpx.AsyncClient; otherwise they are created here and, for
+        the async client, on first use.
+        """
         self.embedding = embedding
         self.text_key = text_key
         self.namespace = namespace
@@ -24,8 +91,15 @@ class PineconeVectorStore(VectorStore):
         self.index_name = index_name
         
         # Initialize the modern Pinecone client (v2+)
-        pc = Pinecone(api_key=pinecone_api_key)
-        self.index = pc.Index(index_name)
+        self.pc = None
+        if index is None:
+            self.pc = Pinecone(api_key=pinecone_api_key)
+            index = self.pc.Index(index_name)
+        self.index = index
+        
+        # Pooled HTTP client used by the async methods
+        self._async_client = async_client
+        self._index_host = None
     
     def add_texts(
         self, 
@@ -127,6 +201,20 @@ class PineconeVectorStore(VectorStore):
         
         return vectorstore
     
+    def _chunks(self, matches) -> List[Any]:
+        """Wrap matches as RetrievedChunks, warning about any without text."""
+        chunks = chunks_from_matches(matches, self.text_key)
+        if len(chunks) != len(matches):
+            print(f"Warning: {len(matches) - len(chunks)} matches missing text content")
+        return chunks
+    
+    def _query_options(self, kwargs: Dict[str, Any]) -> Dict[str, Any]:
+        """namespace (defaulting to the store's) and an optional metadata filter for index.query."""
+        options = {"namespace": kwargs.get("namespace", self.namespace)}
+        if kwargs.get("filter"):
+            options["filter"] = kwargs["filter"]
+        return options
+    
     def similarity_search(
         self, query: str, k: int = 4, **kwargs
     ) -> List[Document]:
@@ -142,22 +230,11 @@ class PineconeVectorStore(VectorStore):
             vector=query_embedding,
             top_k=k,
             include_metadata=True,
-            namespace=self.namespace
+            **self._query_options(kwargs)
         )
         
-        # Convert to LangChain documents
-        documents = []
-        
-        for match in results.matches:
-            # Make sure the text content is in the metadata
-            if self.text_key in match.metadata:
-                page_content = match.metadata.pop(self.text_key)
-                doc = Document(page_content=page_content, metadata=match.metadata)
-                documents.append(doc)
-            else:
-                print(f"Warning: Missing text content in document {match.id}")
-        
-        return documents
+        # Convert to LangChain documents; the match metadata is shared, not popped or copied
+        return [chunk.to_document() for chunk in self._chunks(results.matches)]
     
     def similarity_search_with_score(
         self, query: str, k: int = 4, **kwargs
@@ -174,49 +251,277 @@ class PineconeVectorStore(VectorStore):
             vector=query_embedding,
             top_k=k,
             include_metadata=True,
-            namespace=self.namespace
+            **self._query_options(kwargs)
         )
         
-        # Convert to LangChain documents with scores
-        documents_with_scores = []
+        # Convert to LangChain documents with scores (already between 0 and 1)
+        return [(chunk.to_document(), chunk.score) for chunk in self._chunks(results.matches)]
+    
+    def max_marginal_relevance_search_by_vector(
+        self, embedding: List[float], k: int = 4, fetch_k: int = 20, lambda_mult: float = 0.5, **kwargs
+    ) -> List[Document]:
+        """Return docs selected using the maximal marginal relevance, given a query embedding."""
+        if hasattr(embedding, 'tolist'):
+            embedding = embedding.tolist()
         
-        for match in results.matches:
-            # Make sure the text content is in the metadata
-            if self.text_key in match.metadata:
-                page_content = match.metadata.pop(self.text_key)
-                doc = Document(page_content=page_content, metadata=match.metadata)
-                # Scores are already between 0 and 1
-                documents_with_scores.append((doc, match.score))
-            else:
-                print(f"Warning: Missing text content in document {match.id}")
+        # Fetch the candidates together with their vectors
+        results = self.index.query(
+            vector=embedding,
+            top_k=max(fetch_k, k),
+            include_metadata=True,
+            include_values=True,
+            **self._query_options(kwargs)
+        )
+        candidates = [match for match in results.matches if match.values and (match.metadata or {}).get(self.text_key)]
+        if not candidates:
+            return []
         
-        return documents_with_scores
+        selected = maximal_marginal_relevance(
+            np.array(embedding, dtype=np.float32),
+            np.array([match.values for match in candidates], dtype=np.float32),
+            k=k,
+            lambda_mult=lambda_mult
+        )
+        chunks = chunks_from_matches(candidates, self.text_key)
+        return [chunks[i].to_document() for i in selected]
     
     def max_marginal_relevance_search(
         self, query: str, k: int = 4, fetch_k: int = 20, lambda_mult: float = 0.5, **kwargs
     ) -> List[Document]:
         """Return docs selected using the maximal marginal relevance."""
-        # Not fully implemented - this is a placeholder that falls back to regular search
-        print("Warning: MMR search not implemented for PineconeVectorStore, falling back to regular search")
-        return self.similarity_search(query, k, **kwargs)
+        query_embedding = self.embedding.embed_query(query)
+        return self.max_marginal_relevance_search_by_vector(query_embedding, k, fetch_k, lambda_mult, **kwargs)
+    
+    # ---- Async API ----
+    
+    async def _get_async_client(self):
+        """Pooled client for the index data plane, or None when the index host can't be resolved."""
+        if self._async_client is None:
+            if httpx is None:
+                return None
+            if self._index_host is None:
+                if self.pc is None:
+                    # Injected index handle without a control plane client
+                    return None
+                # One-off control plane lookup, kept off the event loop
+                loop = asyncio.get_running_loop()
+                description = await loop.run_in_executor(None, self.pc.describe_index, self.index_name)
+                self._index_host = description.host
+            if self._async_client is None:
+                self._async_client = httpx.AsyncClient(
+                    base_url=f"https://{self._index_host}",
+                    headers={"Api-Key": self.pinecone_api_key},
+                    limits=httpx.Limits(max_connections=ASYNC_POOL_SIZE, max_keepalive_connections=ASYNC_POOL_SIZE),
+                    timeout=ASYNC_TIMEOUT
+                )
+        return self._async_client
+    
+    async def _aquery(self, vector: List[float], top_k: int, include_values: bool = False,
+                      options: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """Query the index data plane without blocking the event loop; returns match dicts."""
+        options = options if options is not None else self._query_options({})
+        client = await self._get_async_client()
+        if client is None:
+            # No async HTTP client available: run the SDK call in a worker thread
+            loop = asyncio.get_running_loop()
+            results = await loop.run_in_executor(None, functools.partial(
+                self.index.query,
+                vector=vector,
+                top_k=top_k,
+                include_metadata=True,
+                include_values=include_values,
+                **options
+            ))
+            return [
+                {"id": match.id, "score": match.score, "values": match.values, "metadata": match.metadata}
+                for match in results.matches
+            ]
+        
+        body = {"vector": vector, "topK": top_k, "includeMetadata": True, "includeValues": include_values}
+        if options.get("namespace"):
+            body["namespace"] = options["namespace"]
+        if options.get("filter"):
+            body["filter"] = options["filter"]
+        response = await client.post("/query", json=body)
+        response.raise_for_status()
+        return response.json().get("matches", [])
+    
+    async def aembed_query(self, query: str) -> List[float]:
+        """Embed the query in the default executor so the event loop stays free."""
+        loop = asyncio.get_running_loop()
+        query_embedding = await loop.run_in_executor(None, self.embedding.embed_query, query)
+        if hasattr(query_embedding, 'tolist'):
+            query_embedding = query_embedding.tolist()
+        return query_embedding
+    
+    async def asimilarity_search_with_score(
+        self, query: str, k: int = 4, **kwargs
+    ) -> List[Tuple[Document, float]]:
+        """Async version of similarity_search_with_score."""
+        query_embedding = await self.aembed_query(query)
+        matches = await self._aquery(query_embedding, k, options=self._query_options(kwargs))
+        return [(chunk.to_document(), chunk.score) for chunk in self._chunks(matches)]
+    
+    async def asimilarity_search(
+        self, query: str, k: int = 4, **kwargs
+    ) -> List[Document]:
+        """Async version of similarity_search."""
+        return [doc for doc, _ in await self.asimilarity_search_with_score(query, k, **kwargs)]
+    
+    async def amax_marginal_relevance_search(
+        self, query: str, k: int = 4, fetch_k: int = 20, lambda_mult: float = 0.5, **kwargs
+    ) -> List[Document]:
+        """Async version of max_marginal_relevance_search."""
+        query_embedding = await self.aembed_query(query)
+        matches = await self._aquery(query_embedding, max(fetch_k, k), include_values=True, options=self._query_options(kwargs))
+        candidates = [match for match in matches if match.get("values") and (match.get("metadata") or {}).get(self.text_key)]
+        if not candidates:
+            return []
+        
+        selected = maximal_marginal_relevance(
+            np.array(query_embedding, dtype=np.float32),
+            np.array([match["values"] for match in candidates], dtype=np.float32),
+            k=k,
+            lambda_mult=lambda_mult
+        )
+        chunks = chunks_from_matches(candidates, self.text_key)
+        return [chunks[i].to_document() for i in selected]
+    
+    async def aclose(self):
+        """Close the pooled async HTTP client."""
+        if self._async_client is not None:
+            await self._async_client.aclose()
+            self._async_client = None
     
     # Custom retriever implementation compatible with newer LangChain versions
-    def as_retriever(self, search_kwargs=None):
-        """Create a retriever from this vectorstore"""
+    def as_retriever(self, search_type: str = "similarity", search_kwargs=None):
+        """
+        Create a retriever from this vectorstore.
+        
+        search_type="mmr" diversifies results with max_marginal_relevance_search;
+        search_kwargs may then also set fetch_k and lambda_mult.
+        """
+        if search_type not in ("similarity", "mmr"):
+            raise ValueError(f"Unsupported search_type: {search_type}")
         search_kwargs = search_kwargs or {}
         
-        # Create a simple retriever that delegates to our vectorstore
+        # Create a simple retriever that delegates to our vectorstore.
+        # BaseRetriever is a pydantic model, so its attributes must be declared fields.
         class CustomRetriever(BaseRetriever):
-            def __init__(self, vectorstore, search_kwargs):
-                super().__init__()
-                self.vectorstore = vectorstore
-                self.search_kwargs = search_kwargs
+            vectorstore: Any
+            search_type: str = "similarity"
+            search_kwargs: Dict = {}
             
-            def get_relevant_documents(self, query):
+            def _get_relevant_documents(self, query, *, run_manager=None):
+                if self.search_type == "mmr":
+                    return self.vectorstore.max_marginal_relevance_search(query, **self.search_kwargs)
                 return self.vectorstore.similarity_search(query, **self.search_kwargs)
             
-            async def aget_relevant_documents(self, query):
-                # Synchronous fallback
-                return self.get_relevant_documents(query)
+            async def _aget_relevant_documents(self, query, *, run_manager=None):
+                if self.search_type == "mmr":
+                    return await self.vectorstore.amax_marginal_relevance_search(query, **self.search_kwargs)
+                return await self.vectorstore.asimilarity_search(query, **self.search_kwargs)
         
-        return CustomRetriever(self, search_kwargs)
\ No newline at end of file
+        return CustomRetriever(vectorstore=self, search_type=search_type, search_kwargs=search_kwargs)
+
+
+# Example usage: MMR latency and diversity on synthetic near-duplicate candidates,
+# then async vs sync retrieval under concurrency against stubbed services
+if __name__ == "__main__":
+    import time
+    from types import SimpleNamespace
+
+    def loop_mmr(query_embedding, embeddings, k, lambda_mult):
+        """Reference per-candidate Python loop, for comparison."""
+        embeddings = embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+        query = query_embedding / np.linalg.norm(query_embedding)
+        selected = []
+        while len(selected) < min(k, len(embeddings)):
+            best, best_score = None, -np.inf
+            for i in range(len(embeddings)):
+                if i in selected:
+                    continue
+                redundancy = max((float(embeddings[i] @ embeddings[j]) for j in selected), default=0.0)
+                score = lambda_mult * float(embeddings[i] @ query) - (1 - lambda_mult) * redundancy
+                if score > best_score:
+                    best, best_score = i, score
+            selected.append(best)
+        return selected
+
+    def mean_pairwise_similarity(vectors):
+        vectors = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+        sims = vectors @ vectors.T
+        n = len(vectors)
+        return float((sims.sum() - n) / (n * (n - 1)))
+
+    rng = np.random.default_rng(0)
+    dim, k = 1024, 5
+    query = rng.normal(size=dim).astype(np.float32)
+    for fetch_k in (20, 100, 500):
+        # Candidates come in clusters of near-identical chunks, as when one PDF dominates a query
+        centers = query + rng.normal(scale=1.5, size=(fetch_k // 5, dim))
+        candidates = np.repeat(centers, 5, axis=0) + rng.normal(scale=0.1, size=(fetch_k, dim))
+        candidates = candidates.astype(np.float32)
+        top_k = np.argsort(-(candidates @ query))[:k]
+
+        start = time.perf_counter()
+        for _ in range(20):
+            selected = maximal_marginal_relevance(query, candidates, k=k)
+        vectorized_ms = (time.perf_counter() - start) / 20 * 1000
+
+        start = time.perf_counter()
+        loop_mmr(query, candidates, k, 0.5)
+        loop_ms = (time.perf_counter() - start) * 1000
+
+        print(
+            f"fetch_k={fetch_k:3d}: vectorized {vectorized_ms:6.2f} ms, loop {loop_ms:7.2f} ms | "
+            f"mean pairwise similarity top-k {mean_pairwise_similarity(candidates[top_k]):.3f} "
+            f"-> MMR {mean_pairwise_similarity(candidates[selected]):.3f}"
+        )
+
+    # Stubs: 10 ms embedding, 50 ms Pinecone round trip
+    def stub_matches(n):
+        return [{"id": f"doc-{i}", "score": 0.9 - i * 0.01, "values": [], "metadata": {"text": f"chunk {i}", "source": "stub.pdf"}} for i in range(n)]
+
+    class StubEmbeddings(Embeddings):
+        def embed_documents(self, texts):
+            return [self.embed_query(text) for text in texts]
+
+        def embed_query(self, text):
+            time.sleep(0.01)
+            return [0.1] * 8
+
+    class StubIndex:
+        def query(self, top_k=4, **kwargs):
+            time.sleep(0.05)
+            return SimpleNamespace(matches=[SimpleNamespace(**match) for match in stub_matches(top_k)])
+
+    async def stub_pinecone(request):
+        await asyncio.sleep(0.05)
+        return httpx.Response(200, json={"matches": stub_matches(4)})
+
+    async def run(store, concurrency, use_async):
+        retriever = store.as_retriever(search_kwargs={"k": 4})
+        start = time.perf_counter()
+        if use_async:
+            await asyncio.gather(*(retriever.aget_relevant_documents(f"question {i}") for i in range(concurrency)))
+        else:
+            # What the old aget_relevant_documents did: the sync call runs on the event loop
+            async def blocking(i):
+                return retriever.get_relevant_documents(f"question {i}")
+            await asyncio.gather(*(blocking(i) for i in range(concurrency)))
+        return time.perf_counter() - start
+
+    if httpx is not None:
+        store = PineconeVectorStore(
+            "stub", "stub", StubEmbeddings(),
+            index=StubIndex(),
+            async_client=httpx.AsyncClient(transport=httpx.MockTransport(stub_pinecone), base_url="http://stub")
+        )
+        for concurrency in (1, 10, 50):
+            sync_time = asyncio.run(run(store, concurrency, use_async=False))
+            async_time = asyncio.run(run(store, concurrency, use_async=True))
+            print(
+                f"concurrency={concurrency:2d}: sync {sync_time * 1000:7.0f} ms, async {async_time * 1000:6.0f} ms "
+                f"({sync_time / async_time:4.1f}x)"
+            )
@@ -3,17 +3,32 @@ from langchain.chains import RetrievalQA
 from langchain.embeddings import HuggingFaceEmbeddings
 from lanchain_pinecone_adapter import CustomHuggingFaceEmbeddings
 from langchain.callbacks.streaming_stdout import StreamingStdOutCallbackHandler
-from langchain.llms import Ollama
 from langchain.schema import Document, BaseRetriever
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
+import hashlib
 import os
+import re
 import time
+import logging
 from pinecone import Pinecone
 from langchain.prompts import PromptTemplate
 
 from langchain.callbacks.base import BaseCallbackHandler
 import asyncio
 
+from tracing import tracer
+from log_pipeline import sampled
+from request_coalescing import SingleFlight, coalescing_key
+from context_packing import ContextPacker
+from retrieval_types import RetrievedChunk
+from retrieval_policy import policy_for_model
+from reranker import RERANK_CANDIDATES, RERANK_KEEP, get_reranker
+from generation_cache import GenerationCache, generation_key, replay_tokens
+from index_generations import GENERATIONS_INDEX_NAME, IndexGenerations
+from ollama_client import GenerationCancelled, PooledOllama
+
+logger = logging.getLogger(__name__)
+
 from langchain.schema import BaseRetriever
 from typing import List
 
@@ -22,73 +37,152 @@ model = os.environ.get("MODEL", "mistral")
 embeddings_model_name = os.environ.get("EMBEDDINGS_MODEL_NAME", "llama-text-embed-v2")
 pinecone_api_key = os.environ.get("PINECONE_API_KEY", "pcsk_1MfLA_QRmNnRSR4pumc7thAYp6eqHkxGF3Jhmbs9X66SN2i1Rr4akBzmERV5NCjyBhE8e")
 pinecone_environment = os.environ.get("PINECONE_ENVIRONMENT", "us-east-1")
-index_name = os.environ.get("PINECONE_INDEX_NAME", "phoenixville-municipal-code")
+index_name = GENERATIONS_INDEX_NAME
 target_source_chunks = int(os.environ.get("TARGET_SOURCE_CHUNKS", 10))
 
+# QA prompt shared by the RetrievalQA chain and the streaming chains, with very specific instructions
+QA_PROMPT_TEMPLATE = """You are an AI assistant for answering questions about Phoenixville municipal services and documents.
+Use ONLY the following pieces of retrieved context to answer the question.
+If the retrieved context doesn't contain the information needed, say "I don't have that specific information in my database."
+DO NOT make up or invent any information that is not in the context.
+
+Context:
+{context}
+
+Question: {question}
+
+Very important instructions:
+1. ONLY use information from the context above
+2. If asked about the mayor, VERIFY that you are giving the current and correct information from the context
+3. For the mayor of Phoenixville, the correct information is: Peter Urscheler is the current Mayor since January 2, 2018
+4. DO NOT invent names, dates, phone numbers, or any other specific details
+5. If unsure, say "I don't have that specific information in my database"
+
+Answer:"""
+
+# Part of the generation cache key, so editing the template invalidates cached answers
+PROMPT_VERSION = hashlib.sha256(QA_PROMPT_TEMPLATE.encode("utf-8")).hexdigest()[:12]
+
 # Global QA chain instance
 qa_chain = None
 
-# Standalone functions to avoid setting any attributes on BaseRetriever subclasses
-def get_documents_from_pinecone(query: str) -> List[Document]:
-    """Query Pinecone for relevant documents."""
-    try:
-        # Initialize Pinecone client
+# Concurrent identical questions share one retrieval + generation
+query_inflight = SingleFlight("process_query")
+
+# Trims retrieved chunks to the prompt token budget before they are stuffed into the prompt
+context_packer = ContextPacker(model)
+
+# Fetch a wide candidate set, forward only the chunks above the per-query cutoff.
+# Scores come from CustomHuggingFaceEmbeddings' default MiniLM model.
+retrieval_policy = policy_for_model("all-MiniLM-L6-v2", max_chunks=target_source_chunks)
+
+# Optional cross-encoder that narrows the stuffed chunks further
+reranker = get_reranker()
+
+# Answers keyed on (model, prompt version, question, chunk ids); cleared by ingest
+generation_cache = GenerationCache()
+
+# Namespace of the live index generation; ingest flips it once a new one is complete
+index_generations = IndexGenerations(index_name)
+
+# Cached Pinecone index and embeddings model, shared across queries
+_pinecone_index = None
+_embedding_model = None
+
+def get_pinecone_index():
+    """Return the Pinecone index, connecting on first use."""
+    global _pinecone_index
+    if _pinecone_index is None:
         pc = Pinecone(api_key=pinecone_api_key)
         
         # Check if index exists 
         indexes = pc.list_indexes()
         if index_name not in indexes.names():
             print(f"Index {index_name} not found")
-            return []
-            
-        # Get the index
-        index = pc.Index(index_name)
+            return None
         
-        # Initialize embeddings - IMPORTANT: Use the same embeddings model as in diagnostic tool
+        _pinecone_index = pc.Index(index_name)
+    return _pinecone_index
+
+def get_embedding_model():
+    """Return the query embeddings model, loading it on first use."""
+    global _embedding_model
+    if _embedding_model is None:
         try:
-            embedding_model = CustomHuggingFaceEmbeddings()
-            print(f"Using custom embeddings for query: {query}")
+            _embedding_model = CustomHuggingFaceEmbeddings()
+            print("Loaded custom embeddings model")
         except Exception as e:
             print(f"Error with custom embeddings: {e}")
-            embedding_model = HuggingFaceEmbeddings(model_name=embeddings_model_name)
-            print(f"Falling back to standard embeddings for query: {query}")
+            _embedding_model = HuggingFaceEmbeddings(model_name=embeddings_model_name)
+            print("Falling back to standard embeddings model")
+    return _embedding_model
+
+# Standalone functions to avoid setting any attributes on BaseRetriever subclasses
+def embed_queries(queries: List[str]) -> List[List[float]]:
+    """Embed several queries with a single encode call."""
+    embeddings = get_embedding_model().embed_documents(queries)
+    return [e.tolist() if hasattr(e, 'tolist') else list(e) for e in embeddings]
+
+def get_documents_from_pinecone(query: str, query_embedding: Optional[List[float]] = None) -> List[Document]:
+    """Query Pinecone for relevant documents (optionally with a precomputed embedding)."""
+    try:
+        # Get the cached index handle
+        index = get_pinecone_index()
+        if index is None:
+            return []
         
-        # Create query embedding
-        query_embedding = embedding_model.embed_query(query)
+        # Initialize embeddings - IMPORTANT: Use the same embeddings model as in diagnostic tool
+        embedding_model = get_embedding_model()
         
-        # Convert to list if needed
-        if hasattr(query_embedding, 'tolist'):
-            query_embedding = query_embedding.tolist()
+        # Create query embedding
+        if query_embedding is None:
+            with tracer.span("embedding"):
+                query_embedding = embedding_model.embed_query(query)
+                
+                # Convert to list if needed
+                if hasattr(query_embedding, 'tolist'):
+                    query_embedding = query_embedding.tolist()
         
         # Query Pinecone
-        results = index.query(
-            vector=query_embedding,
-            top_k=target_source_chunks,
-            include_metadata=True
-        )
+        with tracer.span("vector_query"):
+            results = index.query(
+                vector=query_embedding,
+                top_k=retrieval_policy.fetch_k,
+                include_metadata=True,
+                namespace=index_generations.active()
+            )
         
-        # Convert to Documents - IMPORTANT: Lower the threshold to 0.5 or even 0.4
-        documents = []
-        min_score_threshold = 0.4  # Lower threshold to include more potential matches
+        # Convert to Documents, keeping only the chunks the retrieval policy forwards
+        with tracer.span("result_processing"):
+            chunks = []
         
-        print(f"Query results for '{query}':")
-        for i, match in enumerate(results.matches):
-            print(f"Match {i+1}: ID={match.id}, Score={match.score}")
-            # Include documents with a minimum similarity score
-            if match.score < min_score_threshold:
-                print(f"  Score below threshold, skipping")
-                continue
+            # Per-match logging is sampled to keep it off the hot path
+            debug = logger.isEnabledFor(logging.DEBUG) and sampled()
+            if debug:
+                logger.debug(f"Query results for '{query}':")
+            for i, match in enumerate(results.matches):
+                if debug:
+                    logger.debug(f"Match {i+1}: ID={match.id}, Score={match.score}")
             
-            if 'text' in match.metadata:
-                page_content = match.metadata.pop('text')
-                doc = Document(page_content=page_content, metadata=match.metadata)
-                documents.append(doc)
-                print(f"  Added document: {match.metadata.get('source', 'Unknown')}")
-            else:
-                print(f"  Warning: Missing text content in document {match.id}")
+                # The chunk shares the match metadata rather than popping the text out of it
+                chunk = RetrievedChunk.from_match(match)
+                if chunk is not None:
+                    chunks.append(chunk)
+                else:
+                    logger.warning(f"Missing text content in document {match.id}")
+        
+            selected = None
+            if reranker is not None:
+                pool = retrieval_policy.limited(max(RERANK_CANDIDATES, retrieval_policy.max_chunks)).select(chunks)
+                selected = reranker.rerank(query, pool, keep=min(RERANK_KEEP, retrieval_policy.max_chunks))
+            if selected is None:
+                selected = retrieval_policy.select(chunks)
+            if debug:
+                logger.debug(f"  Forwarding {len(selected)} of {len(chunks)} chunks: {[chunk.source for chunk in selected]}")
+            documents = [chunk.to_document() for chunk in selected]
         
         # Log the number of relevant documents found
-        print(f"Found {len(documents)} relevant documents for query: {query}")
+        logger.info(f"Found {len(documents)} relevant documents for query: {query}")
         
         # Special handling for "mayor" queries
         if "mayor" in query.lower() and len(documents) == 0:
@@ -116,11 +210,36 @@ def get_documents_from_pinecone(query: str) -> List[Document]:
         traceback.print_exc()
         return []
 
+class TimingCallbackHandler(BaseCallbackHandler):
+    """Records LLM time-to-first-token and total generation time on the current trace."""
+    
+    def __init__(self):
+        self._runs = {}
+    
+    def on_llm_start(self, serialized, prompts, *, run_id=None, **kwargs) -> None:
+        self._runs[run_id] = [time.perf_counter(), False]
+    
+    def on_llm_new_token(self, token: str, *, run_id=None, **kwargs) -> None:
+        run = self._runs.get(run_id)
+        if run and not run[1]:
+            run[1] = True
+            tracer.record("llm_ttft", time.perf_counter() - run[0], run[0])
+    
+    def on_llm_end(self, response, *, run_id=None, **kwargs) -> None:
+        run = self._runs.pop(run_id, None)
+        if run:
+            tracer.record("llm_generation", time.perf_counter() - run[0], run[0])
+    
+    def on_llm_error(self, error, *, run_id=None, **kwargs) -> None:
+        self._runs.pop(run_id, None)
+
+timing_handler = TimingCallbackHandler()
+
 # Class definition must be minimal with overridden _get_relevant_documents method
 class MinimalRetriever(BaseRetriever):
     def _get_relevant_documents(self, query: str) -> List[Document]:
         """Get documents relevant to the query."""
-        return get_documents_from_pinecone(query)
+        return pack_documents(get_documents_from_pinecone(query))
         
 def create_qa_chain(hide_source: bool = False, mute_stream: bool = False):
     """Initializes and returns the QA chain for processing queries."""
@@ -131,32 +250,12 @@ def create_qa_chain(hide_source: bool = False, mute_stream: bool = False):
         retriever = MinimalRetriever()
         
         # Configure callbacks for the LLM
-        callbacks = [] if mute_stream else [StreamingStdOutCallbackHandler()]
+        callbacks = [timing_handler] if mute_stream else [StreamingStdOutCallbackHandler(), timing_handler]
         
         # Initialize the LLM
-        llm = Ollama(model=model, callbacks=callbacks)
+        llm = PooledOllama(model=model, callbacks=callbacks)
         
-        # Define a better prompt template with VERY specific instructions
-        prompt_template = """You are an AI assistant for answering questions about Phoenixville municipal services and documents.
-Use ONLY the following pieces of retrieved context to answer the question.
-If the retrieved context doesn't contain the information needed, say "I don't have that specific information in my database."
-DO NOT make up or invent any information that is not in the context.
-
-Context:
-{context}
-
-Question: {question}
-
-Very important instructions:
-1. ONLY use information from the context above
-2. If asked about the mayor, VERIFY that you are giving the current and correct information from the context
-3. For the mayor of Phoenixville, the correct information is: Peter Urscheler is the current Mayor since January 2, 2018
-4. DO NOT invent names, dates, phone numbers, or any other specific details
-5. If unsure, say "I don't have that specific information in my database"
-
-Answer:"""
-
-        PROMPT = PromptTemplate(template=prompt_template, input_variables=["context", "question"])
+        PROMPT = PromptTemplate(template=QA_PROMPT_TEMPLATE, input_variables=["context", "question"])
         
         # Create the QA chain with the custom prompt
         qa_chain = RetrievalQA.from_chain_type(
@@ -174,11 +273,113 @@ Answer:"""
         traceback.print_exc()
         raise
 
-def process_query(query: str) -> Dict[str, Any]:
+def pack_documents(documents: List[Document]) -> List[Document]:
+    """
+    Drop near-duplicate chunks and trim to the context token budget.
+    Pinecone returns matches best-first, so list order is the ranking.
+    """
+    with tracer.span("context_packing"):
+        return context_packer.pack(
+            documents,
+            text_of=lambda doc: doc.page_content,
+            with_text=lambda doc, text: Document(page_content=text, metadata=doc.metadata)
+        )
+
+def answer_from_documents(query: str, documents: List[Document]) -> Dict[str, Any]:
+    """
+    Run the QA chain's combine step on documents that were already retrieved,
+    so the chain's retriever doesn't embed and query Pinecone a second time.
+    """
+    documents = pack_documents(documents)
+    key = generation_key(model, PROMPT_VERSION, query, documents)
+    result = generation_cache.get(key)
+    if result is None:
+        epoch = generation_cache.epoch
+        result = qa_chain.combine_documents_chain.run(input_documents=documents, question=query)
+        generation_cache.put(key, result, epoch)
+    res = {"query": query, "result": result}
+    if qa_chain.return_source_documents:
+        res["source_documents"] = documents
+    return res
+
+def replay_cached_answer(query: str, documents: List[Document], callback_handler) -> Optional[str]:
+    """If the answer for these (packed) documents is cached, stream it to the callback and return it."""
+    answer = generation_cache.get(generation_key(model, PROMPT_VERSION, query, documents))
+    if answer is not None:
+        for token in replay_tokens(answer):
+            callback_handler.tokens.append(token)
+    return answer
+
+def process_query(query: str, query_embedding: Optional[List[float]] = None) -> Dict[str, Any]:
     """
     Processes a query string using the QA chain and returns a dictionary
     with the answer, source documents, and processing time.
+    Concurrent calls for the same question share one in-flight result.
+    """
+    if not query or not isinstance(query, str):
+        return {"result": "Please enter a valid query.", "source_documents": []}
+    return query_inflight.do(coalescing_key(query), _process_query, query, query_embedding)
+
+# Canonical mayor information, used as a fast-path answer and as the fallback document
+MAYOR_INFO = """
+            The current Mayor of Phoenixville is Peter Urscheler, who has been serving since January 2, 2018.
+            Peter Urscheler oversees a 31-person police force which serves over 17,500 residents.
+            The Mayor's office is located at Borough Hall, 351 Bridge Street, Phoenixville, PA 19460.
+            For questions or to contact the Mayor's office, you can call (610) 933-8801.
+            """
+MAYOR_ANSWER = "The current Mayor of Phoenixville is Peter Urscheler, who has been serving since January 2, 2018. You can contact the Mayor's office at Borough Hall, 351 Bridge Street, or call (610) 933-8801 for more information about municipal services."
+
+# Whole questions asking who the mayor is, which the canonical answer fully covers
+# ("Who is the mayor?", "What's the name of the current mayor of Phoenixville?").
+# Anything else about the mayor ("What is the mayor's position on zoning?") goes to retrieval.
+_MAYOR = r"(?:the\s+)?(?:current\s+)?mayor(?:\s+of\s+(?:the\s+borough\s+of\s+)?phoenixville)?"
+ENTITY_QUESTION = re.compile(
+    r"^\s*(?:"
+    rf"who(?:'s|\s+is)\s+{_MAYOR}(?:\s+(?:now|currently|today))?"
+    rf"|what(?:'s|\s+is)\s+the\s+name\s+of\s+{_MAYOR}"
+    rf"|what(?:'s|\s+is)\s+{_MAYOR}'s\s+name"
+    rf"|(?:tell\s+me\s+)?{_MAYOR}'s\s+name"
+    rf"|name\s+of\s+{_MAYOR}"
+    r")\s*[?.!]*\s*$",
+    re.IGNORECASE
+)
+
+def _is_entity_question(query: str) -> bool:
+    """Who-is-the-mayor questions that the canonical answer fully covers."""
+    return ENTITY_QUESTION.match(query.replace("\u2019", "'")) is not None
+
+def _mayor_fast_path(query: str) -> Optional[str]:
+    """The canonical answer for who-is-the-mayor questions, or None."""
+    return MAYOR_ANSWER if _is_entity_question(query) else None
+
+def _retrieval_answer(query: str, query_embedding: Optional[List[float]], answer: Optional[str] = None) -> Dict[str, Any]:
     """
+    Retrieve documents and answer from them. A precomputed `answer` skips
+    generation; the retrieved documents are returned as sources either way.
+    """
+    documents = get_documents_from_pinecone(query, query_embedding) or []
+    if answer is not None:
+        return {"query": query, "result": answer, "source_documents": documents}
+    
+    # With nothing retrieved for a mayor question, the canonical information is
+    # used as context for the QA chain but not reported as a source
+    context = documents
+    is_mayor = "mayor" in query.lower()
+    if not documents and is_mayor:
+        logger.info("No documents found in vector search, using fallback mayor information")
+        context = [Document(page_content=MAYOR_INFO, metadata={"source": "phoenixville_mayor_info.txt"})]
+    
+    res = answer_from_documents(query, context)
+    if "source_documents" in res:
+        res["source_documents"] = documents
+    
+    # Verify the response contains the correct mayor name
+    if is_mayor and "Peter Urscheler" not in res.get("result", ""):
+        logger.warning("QA chain response doesn't mention correct mayor, overriding")
+        res["result"] = MAYOR_ANSWER
+    return res
+
+def _process_query(query: str, query_embedding: Optional[List[float]] = None) -> Dict[str, Any]:
     global qa_chain
     if qa_chain is None:
         # Initialize with default settings if not already done.
@@ -196,39 +397,10 @@ def process_query(query: str) -> Dict[str, Any]:
         # Start timing
         start = time.time()
         
-        # Special handling for mayor queries to ensure consistent response
-        if "mayor" in query.lower():
-            # Hardcode the correct mayor information as a fallback
-            mayor_info = """
-            The current Mayor of Phoenixville is Peter Urscheler, who has been serving since January 2, 2018.
-            Peter Urscheler oversees a 31-person police force which serves over 17,500 residents.
-            The Mayor's office is located at Borough Hall, 351 Bridge Street, Phoenixville, PA 19460.
-            For questions or to contact the Mayor's office, you can call (610) 933-8801.
-            """
-            
-            # Try to get documents from Pinecone first
-            documents = get_documents_from_pinecone(query)
-            
-            # If no documents found, create a fallback document
-            if not documents:
-                print("No documents found in vector search, using fallback mayor information")
-                fallback_doc = Document(
-                    page_content=mayor_info,
-                    metadata={"source": "phoenixville_mayor_info.txt"}
-                )
-                documents = [fallback_doc]
-                
-            # Run the query through the QA chain
-            res = qa_chain({"query": query, "context": documents})
-            
-            # Verify the response contains the correct mayor name
-            if "Peter Urscheler" not in res.get("result", ""):
-                print("WARNING: QA chain response doesn't mention correct mayor, overriding")
-                res["result"] = f"The current Mayor of Phoenixville is Peter Urscheler, who has been serving since January 2, 2018. You can contact the Mayor's office at Borough Hall, 351 Bridge Street, or call (610) 933-8801 for more information about municipal services."
-        else:
-            # Normal processing for non-mayor queries
-            documents = get_documents_from_pinecone(query)
-            res = qa_chain({"query": query, "context": documents})
+        # "Who is the mayor" style questions get the canonical answer without
+        # generation; other mayor questions keep the QA chain's answer only if it
+        # names the correct mayor
+        res = _retrieval_answer(query, query_embedding, _mayor_fast_path(query))
         
         end = time.time()
         res["processing_time"] = end - start
@@ -240,6 +412,15 @@ def process_query(query: str) -> Dict[str, Any]:
         return {"result": f"An error occurred while processing your query: {str(e)}", "source_documents": []}
 
 
+def get_warmup_stages() -> Dict[str, Any]:
+    """Warm-up callables for the embed, retrieve and generate stages."""
+    return {
+        "embed": lambda query: get_embedding_model().embed_query(query),
+        "retrieve": get_documents_from_pinecone,
+        "generate": process_query,
+    }
+
+
 class StreamingCallbackHandler(BaseCallbackHandler):
     """Callback handler for streaming LLM responses."""
     
@@ -301,52 +482,36 @@ async def process_query_streaming(query: str, callback_handler: StreamingCallbac
             
             # Configure the LLM with the callback handler if provided
             # Configure the LLM with the callback handler if provided
-            if callback_handler:
+            packed = pack_documents(documents)
+            cached = replay_cached_answer(query, packed, callback_handler) if callback_handler else None
+            if cached is not None:
+                res = {"result": cached}
+            elif callback_handler:
                 # Create a new LLM instance with the callback
-                from langchain.llms import Ollama
                 from langchain.chains import LLMChain
                 from langchain.prompts import PromptTemplate
                 
                 # Initialize the streaming LLM
-                streaming_llm = Ollama(model=model, callbacks=[callback_handler])
+                streaming_llm = PooledOllama(model=model, callbacks=[callback_handler, timing_handler])
                 
                 # Prepare context from documents
-                context_text = "\n\n".join([doc.page_content for doc in documents])
+                context_text = "\n\n".join([doc.page_content for doc in packed])
                 
-                # Use a simplified prompt template
-                prompt_template = """You are an AI assistant for answering questions about Phoenixville municipal services and documents.
-Use ONLY the following pieces of retrieved context to answer the question.
-If the retrieved context doesn't contain the information needed, say "I don't have that specific information in my database."
-DO NOT make up or invent any information that is not in the context.
-
-Context:
-{context}
-
-Question: {question}
-
-Very important instructions:
-1. ONLY use information from the context above
-2. If asked about the mayor, VERIFY that you are giving the current and correct information from the context
-3. For the mayor of Phoenixville, the correct information is: Peter Urscheler is the current Mayor since January 2, 2018
-4. DO NOT invent names, dates, phone numbers, or any other specific details
-5. If unsure, say "I don't have that specific information in my database"
-
-Answer:"""
-                
-                # Create the prompt
-                PROMPT = PromptTemplate(template=prompt_template, input_variables=["context", "question"])
+                PROMPT = PromptTemplate(template=QA_PROMPT_TEMPLATE, input_variables=["context", "question"])
                 
                 # Create a simple LLM chain
                 chain = LLMChain(llm=streaming_llm, prompt=PROMPT)
                 
                 # Run the chain
+                epoch = generation_cache.epoch
                 result = chain.run(context=context_text, question=query)
+                generation_cache.put(generation_key(model, PROMPT_VERSION, query, packed), result, epoch)
                 
                 # Construct a response similar to what RetrievalQA would return
                 res = {"result": result}
             else:
                 # Non-streaming approach
-                res = qa_chain({"query": query, "context": documents})
+                res = answer_from_documents(query, documents)
             
             # Verify the response contains the correct mayor name
             result_text = res.get("result", "")
@@ -357,43 +522,26 @@ Answer:"""
                 callback_handler.tokens.append(correction)
                 res["result"] += correction
             elif not callback_handler and "Peter Urscheler" not in result_text:
-                print("WARNING: QA chain response doesn't mention correct mayor, overriding")
+                logger.warning("QA chain response doesn't mention correct mayor, overriding")
                 res["result"] = f"The current Mayor of Phoenixville is Peter Urscheler, who has been serving since January 2, 2018. You can contact the Mayor's office at Borough Hall, 351 Bridge Street, or call (610) 933-8801 for more information about municipal services."
         else:
             # Normal processing for non-mayor queries
             documents = get_documents_from_pinecone(query)
             
             # Configure the LLM with the callback handler if provided
-            if callback_handler:
+            packed = pack_documents(documents)
+            cached = replay_cached_answer(query, packed, callback_handler) if callback_handler else None
+            if cached is not None:
+                res = {"result": cached}
+            elif callback_handler:
                 # Create a new LLM instance with the callback
-                from langchain.llms import Ollama
-                streaming_llm = Ollama(model=model, callbacks=[callback_handler])
+                streaming_llm = PooledOllama(model=model, callbacks=[callback_handler, timing_handler])
                 
                 # Create a new chain with this LLM
                 from langchain.chains import RetrievalQA
                 from langchain.prompts import PromptTemplate
                 
-                # Use the same prompt template as in create_qa_chain
-                prompt_template = """You are an AI assistant for answering questions about Phoenixville municipal services and documents.
-Use ONLY the following pieces of retrieved context to answer the question.
-If the retrieved context doesn't contain the information needed, say "I don't have that specific information in my database."
-DO NOT make up or invent any information that is not in the context.
-
-Context:
-{context}
-
-Question: {question}
-
-Very important instructions:
-1. ONLY use information from the context above
-2. If asked about the mayor, VERIFY that you are giving the current and correct information from the context
-3. For the mayor of Phoenixville, the correct information is: Peter Urscheler is the current Mayor since January 2, 2018
-4. DO NOT invent names, dates, phone numbers, or any other specific details
-5. If unsure, say "I don't have that specific information in my database"
-
-Answer:"""
-
-                PROMPT = PromptTemplate(template=prompt_template, input_variables=["context", "question"])
+                PROMPT = PromptTemplate(template=QA_PROMPT_TEMPLATE, input_variables=["context", "question"])
                 
                 # Create a temporary retriever that will return our documents
                 from langchain.schema import BaseRetriever
@@ -414,7 +562,7 @@ Answer:"""
 
                 
                 # Create the streaming chain
-                streaming_retriever = SimpleRetriever(documents)
+                streaming_retriever = SimpleRetriever(packed)
                 streaming_chain = RetrievalQA.from_chain_type(
                     llm=streaming_llm,
                     chain_type="stuff",
@@ -423,19 +571,25 @@ Answer:"""
                 )
                 
                 # Run the query through the streaming chain
+                epoch = generation_cache.epoch
                 res = streaming_chain({"query": query})
+                generation_cache.put(generation_key(model, PROMPT_VERSION, query, packed), res.get("result", ""), epoch)
             else:
                 # Non-streaming approach
-                res = qa_chain({"query": query, "context": documents})
+                res = answer_from_documents(query, documents)
         
         end = time.time()
         res["processing_time"] = end - start
         return res
+    except GenerationCancelled as e:
+        # The stream was closed by the callback, so there is nobody to report to
+        logger.info(f"Streaming generation cancelled: {e}")
+        return {"result": "", "source_documents": []}
     except Exception as e:
         import traceback
         print(f"Error processing query: {e}")
         print(traceback.format_exc())
-        error_msg = f"An error occurred while processing your query: {str(e)}"
+        error_msg =f"An error occurred while processing your query: {str(e)}"
         if callback_handler:
             callback_handler.tokens.append(error_msg)
         return {"result": error_msg, "source_documents": []}
@@ -1,74 +1,162 @@
 import logging
+import threading
 import time
+from collections import OrderedDict
 from typing import Dict, Any, List, Optional
 import numpy as np
 import os
 from openai import OpenAI
 
+from tracing import tracer
+from request_coalescing import SingleFlight, coalescing_key
+from context_packing import ContextPacker
+from retrieval_types import RetrievedChunk
+from retrieval_policy import RetrievalPolicy, policy_for_model
+from reranker import RERANK_CANDIDATES, RERANK_KEEP, get_reranker
+from query_planner import Branch, QueryPlanner
+from index_generations import IndexGenerations
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 class PineconeQueryHandler:
-    def __init__(self, index_name, namespace=None, pc_client=None):
+    def __init__(self, index_name, namespace=None, pc_client=None, openai_client=None):
         self.index_name = index_name
         self.namespace = namespace
+        # Without an explicit namespace, follow the live index generation
+        self.generations = IndexGenerations(index_name)
         self.pc = pc_client
         self.index = self.pc.Index(index_name)
-        # Initialize OpenAI client
-        self.openai_client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+        # Initialize OpenAI client (injectable, e.g. a local stand-in for benchmarks)
+        self.openai_client = openai_client or OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+        
+        # LRU cache of query embeddings, keyed on whitespace-normalized text
+        self.embedding_cache_size = int(os.environ.get("EMBEDDING_CACHE_SIZE", 1024))
+        self._embedding_cache = OrderedDict()
+        self._embedding_cache_lock = threading.Lock()
+        self.embedding_cache_hits = 0
+        self.embedding_cache_misses = 0
+        
+        # Concurrent identical questions share one embedding/query/LLM call
+        self.inflight = SingleFlight("query_handler")
+        
+        # Trims retrieved documents to the prompt token budget
+        self.context_packer = ContextPacker("gpt-4")
+        
+        # Decides how many matches to fetch and which of them reach GPT-4
+        self.retrieval_policy = policy_for_model("text-embedding-ada-002")
+        
+        # Optional cross-encoder that narrows the forwarded documents further
+        self.reranker = get_reranker()
+        
+        # Races the common-entity fast path against retrieval + generation
+        self.planner = QueryPlanner()
 
-    def query(self, query_text: str, top_k: int = 5, context_filter: Dict = None) -> Dict[str, Any]:
+    def active_namespace(self) -> Optional[str]:
+        return self.namespace or self.generations.active()
+
+    def query(self, query_text: str, top_k: Optional[int] = None, context_filter: Dict = None, embedding: Optional[List[float]] = None) -> Dict[str, Any]:
         """
         Query Pinecone with the given text and return processed results
         
         Args:
             query_text: The text to query
-            top_k: Number of results to return
+            top_k: Maximum number of documents to use (default: the retrieval policy's)
             context_filter: Optional filter to apply (e.g., for specific department data)
+            embedding: Precomputed query embedding (e.g. from embed_batch)
             
         Returns:
             Dictionary with results and processed response
         """
-        start_time = time.time()
-        
-        # First check if this is a common entity question
-        common_entity_answer = self._check_common_entities(query_text)
-        if common_entity_answer:
-            # Return the answer directly with a minimal source document
-            return {
-                "result": common_entity_answer,
-                "source_documents": [
-                    {
-                        "content": "Information about key Phoenixville officials and representatives.",
-                        "source": "Phoenixville Municipal Records"
-                    }
-                ],
-                "query_time": time.time() - start_time,
-                "total_relevance": 1.0  # High relevance for direct answers
-            }
+        key = coalescing_key(query_text, context_filter, top_k)
+        return self.inflight.do(key, self._query, query_text, top_k, context_filter, embedding)
+
+    def _query(self, query_text: str, top_k: Optional[int], context_filter: Optional[Dict], embedding: Optional[List[float]]) -> Dict[str, Any]:
+        """
+        Run a single query end to end (see query).
         
+        The deterministic common-entity answer and vector retrieval + generation
+        run concurrently; a common-entity answer wins as soon as it is found and
+        the retrieval branch stops before calling the LLM.
+        """
+        start_time = time.time()
+        response_data, _ = self.planner.run([
+            Branch("fast_path", lambda cancel: self._fast_path_answer(query_text, start_time)),
+            Branch(
+                "vector",
+                lambda cancel: self._vector_answer(query_text, top_k, context_filter, embedding, start_time, cancel),
+                confident=self._has_answer
+            ),
+        ])
+        return response_data or self._create_fallback_response(query_text)
+    
+    @staticmethod
+    def _has_answer(response_data: Dict[str, Any]) -> bool:
+        """False if the response says no useful information was found."""
+        result = response_data["result"]
+        return "wasn't able to find information" not in result and "don't contain information" not in result
+    
+    def _fast_path_answer(self, query_text: str, start_time: float) -> Optional[Dict[str, Any]]:
+        """Answer common entity questions directly, without retrieval."""
+        with tracer.span("routing"):
+            common_entity_answer = self._check_common_entities(query_text)
+        if not common_entity_answer:
+            return None
+        # Return the answer directly with a minimal source document
+        return {
+            "result": common_entity_answer,
+            "source_documents": [
+                {
+                    "content": "Information about key Phoenixville officials and representatives.",
+                    "source": "Phoenixville Municipal Records"
+                }
+            ],
+            "query_time": time.time() - start_time,
+            "total_relevance": 1.0  # High relevance for direct answers
+        }
+    
+    def _vector_answer(
+        self,
+        query_text: str,
+        top_k: Optional[int],
+        context_filter: Optional[Dict],
+        embedding: Optional[List[float]],
+        start_time: float,
+        cancel: threading.Event
+    ) -> Optional[Dict[str, Any]]:
+        """Embed, query Pinecone and generate an answer; None if cancelled or failed."""
         try:
             if not self.index:
                 logger.warning("No Pinecone index available, using fallback")
                 return self._create_fallback_response(query_text)
             
-            # Generate embedding
-            embedding = self._generate_embedding(query_text)
+            # Generate embedding (skipped if the fast path has already answered)
+            if embedding is None:
+                if cancel.is_set():
+                    return None
+                with tracer.span("embedding"):
+                    embedding = self._generate_embedding(query_text)
             if not embedding:
                 logger.warning("Failed to generate embedding, using fallback")
                 return self._create_fallback_response(query_text)
+            if cancel.is_set():
+                return None
+            
+            # Fetch a wide candidate set; the policy decides what reaches the LLM
+            policy = self.retrieval_policy.limited(top_k) if top_k else self.retrieval_policy
             
             # Prepare query parameters
             query_params = {
                 "vector": embedding,
-                "top_k": top_k,
+                "top_k": policy.fetch_k,
                 "include_metadata": True,
             }
             
             # Add namespace if specified
-            if self.namespace:
-                query_params["namespace"] = self.namespace
+            namespace = self.active_namespace()
+            if namespace:
+                query_params["namespace"] = namespace
                 
             # Add filter if specified
             if context_filter:
@@ -76,61 +164,110 @@ class PineconeQueryHandler:
             
             # Execute query
             logger.info(f"Querying Pinecone with: {query_text}")
-            results = self.index.query(**query_params)
+            with tracer.span("vector_query"):
+                results = self.index.query(**query_params)
             query_time = time.time() - start_time
             logger.info(f"Query completed in {query_time:.3f} seconds")
             
             # Process results
-            response_data = self._process_results(query_text, results, query_time)
-            
-            # Check if the response indicates no useful information was found
-            if "wasn't able to find information" in response_data["result"] or "don't contain information" in response_data["result"]:
-                # Try the common entity check again as a last resort
-                common_entity_answer = self._check_common_entities(query_text)
-                if common_entity_answer:
-                    response_data["result"] = common_entity_answer
-            
-            return response_data
+            return self._process_results(query_text, results, query_time, policy, cancel)
             
         except Exception as e:
             logger.error(f"Error during Pinecone query: {e}")
-            
-            # Try the common entity check as a fallback
-            common_entity_answer = self._check_common_entities(query_text)
-            if common_entity_answer:
-                return {
-                    "result": common_entity_answer,
-                    "source_documents": [
-                        {
-                            "content": "Information about key Phoenixville officials and representatives.",
-                            "source": "Phoenixville Municipal Records"
-                        }
-                    ],
-                    "query_time": time.time() - start_time,
-                    "total_relevance": 1.0
-                }
-            
-            return self._create_fallback_response(query_text)
+            return None
         
+    def _cached_embedding(self, key: str) -> Optional[List[float]]:
+        with self._embedding_cache_lock:
+            embedding = self._embedding_cache.get(key)
+            if embedding is None:
+                self.embedding_cache_misses += 1
+            else:
+                self.embedding_cache_hits += 1
+                self._embedding_cache.move_to_end(key)
+            return embedding
+
+    def _store_embedding(self, key: str, embedding: List[float]):
+        with self._embedding_cache_lock:
+            self._embedding_cache[key] = embedding
+            self._embedding_cache.move_to_end(key)
+            while len(self._embedding_cache) > self.embedding_cache_size:
+                self._embedding_cache.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        """In-memory counters for /status: cache hit rates and queries in flight."""
+        with self._embedding_cache_lock:
+            lookups = self.embedding_cache_hits + self.embedding_cache_misses
+            embedding_cache = {
+                "entries": len(self._embedding_cache),
+                "hits": self.embedding_cache_hits,
+                "misses": self.embedding_cache_misses,
+                "hit_rate": round(self.embedding_cache_hits / lookups, 3) if lookups else 0.0,
+            }
+        return {
+            "embedding_cache": embedding_cache,
+            "reranker": self.reranker.stats() if self.reranker else None,
+            "in_flight": self.inflight.stats()["in_flight"],
+            "planner_wins": dict(self.planner.wins),
+        }
+
     def _generate_embedding(self, text: str) -> List[float]:
         """Generate a text embedding using OpenAI's text-embedding-ada-002 with 1536 dims"""
+        key = " ".join(text.split())
+        cached = self._cached_embedding(key)
+        if cached is not None:
+            return cached
+        
         try:
             # Using the new OpenAI client with the same model used in database
             response = self.openai_client.embeddings.create(
                 model="text-embedding-ada-002",
                 input=text
             )
-            return response.data[0].embedding
+            embedding = response.data[0].embedding
+            self._store_embedding(key, embedding)
+            return embedding
                 
         except Exception as e:
             logger.error(f"OpenAI embedding generation error: {e}")
             return [0.0] * 1536  # Match Pinecone dimension for text-embedding-ada-002
 
-    def _process_results(self, query_text: str, results, query_time: float) -> Dict[str, Any]:
-        """Process the results from Pinecone query"""
+    def embed_batch(self, texts: List[str]) -> List[List[float]]:
+        """Embed many queries with a single API call, skipping cached ones."""
+        keys = [" ".join(text.split()) for text in texts]
+        embeddings = {}
+        missing = []
+        for key in dict.fromkeys(keys):
+            cached = self._cached_embedding(key)
+            if cached is None:
+                missing.append(key)
+            else:
+                embeddings[key] = cached
+        
+        if missing:
+            try:
+                response = self.openai_client.embeddings.create(
+                    model="text-embedding-ada-002",
+                    input=missing
+                )
+                for key, item in zip(missing, response.data):
+                    embeddings[key] = item.embedding
+                    self._store_embedding(key, item.embedding)
+            except Exception as e:
+                logger.error(f"OpenAI batch embedding generation error: {e}")
+                for key in missing:
+                    embeddings[key] = [0.0] * 1536
         
-        # Log raw results for debugging
-        logger.info(f"Raw results structure: {type(results)}")
+        return [embeddings[key] for key in keys]
+
+    def _process_results(
+        self,
+        query_text: str,
+        results,
+        query_time: float,
+        policy: RetrievalPolicy,
+        cancel: Optional[threading.Event] = None
+    ) -> Optional[Dict[str, Any]]:
+        """Process the results from Pinecone query"""
         
         # Check if we have any matches
         if not hasattr(results, 'matches') or not results.matches:
@@ -140,68 +277,67 @@ class PineconeQueryHandler:
         # Log match count for debugging
         logger.info(f"Found {len(results.matches)} matches")
         
+        # Per-match logging is costly on the request path, so only at debug level
+        debug = logger.isEnabledFor(logging.DEBUG)
+        
         # Extract source documents
-        source_docs = []
-        total_score = 0
+        candidates = []
         
-        for i, match in enumerate(results.matches):
-            # Log each match for debugging
-            logger.info(f"Match {i}: ID={match.id}, Score={match.score}")
-            logger.info(f"Match {i} metadata keys: {match.metadata.keys() if hasattr(match, 'metadata') else 'No metadata'}")
+        with tracer.span("result_processing"):
+            for i, match in enumerate(results.matches):
+                if debug:
+                    logger.debug(f"Match {i}: ID={match.id}, Score={match.score}")
+                    logger.debug(f"Match {i} metadata keys: {match.metadata.keys() if hasattr(match, 'metadata') else 'No metadata'}")
             
-            # Accept all results with positive scores, no matter how small
-            # Skip only if score is negative and very low
-            if match.score < -0.5:  # Much lower threshold to include more results
-                logger.info(f"Skipping match {i} due to very low score: {match.score}")
-                continue
-                    
-            total_score += match.score
-            
-            if hasattr(match, 'metadata') and match.metadata:
-                # Extract text from the 'text' field
-                text = match.metadata.get('text', '')
-                
-                # Use source_title and source_url for the source field
-                source_title = match.metadata.get('source_title', 'Unknown Source')
-                source_url = match.metadata.get('source_url', '')
-                source = f"{source_title} ({source_url})" if source_url else source_title
-                
-                if text:
-                    logger.info(f"Adding document from source: {source}")
-                    source_docs.append({
-                        "content": text.strip(),
-                        "source": source,
-                        "score": match.score
-                    })
+                if hasattr(match, 'metadata') and match.metadata:
+                    # References the match's text and metadata; source is built from
+                    # source_title/source_url only when the response is serialized
+                    chunk = RetrievedChunk.from_match(match)
+                    if chunk is not None:
+                        candidates.append(chunk)
+                    else:
+                        logger.warning(f"Match {i} has no text in metadata")
                 else:
-                    logger.warning(f"Match {i} has no text in metadata")
-            else:
-                logger.warning(f"Match {i} has no metadata")
+                    logger.warning(f"Match {i} has no metadata")
+            
+            # Only the chunks above this query's cutoff are sent to GPT-4; with a
+            # reranker, a wider pool is rescored and only the best few are kept
+            source_docs = None
+            if self.reranker is not None:
+                pool = policy.limited(max(RERANK_CANDIDATES, policy.max_chunks)).select(candidates)
+                source_docs = self.reranker.rerank(query_text, pool, keep=min(RERANK_KEEP, policy.max_chunks))
+            if source_docs is None:
+                source_docs = policy.select(candidates)
+            if debug:
+                logger.debug(f"Forwarding {len(source_docs)} of {len(candidates)} documents: {[doc.source for doc in source_docs]}")
         
         # If no valid documents found
         if not source_docs:
             logger.warning("No valid documents found in results")
             return self._create_fallback_response(query_text)
         
-        # Generate answer from extracted documents
-        answer = self._generate_answer(query_text, source_docs)
+        # Generate answer from extracted documents, unless another branch already answered
+        if cancel is not None and cancel.is_set():
+            return None
+        answer = self._generate_answer(query_text, source_docs, cancel)
         
         # Return processed results
         return {
             "result": answer,
             "source_documents": source_docs,
             "query_time": query_time,
-            "total_relevance": total_score / len(results.matches) if results.matches else 0
+            "total_relevance": sum(doc.score for doc in source_docs) / len(source_docs)
         }
 
-    def _generate_answer(self, query: str, documents: List[Dict]) -> str:
+    def _generate_answer(self, query: str, documents: List[RetrievedChunk], cancel: Optional[threading.Event] = None) -> str:
         """Use OpenAI to synthesize an answer from documents"""
         try:
-            # Calculate average score to determine confidence
-            avg_score = sum(doc.get('score', 0) for doc in documents) / len(documents) if documents else 0
+            with tracer.span("prompt_build"):
+                # Calculate average score to determine confidence
+                avg_score = sum(doc.score for doc in documents) / len(documents) if documents else 0
             
-            # Enhanced system prompt that includes instruction about score
-            system_prompt = """You are a helpful municipal assistant for Phoenixville, PA. 
+                # Enhanced system prompt that includes instruction about score
+                system_prompt = """You are a helpful municipal assistant for Phoenixville, PA. 
     Use the following documents to answer the user's question concisely and clearly.
 
     IMPORTANT: The documents are retrieved using vector similarity search.
@@ -214,23 +350,47 @@ class PineconeQueryHandler:
     Current confidence level based on document relevance: {confidence}
     """.format(confidence="Low" if avg_score < 0.5 else "Medium" if avg_score < 0.8 else "High")
 
-            # Create a context string from the documents
-            context = "\n\n".join([f"Document from {doc['source']} (relevance score: {doc.get('score', 0):.4f}):\n{doc['content']}" for doc in documents])
+                # Keep the most relevant, non-duplicate documents that fit the token budget
+                packed = self.context_packer.pack(
+                    documents,
+                    text_of=lambda doc: doc.text,
+                    score_of=lambda doc: doc.score,
+                    with_text=lambda doc, text: doc.with_text(text)
+                )
+                
+                # Create a context string from the documents
+                context = "\n\n".join([f"Document from {doc.source} (relevance score: {doc.score:.4f}):\n{doc.text.strip()}" for doc in packed])
 
-            # Modified prompt that includes the confidence assessment
-            prompt = f"{system_prompt}\n\nDocuments:\n{context}\n\nQuestion: {query}\nAnswer:"
+                # The instructions go in the system message only
+                prompt = f"Documents:\n{context}\n\nQuestion: {query}\nAnswer:"
 
-            # Using the new OpenAI client with enhanced instructions
-            response = self.openai_client.chat.completions.create(
+            # Stream the completion so time-to-first-token can be measured
+            start = time.perf_counter()
+            stream = self.openai_client.chat.completions.create(
                 model="gpt-4",
                 messages=[
                     {"role": "system", "content": system_prompt},
                     {"role": "user", "content": prompt}
                 ],
                 temperature=0.3,
-                max_tokens=500
+                max_tokens=500,
+                stream=True
             )
-            return response.choices[0].message.content
+            parts = []
+            for chunk in stream:
+                if cancel is not None and cancel.is_set():
+                    # The answer is no longer needed; stop paying for tokens
+                    stream.close()
+                    break
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    if not parts:
+                        tracer.record("llm_ttft", time.perf_counter() - start, start)
+                    parts.append(delta)
+            tracer.record("llm_generation", time.perf_counter() - start, start)
+            return "".join(parts)
 
         except Exception as e:
             logger.error(f"LLM generation error: {e}")
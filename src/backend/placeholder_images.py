@@ -0,0 +1,158 @@
+import asyncio
+import hashlib
+import io
+import os
+import threading
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from PIL import Image, ImageDraw
+
+from request_coalescing import SingleFlight
+
+# Largest side and area accepted; bigger requests are refused before anything is allocated
+PLACEHOLDER_MAX_DIMENSION = int(os.environ.get("PLACEHOLDER_MAX_DIMENSION", 2048))
+PLACEHOLDER_MAX_PIXELS = int(os.environ.get("PLACEHOLDER_MAX_PIXELS", 2048 * 2048))
+PLACEHOLDER_CACHE_ENTRIES = int(os.environ.get("PLACEHOLDER_CACHE_ENTRIES", 256))
+# Placeholders for a given size never change, so clients may keep them
+PLACEHOLDER_CACHE_CONTROL = "public, max-age=86400, immutable"
+
+
+def validate_dimensions(width: int, height: int):
+    """Raise ValueError for sizes outside the configured limits."""
+    if width < 1 or height < 1:
+        raise ValueError("Width and height must be positive")
+    if width > PLACEHOLDER_MAX_DIMENSION or height > PLACEHOLDER_MAX_DIMENSION:
+        raise ValueError(f"Width and height must be at most {PLACEHOLDER_MAX_DIMENSION}")
+    if width * height > PLACEHOLDER_MAX_PIXELS:
+        raise ValueError(f"Images are limited to {PLACEHOLDER_MAX_PIXELS} pixels")
+
+
+def render_placeholder(width: int, height: int) -> bytes:
+    """Gray PNG with a darker one-pixel border."""
+    img = Image.new('RGB', (width, height), color=(200, 200, 200))
+    draw = ImageDraw.Draw(img)
+    draw.rectangle([(0, 0), (width - 1, height - 1)], outline=(100, 100, 100))
+    buffer = io.BytesIO()
+    img.save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """True if an If-None-Match header value covers `etag`."""
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates or f"W/{etag}" in candidates
+
+
+class PlaceholderCache:
+    """
+    LRU cache of encoded placeholder PNGs and their strong ETags, keyed by size.
+
+    Hits are served straight from memory. Misses are rendered on a worker
+    thread, and concurrent requests for the same uncached size share one
+    render.
+    """
+
+    def __init__(self, max_entries: int = PLACEHOLDER_CACHE_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._renders = SingleFlight("placeholder")
+        self.hits = 0
+        self.misses = 0
+
+    def _lookup(self, key: Tuple[int, int]) -> Optional[Tuple[bytes, str]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+            return entry
+
+    def _render(self, key: Tuple[int, int]) -> Tuple[bytes, str]:
+        content = render_placeholder(*key)
+        entry = (content, f'"{key[0]}x{key[1]}-{hashlib.sha1(content).hexdigest()[:16]}"')
+        with self._lock:
+            self.misses += 1
+            self._entries[key] = entry
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+    def get(self, width: int, height: int) -> Tuple[bytes, str]:
+        """(PNG bytes, ETag) for a validated size; renders on a miss."""
+        key = (width, height)
+        return self._lookup(key) or self._renders.do(key, self._render, key)
+
+    async def aget(self, width: int, height: int) -> Tuple[bytes, str]:
+        """Like get(), but renders misses off the event loop."""
+        key = (width, height)
+        return self._lookup(key) or await asyncio.to_thread(self._renders.do, key, self._render, key)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": sum(len(content) for content, _ in self._entries.values()),
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            }
+
+
+# Example usage: requests per second for the frontend's usual sizes, before and after
+if __name__ == "__main__":
+    import random
+    import time
+
+    import httpx
+    from fastapi import FastAPI, Request, Response
+
+    app = FastAPI()
+    cache = PlaceholderCache()
+
+    @app.get("/old/{width}/{height}")
+    async def old(width: int, height: int):
+        return Response(content=render_placeholder(width, height), media_type="image/png")
+
+    @app.get("/new/{width}/{height}")
+    async def new(width: int, height: int, request: Request):
+        validate_dimensions(width, height)
+        content, etag = await cache.aget(width, height)
+        headers = {"ETag": etag, "Cache-Control": PLACEHOLDER_CACHE_CONTROL}
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            return Response(status_code=304, headers=headers)
+        return Response(content=content, media_type="image/png", headers=headers)
+
+    sizes = [(40, 40), (64, 64), (300, 200), (400, 300), (800, 400)]
+    random.seed(5)
+    paths = [random.choice(sizes) for _ in range(600)]
+
+    async def bench(prefix, revalidate=False):
+        etags = {}
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+            start = time.perf_counter()
+            statuses = []
+            for i in range(0, len(paths), 50):
+                async def fetch(size):
+                    headers = {"If-None-Match": etags[size]} if revalidate and size in etags else {}
+                    response = await client.get(f"/{prefix}/{size[0]}/{size[1]}", headers=headers)
+                    if "etag" in response.headers:
+                        etags[size] = response.headers["etag"]
+                    return response.status_code
+                statuses += await asyncio.gather(*(fetch(size) for size in paths[i:i + 50]))
+            elapsed = time.perf_counter() - start
+        return len(paths) / elapsed, statuses
+
+    async def main():
+        for name, prefix, revalidate in (("render per request", "old", False), ("LRU cache", "new", False), ("cache + 304s", "new", True)):
+            rps, statuses = await bench(prefix, revalidate)
+            print(f"{name:18s}: {rps:7.0f} req/s ({statuses.count(304)} not modified)")
+        print(cache.stats())
+        try:
+            validate_dimensions(100000, 100000)
+        except ValueError as e:
+            print(f"100000x100000 refused: {e}")
+
+    asyncio.run(main())
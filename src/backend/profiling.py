@@ -0,0 +1,195 @@
+import hmac
+import logging
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from typing import Any, Dict, Optional
+
+from fastapi import Header, HTTPException
+
+from tracing import Tracer, tracer
+
+logger = logging.getLogger(__name__)
+
+# Shared secret for the /admin/profile endpoints; they are disabled when unset
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN", "")
+
+# Upper bounds for a single profiling request
+PROFILE_MAX_SECONDS = float(os.environ.get("PROFILE_MAX_SECONDS", 120))
+PROFILE_MIN_INTERVAL = 0.001
+
+# Leaf frames of threads that are waiting rather than working (event loop poll, idle pool workers)
+IDLE_FRAMES = {
+    ("selectors.py", "select"),
+    ("threading.py", "wait"),
+    ("queue.py", "get"),
+    ("thread.py", "_worker"),
+}
+
+
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    """FastAPI dependency guarding the profiling endpoints with the X-Admin-Token header."""
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Profiling endpoints are disabled; set ADMIN_TOKEN to enable them")
+    if not x_admin_token or not hmac.compare_digest(x_admin_token, ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+
+def validate_window(seconds: float) -> float:
+    if not 0 < seconds <= PROFILE_MAX_SECONDS:
+        raise ValueError(f"seconds must be in (0, {PROFILE_MAX_SECONDS:g}]")
+    return seconds
+
+
+class Profile:
+    """Stack sample counts from one profiling run."""
+
+    def __init__(self, stacks: Counter, samples: int, duration: float, interval: float):
+        self.stacks = stacks
+        self.samples = samples
+        self.duration = duration
+        self.interval = interval
+
+    def collapsed(self) -> str:
+        """One 'thread;outer;...;inner count' line per stack (flamegraph.pl, speedscope, inferno)."""
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+class SamplingProfiler:
+    """
+    Wall-clock sampler over every thread's Python stack.
+
+    Sampling reads sys._current_frames() from a background loop, so nothing
+    is instrumented while it is off and one run costs a stack walk per thread
+    per interval. Frames of a running coroutine are on the event loop thread's
+    stack, so CPU-bound work inside handlers shows up under that thread.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._labels = {}
+
+    def _label(self, code) -> str:
+        label = self._labels.get(code)
+        if label is None:
+            # Semicolons separate frames in the collapsed format
+            label = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})".replace(";", ":")
+            self._labels[code] = label
+        return label
+
+    def profile(self, seconds: float, interval: float = 0.005, include_idle: bool = False) -> Profile:
+        """Sample for `seconds`; raises RuntimeError if another profile is already running."""
+        validate_window(seconds)
+        interval = max(interval, PROFILE_MIN_INTERVAL)
+        if not self._lock.acquire(blocking=False):
+            raise RuntimeError("A CPU profile is already running")
+        logger.info(f"CPU profile started for {seconds}s at {interval * 1000:.1f} ms intervals")
+        try:
+            me = threading.get_ident()
+            stacks, samples = Counter(), 0
+            start = time.perf_counter()
+            deadline = start + seconds
+            while time.perf_counter() < deadline:
+                names = {thread.ident: thread.name for thread in threading.enumerate()}
+                for ident, frame in sys._current_frames().items():
+                    if ident == me:
+                        continue
+                    code = frame.f_code
+                    if not include_idle and (os.path.basename(code.co_filename), code.co_name) in IDLE_FRAMES:
+                        continue
+                    frames = []
+                    while frame is not None:
+                        frames.append(self._label(frame.f_code))
+                        frame = frame.f_back
+                    frames.append(names.get(ident, f"thread-{ident}").replace(";", ":"))
+                    stacks[";".join(reversed(frames))] += 1
+                samples += 1
+                time.sleep(interval)
+            return Profile(stacks, samples, time.perf_counter() - start, interval)
+        finally:
+            self._lock.release()
+
+
+class AllocationProfiler:
+    """
+    tracemalloc over a window: the source lines whose allocations grew most,
+    and net allocation per route from the tracer.
+
+    tracemalloc slows allocation-heavy code noticeably, so it only runs for
+    the requested window unless it was already enabled (PYTHONTRACEMALLOC).
+    """
+
+    def __init__(self, tracer: Tracer = tracer):
+        self.tracer = tracer
+        self._lock = threading.Lock()
+
+    def window(self, seconds: float, top: int = 25, frames: int = 1) -> Dict[str, Any]:
+        """Block for `seconds` and return the diff; raises RuntimeError if a window is already open."""
+        validate_window(seconds)
+        if not self._lock.acquire(blocking=False):
+            raise RuntimeError("An allocation profile is already running")
+        logger.info(f"Allocation profile started for {seconds}s")
+        started_here = not tracemalloc.is_tracing()
+        try:
+            if started_here:
+                tracemalloc.start(max(1, frames))
+            self.tracer.reset_allocations()
+            before = tracemalloc.take_snapshot()
+            time.sleep(seconds)
+            after = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            routes = self.tracer.allocations()
+        finally:
+            if started_here:
+                tracemalloc.stop()
+            self._lock.release()
+
+        ignore = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, "<frozen importlib._bootstrap*>")]
+        group_by = "traceback" if frames > 1 else "lineno"
+        diff = after.filter_traces(ignore).compare_to(before.filter_traces(ignore), group_by)
+        return {
+            "window_s": seconds,
+            "traced_kb": {"current": round(current / 1024, 1), "peak": round(peak / 1024, 1)},
+            "top": [
+                {
+                    "traceback": [f"{frame.filename}:{frame.lineno}" for frame in stat.traceback],
+                    "size_diff_kb": round(stat.size_diff / 1024, 1),
+                    "count_diff": stat.count_diff,
+                    "size_kb": round(stat.size / 1024, 1),
+                }
+                for stat in diff[:top]
+            ],
+            "routes": routes,
+        }
+
+
+# Process-wide profilers shared by the API modules
+sampling_profiler = SamplingProfiler()
+allocation_profiler = AllocationProfiler()
+
+
+# Example usage: profile a busy thread and print the hottest stacks
+if __name__ == "__main__":
+    def busy():
+        deadline = time.time() + 1.5
+        while time.time() < deadline:
+            sorted(str(i) for i in range(2000))
+
+    worker = threading.Thread(target=busy, name="busy")
+    worker.start()
+    profile = sampling_profiler.profile(1.0, interval=0.002)
+    worker.join()
+    print(f"{profile.samples} samples over {profile.duration:.2f}s")
+    print(profile.collapsed()[:600])
+
+    retained = []
+    worker = threading.Thread(target=lambda: [retained.append(bytearray(1024)) or time.sleep(0.0005) for _ in range(500)])
+    worker.start()
+    result = allocation_profiler.window(0.5)
+    worker.join()
+    print(f"Traced {result['traced_kb']}; largest growth:")
+    for stat in result["top"][:3]:
+        print(f"  {stat['traceback'][0]}: {stat['size_diff_kb']:+} KB in {stat['count_diff']:+} blocks")
@@ -0,0 +1,138 @@
+import contextvars
+import logging
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, List, Optional, Tuple
+
+from tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+# Shared by all planners; each query uses one thread per branch
+PLANNER_WORKERS = int(os.environ.get("PLANNER_WORKERS", 32))
+_executor = ThreadPoolExecutor(max_workers=PLANNER_WORKERS, thread_name_prefix="query-planner")
+
+
+def queued_branches() -> int:
+    """Branches waiting for a free planner thread."""
+    return _executor._work_queue.qsize()
+
+
+class Branch:
+    """
+    One way of answering a query.
+
+    `fn(cancel)` returns a result or None; it should check the
+    threading.Event `cancel` before expensive steps (e.g. LLM generation) and
+    give up early once it is set. `confident(result)` decides whether the
+    result can be returned without waiting for the other branches.
+    """
+
+    def __init__(self, name: str, fn: Callable[[threading.Event], Any], confident: Callable[[Any], bool] = lambda result: True):
+        self.name = name
+        self.fn = fn
+        self.confident = confident
+
+
+class QueryPlanner:
+    """
+    Runs a query's branches concurrently and returns the first confident
+    result, cancelling the rest. If no branch is confident, the first
+    non-None result in branch order wins.
+    """
+
+    def __init__(self, timeout: Optional[float] = None):
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self.wins = {}
+
+    def run(self, branches: List[Branch]) -> Tuple[Any, Optional[str]]:
+        """Return (result, winning branch name); (None, None) if every branch came up empty."""
+        cancel = threading.Event()
+        futures = {}
+        for branch in branches:
+            # Each branch runs in its own copy of the context so its spans land in this request's trace
+            context = contextvars.copy_context()
+            futures[_executor.submit(context.run, self._run_branch, branch, cancel)] = branch
+
+        results = {}
+        pending = set(futures)
+        deadline = time.monotonic() + self.timeout if self.timeout else None
+        try:
+            while pending:
+                remaining = deadline - time.monotonic() if deadline else None
+                if remaining is not None and remaining <= 0:
+                    logger.warning(f"Query planner timed out waiting for {[futures[f].name for f in pending]}")
+                    break
+                done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+                for future in done:
+                    branch = futures[future]
+                    result = future.result()
+                    results[branch.name] = result
+                    if result is not None and branch.confident(result):
+                        return self._won(result, branch.name)
+
+            for branch in branches:
+                if results.get(branch.name) is not None:
+                    return self._won(results[branch.name], branch.name)
+            return None, None
+        finally:
+            # Losing branches stop at their next cancellation check; queued ones never start
+            cancel.set()
+            for future in pending:
+                future.cancel()
+
+    @staticmethod
+    def _run_branch(branch: Branch, cancel: threading.Event) -> Any:
+        if cancel.is_set():
+            return None
+        try:
+            with tracer.span(f"branch_{branch.name}"):
+                return branch.fn(cancel)
+        except Exception as e:
+            logger.error(f"Query branch {branch.name} failed: {e}")
+            return None
+
+    def _won(self, result: Any, name: str) -> Tuple[Any, str]:
+        with self._lock:
+            self.wins[name] = self.wins.get(name, 0) + 1
+        return result, name
+
+
+# Example usage: latency of entity questions, sequential vs planned
+if __name__ == "__main__":
+    import random
+
+    def fast_path(cancel):
+        time.sleep(0.001)
+        return "Peter Urscheler" if "mayor" in question else None
+
+    def vector_path(cancel):
+        # Embedding + Pinecone, then LLM generation unless cancelled
+        time.sleep(random.uniform(0.05, 0.3))
+        if cancel.is_set():
+            return None
+        time.sleep(random.uniform(0.5, 2.5))
+        return "generated answer"
+
+    planner = QueryPlanner()
+    random.seed(1)
+    question = "Who is the mayor?"
+    sequential, planned = [], []
+    for _ in range(30):
+        start = time.perf_counter()
+        # Before: retrieval and generation always ran, then the answer was checked
+        vector_path(threading.Event())
+        fast_path(None)
+        sequential.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        planner.run([Branch("fast_path", fast_path), Branch("vector", vector_path)])
+        planned.append(time.perf_counter() - start)
+
+    for name, samples in (("sequential", sequential), ("planned", planned)):
+        samples.sort()
+        print(f"{name:10s}: p50 {samples[len(samples) // 2] * 1000:7.1f} ms, max {samples[-1] * 1000:7.1f} ms")
+    print(f"wins: {planner.wins}")
@@ -0,0 +1,3 @@
+def normalize_query(text: str) -> str:
+    """Canonical form of a question, used to dedupe requests and build cache keys."""
+    return " ".join(text.lower().split()).rstrip("?.! ")
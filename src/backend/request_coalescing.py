@@ -0,0 +1,201 @@
+import asyncio
+import json
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+from query_utils import normalize_query
+
+
+def coalescing_key(query: str, context_filter: Optional[Dict] = None, *extra: Any) -> Tuple:
+    """Key identical questions: normalized text plus the filter and any other options."""
+    filter_key = json.dumps(context_filter, sort_keys=True, default=str) if context_filter else ""
+    return (normalize_query(query), filter_key) + extra
+
+
+class SingleFlight:
+    """
+    Share one in-flight call between concurrent callers with the same key.
+
+    The first caller (the leader) runs the function; callers arriving while
+    it is running wait for the same result instead of repeating the work.
+    Nothing is cached once the call completes.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.requests = 0
+        self.executions = 0
+
+    def do(self, key: Hashable, fn: Callable, *args, **kwargs):
+        with self._lock:
+            self.requests += 1
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+                self.executions += 1
+
+        if not leader:
+            result = future.result()
+            # Followers get their own top-level copy so callers can't step on each other
+            return dict(result) if isinstance(result, dict) else result
+
+        try:
+            result = fn(*args, **kwargs)
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "upstream_calls": self.executions,
+                "coalesced": self.requests - self.executions,
+                "in_flight": len(self._calls),
+            }
+
+
+_END = object()
+
+
+class TokenBroadcast:
+    """
+    Fan a token stream produced on one thread out to any number of asyncio
+    subscribers. Late subscribers first replay the tokens already produced.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.tokens = []
+        self.done = False
+        self._subscribers = []
+        self._subscribed = False
+
+    def publish(self, token: str):
+        with self._lock:
+            self.tokens.append(token)
+            subscribers = list(self._subscribers)
+        for loop, queue in subscribers:
+            loop.call_soon_threadsafe(queue.put_nowait, token)
+
+    def close(self):
+        with self._lock:
+            self.done = True
+            subscribers, self._subscribers = self._subscribers, []
+        for loop, queue in subscribers:
+            loop.call_soon_threadsafe(queue.put_nowait, _END)
+
+    @property
+    def abandoned(self) -> bool:
+        """True once every subscriber has gone away before the stream finished."""
+        with self._lock:
+            return self._subscribed and not self._subscribers and not self.done
+
+    async def subscribe(self):
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        subscription = (loop, queue)
+        with self._lock:
+            backlog = list(self.tokens)
+            done = self.done
+            if not done:
+                self._subscribers.append(subscription)
+                self._subscribed = True
+
+        try:
+            for token in backlog:
+                yield token
+            if done:
+                return
+            while True:
+                token = await queue.get()
+                if token is _END:
+                    return
+                yield token
+        finally:
+            with self._lock:
+                if subscription in self._subscribers:
+                    self._subscribers.remove(subscription)
+
+
+class StreamCoalescer:
+    """Registry of in-flight token streams, so identical streaming requests share one generation."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock()
+        self._streams = {}
+        self.requests = 0
+        self.executions = 0
+
+    def join(self, key: Hashable) -> Tuple[TokenBroadcast, bool]:
+        """Return the stream for `key` and whether the caller must produce it."""
+        with self._lock:
+            self.requests += 1
+            broadcast = self._streams.get(key)
+            if broadcast is not None:
+                return broadcast, False
+            broadcast = self._streams[key] = TokenBroadcast()
+            self.executions += 1
+            return broadcast, True
+
+    def finish(self, key: Hashable, broadcast: TokenBroadcast):
+        """Close the stream and stop routing new requests to it."""
+        with self._lock:
+            if self._streams.get(key) is broadcast:
+                del self._streams[key]
+        broadcast.close()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "upstream_calls": self.executions,
+                "coalesced": self.requests - self.executions,
+                "in_flight": len(self._streams),
+            }
+
+
+def render_coalescing_metrics(*flights, prefix: str = "govify") -> str:
+    """Prometheus counters for SingleFlight/StreamCoalescer instances."""
+    lines = [
+        f"# TYPE {prefix}_coalescing_requests_total counter",
+        f"# TYPE {prefix}_coalescing_upstream_calls_total counter",
+    ]
+    for flight in flights:
+        stats = flight.stats()
+        lines.append(f'{prefix}_coalescing_requests_total{{flight="{flight.name}"}} {stats["requests"]}')
+        lines.append(f'{prefix}_coalescing_upstream_calls_total{{flight="{flight.name}"}} {stats["upstream_calls"]}')
+    return "\n".join(lines) + "\n"
+
+
+# Example usage: a synthetic burst of identical questions
+if __name__ == "__main__":
+    import time
+    from concurrent.futures import ThreadPoolExecutor
+
+    upstream_calls = 0
+
+    def slow_answer(question):
+        global upstream_calls
+        upstream_calls += 1
+        time.sleep(0.5)  # embedding + vector query + LLM
+        return {"result": f"answer to {question}"}
+
+    flight = SingleFlight("query")
+    questions = ["When is trash pickup?", "when is trash pickup", "When is  trash pickup?!"] * 20 + ["Is the pool open?"] * 10
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=len(questions)) as pool:
+        list(pool.map(lambda q: flight.do(coalescing_key(q), slow_answer, q), questions))
+    print(f"{len(questions)} requests, {upstream_calls} upstream calls in {time.perf_counter() - start:.2f}s")
+    print(flight.stats())
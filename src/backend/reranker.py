@@ -0,0 +1,193 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+from query_utils import normalize_query
+from tracing import tracer
+
+try:
+    from sentence_transformers import CrossEncoder
+except ImportError:
+    CrossEncoder = None
+
+logger = logging.getLogger(__name__)
+
+RERANK_ENABLED = os.environ.get("RERANK_ENABLED", "false").lower() == "true"
+RERANKER_MODEL = os.environ.get("RERANKER_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+# Candidates scored per query, and how many of them go to the LLM afterwards
+RERANK_CANDIDATES = int(os.environ.get("RERANK_CANDIDATES", 10))
+RERANK_KEEP = int(os.environ.get("RERANK_KEEP", 3))
+
+
+class Reranker:
+    """
+    Re-orders retrieved chunks with a cross-encoder and keeps the best few.
+
+    (query, chunk) pairs are scored in batches and cached by normalized query
+    and chunk id. Reranking is skipped, and rerank() returns None so the
+    caller keeps its vector-score order, when the model is unavailable, when
+    `max_concurrent` reranks are already running, or when the expected
+    scoring time for the uncached pairs exceeds `latency_budget_ms`.
+    """
+
+    def __init__(
+        self,
+        model_name: str = RERANKER_MODEL,
+        batch_size: int = 32,
+        latency_budget_ms: float = float(os.environ.get("RERANK_BUDGET_MS", 150)),
+        max_concurrent: int = int(os.environ.get("RERANK_MAX_CONCURRENT", 2)),
+        cache_size: int = 10000,
+        model: Any = None
+    ):
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.latency_budget = latency_budget_ms / 1000.0
+        self.cache_size = cache_size
+
+        self._model = model
+        self._model_failed = False
+        self._model_lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_concurrent)
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+        # Running estimate of scoring time per pair, refined after every batch
+        self._seconds_per_pair = None
+
+        self.reranked = 0
+        self.skipped_load = 0
+        self.skipped_budget = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def _get_model(self):
+        if self._model is None and not self._model_failed:
+            with self._model_lock:
+                if self._model is None and not self._model_failed:
+                    if CrossEncoder is None:
+                        logger.warning("sentence-transformers is not installed; reranking is disabled")
+                        self._model_failed = True
+                    else:
+                        try:
+                            self._model = CrossEncoder(self.model_name)
+                        except Exception as e:
+                            logger.error(f"Error loading reranker model {self.model_name}: {e}")
+                            self._model_failed = True
+        return self._model
+
+    def _score(self, query: str, chunks: List[Any]) -> Optional[List[float]]:
+        query_key = normalize_query(query)
+        scores = [None] * len(chunks)
+        missing = []
+        with self._cache_lock:
+            for i, chunk in enumerate(chunks):
+                cached = self._cache.get((query_key, chunk.id))
+                if cached is None:
+                    missing.append(i)
+                else:
+                    self._cache.move_to_end((query_key, chunk.id))
+                    scores[i] = cached
+            self.cache_hits += len(chunks) - len(missing)
+            self.cache_misses += len(missing)
+
+        if missing:
+            if self._seconds_per_pair is not None and self._seconds_per_pair * len(missing) > self.latency_budget:
+                self.skipped_budget += 1
+                return None
+
+            model = self._get_model()
+            start = time.perf_counter()
+            predicted = model.predict([(query, chunks[i].text) for i in missing], batch_size=self.batch_size)
+            per_pair = (time.perf_counter() - start) / len(missing)
+            self._seconds_per_pair = per_pair if self._seconds_per_pair is None else 0.8 * self._seconds_per_pair + 0.2 * per_pair
+
+            with self._cache_lock:
+                for i, score in zip(missing, predicted):
+                    scores[i] = float(score)
+                    self._cache[(query_key, chunks[i].id)] = float(score)
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return scores
+
+    def rerank(self, query: str, chunks: List[Any], keep: int = RERANK_KEEP) -> Optional[List[Any]]:
+        """Best `keep` chunks by cross-encoder score, or None if reranking was skipped."""
+        if not chunks or self._get_model() is None:
+            return None
+        if not self._slots.acquire(blocking=False):
+            self.skipped_load += 1
+            return None
+        try:
+            with tracer.span("rerank"):
+                scores = self._score(query, chunks)
+            if scores is None:
+                return None
+            self.reranked += 1
+            order = sorted(range(len(chunks)), key=lambda i: scores[i], reverse=True)
+            return [chunks[i] for i in order[:keep]]
+        except Exception as e:
+            logger.error(f"Reranking failed, keeping vector order: {e}")
+            return None
+        finally:
+            self._slots.release()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.cache_hits + self.cache_misses
+        return {
+            "enabled": self._model is not None,
+            "reranked": self.reranked,
+            "skipped_load": self.skipped_load,
+            "skipped_budget": self.skipped_budget,
+            "cache_hit_rate": round(self.cache_hits / lookups, 3) if lookups else 0.0,
+            "ms_per_pair": round(self._seconds_per_pair * 1000, 3) if self._seconds_per_pair else None,
+        }
+
+
+def get_reranker() -> Optional[Reranker]:
+    """A Reranker if RERANK_ENABLED=true, else None."""
+    return Reranker() if RERANK_ENABLED else None
+
+
+# Example usage: budget, load shedding and cache behaviour with a stub scorer
+if __name__ == "__main__":
+    import re
+    from concurrent.futures import ThreadPoolExecutor
+
+    from retrieval_types import RetrievedChunk
+
+    class StubCrossEncoder:
+        """Word-overlap scorer costing ~2 ms per pair, standing in for a MiniLM cross-encoder on CPU."""
+
+        def predict(self, pairs, batch_size=32):
+            time.sleep(0.002 * len(pairs))
+            scores = []
+            for query, text in pairs:
+                query_words = set(re.findall(r"\w+", query.lower()))
+                scores.append(len(query_words & set(re.findall(r"\w+", text.lower()))) / (len(query_words) or 1))
+            return scores
+
+    texts = [
+        "Borough Hall office hours are Monday through Friday, 8:00 AM to 4:30 PM.",
+        "The Borough Hall building was renovated in 1998.",
+        "Council meetings are held at Borough Hall on the second Tuesday.",
+        "Trash is collected once a week on your designated day.",
+        "Office hours for the codes department are 9 AM to 3 PM.",
+    ] * 4
+    chunks = [RetrievedChunk(f"chunk-{i}", 0.8 - i * 0.01, text, {"source": "stub"}) for i, text in enumerate(texts)]
+
+    reranker = Reranker(model=StubCrossEncoder(), latency_budget_ms=60, max_concurrent=2)
+    question = "What are Borough Hall office hours?"
+
+    start = time.perf_counter()
+    kept = reranker.rerank(question, chunks[:10], keep=3)
+    print(f"cold: {(time.perf_counter() - start) * 1000:.1f} ms -> {[c.id for c in kept]}")
+    start = time.perf_counter()
+    reranker.rerank(question, chunks[:10], keep=3)
+    print(f"cached: {(time.perf_counter() - start) * 1000:.2f} ms")
+    print(f"40 new candidates (over budget): {reranker.rerank('When is trash pickup?', chunks * 2, keep=3)}")
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        results = list(pool.map(lambda i: reranker.rerank(f"question {i} about borough hall", chunks[:10]), range(8)))
+    print(f"8 concurrent: {sum(r is not None for r in results)} reranked, {sum(r is None for r in results)} skipped under load")
+    print(reranker.stats())
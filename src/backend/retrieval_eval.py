@@ -0,0 +1,493 @@
+import argparse
+import hashlib
+import json
+import logging
+import math
+import os
+import re
+import sys
+import time
+from collections import Counter
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from local_backends import HashEmbedder, load_corpus, minilm_embedder, sample_corpus, sample_questions
+from retrieval_policy import CALIBRATED_MIN_SCORES, RetrievalPolicy
+from retrieval_types import RetrievedChunk
+
+logger = logging.getLogger(__name__)
+
+EVAL_K = (1, 3, 5, 10)
+# Vectors of remote embedding models, so they only have to be fetched once
+EVAL_EMBEDDING_CACHE = os.environ.get("EVAL_EMBEDDING_CACHE", "eval_embeddings")
+
+_WORD = re.compile(r"[a-z0-9]+")
+
+
+# Metrics (binary relevance)
+
+def recall_at_k(ranked: Sequence[str], relevant: set, k: int) -> float:
+    return len(relevant.intersection(ranked[:k])) / len(relevant) if relevant else 0.0
+
+
+def reciprocal_rank(ranked: Sequence[str], relevant: set) -> float:
+    for position, chunk_id in enumerate(ranked, 1):
+        if chunk_id in relevant:
+            return 1.0 / position
+    return 0.0
+
+
+def ndcg_at_k(ranked: Sequence[str], relevant: set, k: int) -> float:
+    dcg = sum(1.0 / math.log2(position + 1) for position, chunk_id in enumerate(ranked[:k], 1) if chunk_id in relevant)
+    ideal = sum(1.0 / math.log2(position + 1) for position in range(1, min(len(relevant), k) + 1))
+    return dcg / ideal if ideal else 0.0
+
+
+# Embedders
+
+class OpenAIEmbedder:
+    """text-embedding-ada-002 through the OpenAI API, in batches."""
+
+    def __init__(self, model: str = "text-embedding-ada-002", batch_size: int = 256):
+        from openai import OpenAI
+        self.client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+        self.model = model
+        self.batch_size = batch_size
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        vectors = []
+        for start in range(0, len(texts), self.batch_size):
+            response = self.client.embeddings.create(model=self.model, input=texts[start:start + self.batch_size])
+            vectors.extend(item.embedding for item in response.data)
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+class CachedEmbedder:
+    """
+    Embeddings persisted to `<cache_dir>/<name>.npz`, keyed by text hash.
+
+    With `offline=True`, texts missing from the cache raise LookupError
+    instead of calling the wrapped model (which may be None).
+    """
+
+    def __init__(self, name: str, embedder: Any = None, cache_dir: str = EVAL_EMBEDDING_CACHE, offline: bool = True):
+        self.name = name
+        self.embedder = embedder
+        self.offline = offline
+        self.path = os.path.join(cache_dir, f"{name}.npz")
+        self._vectors = {}
+        if os.path.exists(self.path):
+            data = np.load(self.path)
+            self._vectors = dict(zip(data["keys"].tolist(), data["vectors"]))
+        self._dirty = False
+
+    @staticmethod
+    def _key(text: str) -> str:
+        return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [self._key(text) for text in texts]
+        missing = [text for key, text in dict(zip(keys, texts)).items() if key not in self._vectors]
+        if missing:
+            if self.offline or self.embedder is None:
+                raise LookupError(f"{len(missing)} texts are not in {self.path}; run once with --online to fetch them")
+            for text, vector in zip(missing, self.embedder.embed_documents(missing)):
+                self._vectors[self._key(text)] = np.asarray(vector, dtype=np.float32)
+            self._dirty = True
+        return [self._vectors[key] for key in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+    def save(self):
+        if self._dirty:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            keys = list(self._vectors)
+            np.savez(self.path, keys=np.array(keys), vectors=np.stack([self._vectors[k] for k in keys]))
+            self._dirty = False
+
+
+# Retrievers: search(query, k) -> [(record position, score)], best first
+
+class DenseRetriever:
+    """
+    Cosine search over embedded records: exact, int8 scalar-quantized, or
+    IVF (k-means partitions, `nprobe` of them searched) as the ANN stand-in.
+    """
+
+    def __init__(self, records: List[Dict[str, Any]], embedder: Any, quantize: bool = False,
+                 nlist: Optional[int] = None, nprobe: int = 4, seed: int = 0):
+        self.embedder = embedder
+        matrix = np.asarray(embedder.embed_documents([r["text"] for r in records]), dtype=np.float32)
+        matrix /= np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+        self.quantize = quantize
+        if quantize:
+            # Per-dimension symmetric int8 scales; 4x smaller than float32
+            self.scale = np.maximum(np.abs(matrix).max(axis=0), 1e-12) / 127.0
+            self.codes = np.round(matrix / self.scale).astype(np.int8)
+            self.index_bytes = self.codes.nbytes + self.scale.nbytes
+        else:
+            self.matrix = matrix
+            self.index_bytes = matrix.nbytes
+        self.nprobe = nprobe
+        self.lists = None
+        if nlist:
+            self.centroids, assignment = _kmeans(matrix, nlist, seed)
+            self.lists = [np.flatnonzero(assignment == c) for c in range(len(self.centroids))]
+
+    def _scores(self, query: np.ndarray, rows: Optional[np.ndarray]) -> np.ndarray:
+        if self.quantize:
+            codes = self.codes if rows is None else self.codes[rows]
+            return codes.astype(np.float32) @ (query * self.scale)
+        return (self.matrix if rows is None else self.matrix[rows]) @ query
+
+    def search(self, query: str, k: int) -> List[Tuple[int, float]]:
+        vector = np.asarray(self.embedder.embed_query(query), dtype=np.float32)
+        vector /= max(np.linalg.norm(vector), 1e-12)
+        rows = None
+        if self.lists is not None:
+            probes = np.argsort(-(self.centroids @ vector))[:self.nprobe]
+            rows = np.concatenate([self.lists[c] for c in probes])
+        scores = self._scores(vector, rows)
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        positions = top if rows is None else rows[top]
+        return [(int(p), float(s)) for p, s in zip(positions, scores[top])]
+
+
+def _kmeans(matrix: np.ndarray, nlist: int, seed: int, iterations: int = 10) -> Tuple[np.ndarray, np.ndarray]:
+    """Spherical k-means (cosine) for the IVF partitions."""
+    rng = np.random.default_rng(seed)
+    centroids = matrix[rng.choice(len(matrix), size=min(nlist, len(matrix)), replace=False)]
+    for _ in range(iterations):
+        assignment = np.argmax(matrix @ centroids.T, axis=1)
+        for c in range(len(centroids)):
+            members = matrix[assignment == c]
+            if len(members):
+                centroid = members.sum(axis=0)
+                centroids[c] = centroid / max(np.linalg.norm(centroid), 1e-12)
+    return centroids, np.argmax(matrix @ centroids.T, axis=1)
+
+
+class BM25Retriever:
+    """Okapi BM25 over an inverted index of lowercased word tokens."""
+
+    def __init__(self, records: List[Dict[str, Any]], k1: float = 1.5, b: float = 0.75):
+        self.k1, self.b = k1, b
+        self.postings: Dict[str, List[Tuple[int, int]]] = {}
+        self.lengths = np.zeros(len(records), dtype=np.float32)
+        for position, record in enumerate(records):
+            terms = Counter(_WORD.findall(record["text"].lower()))
+            self.lengths[position] = sum(terms.values())
+            for term, count in terms.items():
+                self.postings.setdefault(term, []).append((position, count))
+        self.avg_length = float(self.lengths.mean()) if len(records) else 0.0
+        self.index_bytes = sum(len(p) for p in self.postings.values()) * 16
+
+    def search(self, query: str, k: int) -> List[Tuple[int, float]]:
+        scores = np.zeros(len(self.lengths), dtype=np.float32)
+        n = len(self.lengths)
+        for term in set(_WORD.findall(query.lower())):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+            positions = np.fromiter((p for p, _ in postings), dtype=np.int64, count=len(postings))
+            tf = np.fromiter((c for _, c in postings), dtype=np.float32, count=len(postings))
+            norm = self.k1 * (1 - self.b + self.b * self.lengths[positions] / self.avg_length)
+            scores[positions] += idf * tf * (self.k1 + 1) / (tf + norm)
+        k = min(k, n)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(p), float(scores[p])) for p in top if scores[p] > 0]
+
+
+class HybridRetriever:
+    """Dense and BM25 results merged with reciprocal rank fusion."""
+
+    def __init__(self, dense: DenseRetriever, bm25: BM25Retriever, depth: int = 50, rrf_k: int = 60):
+        self.dense, self.bm25, self.depth, self.rrf_k = dense, bm25, depth, rrf_k
+        self.index_bytes = dense.index_bytes + bm25.index_bytes
+
+    def search(self, query: str, k: int) -> List[Tuple[int, float]]:
+        fused = {}
+        for results in (self.dense.search(query, self.depth), self.bm25.search(query, self.depth)):
+            for rank, (position, _) in enumerate(results, 1):
+                fused[position] = fused.get(position, 0.0) + 1.0 / (self.rrf_k + rank)
+        return sorted(fused.items(), key=lambda item: item[1], reverse=True)[:k]
+
+
+class RerankedRetriever:
+    """Dense candidates re-ordered by the production cross-encoder Reranker."""
+
+    def __init__(self, dense: DenseRetriever, records: List[Dict[str, Any]], reranker: Any, candidates: int = 20):
+        self.dense, self.records, self.reranker, self.candidates = dense, records, reranker, candidates
+        self.index_bytes = dense.index_bytes
+
+    def search(self, query: str, k: int) -> List[Tuple[int, float]]:
+        results = self.dense.search(query, max(k, self.candidates))
+        chunks = [RetrievedChunk(str(p), s, self.records[p]["text"], self.records[p]["metadata"]) for p, s in results]
+        reranked = self.reranker.rerank(query, chunks, keep=len(chunks))
+        if reranked is None:
+            raise RuntimeError("reranker skipped the query")
+        return [(int(chunk.id), chunk.score) for chunk in reranked[:k]]
+
+
+# Evaluation
+
+def evaluate(name: str, retriever: Any, records: List[Dict[str, Any]], questions: List[Dict[str, Any]],
+             policy: Optional[RetrievalPolicy] = None, depth: int = 10) -> Dict[str, Any]:
+    """Ranking metrics, per-query latency and (for cosine scores) what the retrieval policy would forward."""
+    metrics = {f"recall@{k}": 0.0 for k in EVAL_K}
+    metrics.update({"mrr": 0.0, "ndcg@10": 0.0})
+    forwarded, forwarded_recall = 0, 0.0
+    latencies = []
+    for question in questions:
+        relevant = set(question["relevant"])
+        start = time.perf_counter()
+        results = retriever.search(question["query"], max(depth, policy.fetch_k if policy else 0))
+        latencies.append(time.perf_counter() - start)
+        ranked = [records[p]["id"] for p, _ in results]
+        for k in EVAL_K:
+            metrics[f"recall@{k}"] += recall_at_k(ranked, relevant, k)
+        metrics["mrr"] += reciprocal_rank(ranked, relevant)
+        metrics["ndcg@10"] += ndcg_at_k(ranked, relevant, 10)
+        if policy is not None:
+            selected = policy.select(results, score_of=lambda r: r[1])
+            forwarded += len(selected)
+            forwarded_recall += recall_at_k([records[p]["id"] for p, _ in selected], relevant, len(selected))
+
+    n = len(questions)
+    latencies.sort()
+    result = {
+        "config": name,
+        **{metric: round(total / n, 4) for metric, total in metrics.items()},
+        "latency_p50_ms": round(latencies[n // 2] * 1000, 3),
+        "latency_p95_ms": round(latencies[min(n - 1, int(math.ceil(0.95 * n)) - 1)] * 1000, 3),
+        "index_mb": round(getattr(retriever, "index_bytes", 0) / 2 ** 20, 2),
+    }
+    if policy is not None:
+        result["policy_forwarded"] = round(forwarded / n, 2)
+        result["policy_recall"] = round(forwarded_recall / n, 4)
+    return result
+
+
+def pareto_front(results: List[Dict[str, Any]], quality: str = "ndcg@10", cost: str = "latency_p95_ms") -> List[Dict[str, Any]]:
+    """Configurations no other configuration beats on both quality and latency."""
+    front = [r for r in results if not any(
+        o[quality] >= r[quality] and o[cost] <= r[cost] and (o[quality] > r[quality] or o[cost] < r[cost]) for o in results
+    )]
+    return sorted(front, key=lambda r: r[cost])
+
+
+def pareto_svg(results: List[Dict[str, Any]], quality: str = "ndcg@10", cost: str = "latency_p95_ms",
+               width: int = 720, height: int = 440) -> str:
+    """Scatter of quality vs latency (log scale) with the Pareto front highlighted, as standalone SVG."""
+    left, right, top, bottom = 70, 30, 30, 50
+    costs = [max(r[cost], 1e-3) for r in results]
+    low, high = math.log10(min(costs)) - 0.1, math.log10(max(costs)) + 0.1
+    q_low = min(0.0, min(r[quality] for r in results))
+
+    def x(value):
+        return left + (math.log10(max(value, 1e-3)) - low) / (high - low) * (width - left - right)
+
+    def y(value):
+        return height - bottom - (value - q_low) / (1.0 - q_low) * (height - top - bottom)
+
+    front = pareto_front(results, quality, cost)
+    parts = [
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" font-family="sans-serif" font-size="11">',
+        f'<rect width="{width}" height="{height}" fill="white"/>',
+        f'<line x1="{left}" y1="{height - bottom}" x2="{width - right}" y2="{height - bottom}" stroke="black"/>',
+        f'<line x1="{left}" y1="{top}" x2="{left}" y2="{height - bottom}" stroke="black"/>',
+        f'<text x="{(width + left) / 2}" y="{height - 12}" text-anchor="middle">{cost} (log scale)</text>',
+        f'<text x="16" y="{(height - bottom + top) / 2}" transform="rotate(-90 16 {(height - bottom + top) / 2})" text-anchor="middle">{quality}</text>',
+    ]
+    for exponent in range(math.ceil(low), math.floor(high) + 1):
+        tick = 10 ** exponent
+        parts.append(f'<text x="{x(tick):.1f}" y="{height - bottom + 16}" text-anchor="middle">{tick:g}</text>')
+    for step in range(6):
+        value = q_low + (1.0 - q_low) * step / 5
+        parts.append(f'<text x="{left - 8}" y="{y(value) + 4:.1f}" text-anchor="end">{value:.1f}</text>')
+    if len(front) > 1:
+        points = " ".join(f"{x(r[cost]):.1f},{y(r[quality]):.1f}" for r in front)
+        parts.append(f'<polyline points="{points}" fill="none" stroke="#d62728" stroke-dasharray="4 3"/>')
+    for r in results:
+        color = "#d62728" if r in front else "#1f77b4"
+        parts.append(f'<circle cx="{x(r[cost]):.1f}" cy="{y(r[quality]):.1f}" r="5" fill="{color}"/>')
+        parts.append(f'<text x="{x(r[cost]) + 8:.1f}" y="{y(r[quality]) - 6:.1f}">{r["config"]}</text>')
+    parts.append("</svg>")
+    return "\n".join(parts)
+
+
+def build_configs(args: argparse.Namespace, records: List[Dict[str, Any]], embedders: Dict[str, Any]):
+    """Yield (name, retriever factory, policy factory) for the requested configurations; embedders are shared via `embedders`."""
+
+    def embedder(name):
+        if name not in embedders:
+            if name == "hash":
+                embedders[name] = HashEmbedder(dim=384)
+            elif name == "minilm":
+                model = minilm_embedder(target_dim=1024)
+                if model is None:
+                    raise ImportError("sentence-transformers is not installed")
+                embedders[name] = model
+            elif name == "ada-002":
+                embedders[name] = CachedEmbedder("ada-002", OpenAIEmbedder() if args.online else None, args.embedding_cache, offline=not args.online)
+            else:
+                raise ValueError(f"Unknown embedder {name!r}")
+        return embedders[name]
+
+    def policy(name):
+        # The hashing stand-in is uncalibrated and scores lower than real models
+        calibrated = {"hash": 0.2, "minilm": CALIBRATED_MIN_SCORES["all-MiniLM-L6-v2"], "ada-002": CALIBRATED_MIN_SCORES["text-embedding-ada-002"]}
+        min_score = args.min_score if args.min_score is not None else calibrated[name]
+        return RetrievalPolicy(max_chunks=args.target_chunks, min_score=min_score)
+
+    base = args.base
+    dense_cache = {}
+
+    def dense(name):
+        if name not in dense_cache:
+            dense_cache[name] = DenseRetriever(records, embedder(name))
+        return dense_cache[name]
+
+    for config in args.configs.split(","):
+        config = config.strip()
+        if config in ("hash", "minilm", "ada-002"):
+            yield f"{config} exact", lambda c=config: dense(c), lambda c=config: policy(c)
+        elif config == "bm25":
+            yield "bm25", lambda: BM25Retriever(records), lambda: None
+        elif config == "hybrid":
+            yield f"hybrid bm25+{base}", lambda: HybridRetriever(dense(base), BM25Retriever(records)), lambda: None
+        elif config == "rerank":
+            def reranked():
+                from reranker import CrossEncoder, Reranker
+                if CrossEncoder is None:
+                    raise ImportError("sentence-transformers is not installed")
+                return RerankedRetriever(dense(base), records, Reranker(latency_budget_ms=1e9, max_concurrent=1), args.rerank_candidates)
+            yield f"{base}+rerank", reranked, lambda: None
+        elif config == "int8":
+            yield f"{base} int8", lambda: DenseRetriever(records, embedder(base), quantize=True), lambda: policy(base)
+        elif config == "ivf":
+            nlist = args.nlist or max(1, int(math.sqrt(len(records))))
+            for nprobe in args.nprobe:
+                yield (f"{base} ivf nprobe={nprobe}",
+                       lambda p=nprobe: DenseRetriever(records, embedder(base), nlist=nlist, nprobe=p, seed=args.seed),
+                       lambda: policy(base))
+        else:
+            raise SystemExit(f"Unknown configuration {config!r}")
+
+
+def _normalize_space(text: str) -> str:
+    return " ".join(text.replace("\u200b", " ").split()).lower()
+
+
+def load_questions(path: str, records: Optional[List[Dict[str, Any]]] = None) -> List[Dict[str, Any]]:
+    """
+    JSON lines of {"query": ..., "relevant": [chunk ids]}, or of
+    {"query": ..., "relevant_text": [passages]}. Passages are resolved
+    against `records` to the chunks containing them, so labels survive
+    changes to the chunk size.
+    """
+    with open(path) as f:
+        questions = [json.loads(line) for line in f if line.strip()]
+    texts = [(r["id"], _normalize_space(r["text"])) for r in records or []]
+    for question in questions:
+        if "relevant_text" in question:
+            passages = [_normalize_space(p) for p in question["relevant_text"]]
+            question["relevant"] = [chunk_id for chunk_id, text in texts if any(p in text for p in passages)]
+        if not question.get("relevant"):
+            logger.warning(f"No chunk is labelled relevant for {question['query']!r}")
+    return questions
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Retrieval quality vs latency for each retrieval configuration, fully offline.")
+    parser.add_argument("--configs", default="hash,minilm,ada-002,bm25,hybrid,rerank,int8,ivf",
+                        help="Comma-separated: hash, minilm, ada-002, bm25, hybrid, rerank, int8, ivf")
+    parser.add_argument("--base", default=None, help="Embedder for hybrid/rerank/int8/ivf (default: minilm if installed, else hash)")
+    parser.add_argument("--corpus", help="Directory of .pdf/.txt/.md documents, split like ingest (default: the synthetic sample corpus)")
+    parser.add_argument("--labels", help="JSON lines of {query, relevant: [chunk ids]} or {query, relevant_text: [passages]} for --corpus")
+    parser.add_argument("--chunks", type=int, default=5000, help="Sample corpus size")
+    parser.add_argument("--target-chunks", type=int, default=int(os.environ.get("TARGET_SOURCE_CHUNKS", 10)),
+                        help="Retrieval policy max_chunks (TARGET_SOURCE_CHUNKS)")
+    parser.add_argument("--min-score", type=float, default=None, help="Policy score threshold (default: calibrated per model)")
+    parser.add_argument("--rerank-candidates", type=int, default=20)
+    parser.add_argument("--nlist", type=int, default=None, help="IVF partitions (default: sqrt of corpus size)")
+    parser.add_argument("--nprobe", type=lambda v: [int(p) for p in v.split(",")], default=[2, 8], help="IVF partitions searched, comma-separated")
+    parser.add_argument("--online", action="store_true", help="Allow fetching missing ada-002 vectors from OpenAI (cached for offline runs)")
+    parser.add_argument("--embedding-cache", default=EVAL_EMBEDDING_CACHE)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write results as JSON")
+    parser.add_argument("--chart", help="Write the quality/latency Pareto chart as SVG")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.WARNING)
+    if args.corpus:
+        if not args.labels:
+            raise SystemExit("--corpus needs --labels")
+        records = load_corpus(args.corpus)
+        questions = load_questions(args.labels, records)
+    else:
+        records, questions = sample_corpus(args.chunks, args.seed), sample_questions()
+    if args.base is None:
+        try:
+            import sentence_transformers  # noqa: F401
+            args.base = "minilm"
+        except ImportError:
+            args.base = "hash"
+
+    results, skipped = [], {}
+    embedders = {}
+    for name, make_retriever, make_policy in build_configs(args, records, embedders):
+        try:
+            start = time.perf_counter()
+            retriever = make_retriever()
+            build_seconds = time.perf_counter() - start
+            result = evaluate(name, retriever, records, questions, make_policy())
+        except (ImportError, LookupError, RuntimeError) as e:
+            skipped[name] = str(e)
+            print(f"{name}: skipped ({e})")
+            continue
+        result["build_s"] = round(build_seconds, 2)
+        results.append(result)
+    for embedder in embedders.values():
+        if isinstance(embedder, CachedEmbedder):
+            embedder.save()
+
+    front = {r["config"] for r in pareto_front(results)} if results else set()
+    header = f"{'config':28s} {'R@1':>6s} {'R@5':>6s} {'R@10':>6s} {'MRR':>6s} {'nDCG10':>7s} {'p50 ms':>8s} {'p95 ms':>8s} {'fwd':>5s} {'fwd R':>6s} {'MB':>7s}"
+    print(header)
+    for r in results:
+        print(f"{r['config'] + (' *' if r['config'] in front else ''):28s} {r['recall@1']:6.3f} {r['recall@5']:6.3f} {r['recall@10']:6.3f} "
+              f"{r['mrr']:6.3f} {r['ndcg@10']:7.3f} {r['latency_p50_ms']:8.3f} {r['latency_p95_ms']:8.3f} "
+              f"{r.get('policy_forwarded', ''):>5} {r.get('policy_recall', ''):>6} {r['index_mb']:7.2f}")
+    print(f"* Pareto front (nDCG@10 vs p95 latency); {len(questions)} questions, {len(records)} chunks")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"questions": len(questions), "chunks": len(records), "results": results, "skipped": skipped,
+                       "pareto_front": sorted(front)}, f, indent=2)
+    if args.chart and results:
+        with open(args.chart, "w") as f:
+            f.write(pareto_svg(results))
+        print(f"Pareto chart written to {args.chart}")
+    return 0
+
+
+# Example usage:
+#   python retrieval_eval.py --chart pareto.svg --output eval.json
+#   python retrieval_eval.py --configs ada-002 --online   # fetch and cache ada-002 vectors once
+if __name__ == "__main__":
+    sys.exit(main())
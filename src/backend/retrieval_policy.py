@@ -0,0 +1,139 @@
+import os
+from typing import Any, Callable, Dict, List, Optional
+
+# Minimum cosine score worth sending to the LLM, per embedding model. These are
+# starting points: ada-002 scores bunch up high (unrelated text still scores
+# ~0.7) while the padded MiniLM vectors score much lower. Check the score
+# distribution on your own index and override with RETRIEVAL_MIN_SCORE.
+CALIBRATED_MIN_SCORES = {
+    "text-embedding-ada-002": 0.76,
+    "text-embedding-3-small": 0.30,
+    "all-MiniLM-L6-v2": 0.30,
+    "llama-text-embed-v2": 0.40,
+}
+DEFAULT_MIN_SCORE = 0.40
+
+
+class RetrievalPolicy:
+    """
+    Decides how many candidates to fetch and which of them go to generation.
+
+    A query fetches `fetch_k` candidates (cheap: one vector query), then
+    forwards only the best-scoring ones: candidates below the model's
+    calibrated `min_score` are dropped, the list is cut at the largest score
+    gap if that gap stands out from the rest (at least `min_gap` and
+    `gap_factor` times the mean gap), and at most `max_chunks` are kept.
+    """
+
+    def __init__(
+        self,
+        fetch_k: int = 20,
+        max_chunks: int = 5,
+        min_score: float = DEFAULT_MIN_SCORE,
+        min_chunks: int = 1,
+        min_gap: float = 0.05,
+        gap_factor: float = 2.5
+    ):
+        self.fetch_k = max(fetch_k, max_chunks)
+        self.max_chunks = max_chunks
+        self.min_score = min_score
+        self.min_chunks = min_chunks
+        self.min_gap = min_gap
+        self.gap_factor = gap_factor
+
+    def limited(self, max_chunks: int) -> "RetrievalPolicy":
+        """Same policy forwarding at most `max_chunks` chunks."""
+        return RetrievalPolicy(
+            fetch_k=self.fetch_k,
+            max_chunks=max_chunks,
+            min_score=self.min_score,
+            min_chunks=self.min_chunks,
+            min_gap=self.min_gap,
+            gap_factor=self.gap_factor
+        )
+
+    def cutoff(self, scores: List[float]) -> int:
+        """Number of leading candidates to keep, for scores sorted best-first."""
+        keep = 0
+        while keep < len(scores) and keep < self.max_chunks and scores[keep] >= self.min_score:
+            keep += 1
+        if keep <= self.min_chunks:
+            return keep
+
+        # Look for a pronounced drop among the candidates that passed the floor,
+        # including the drop to the first candidate that didn't
+        window = scores[:keep + 1] if keep < len(scores) else scores[:keep]
+        gaps = [window[i] - window[i + 1] for i in range(len(window) - 1)]
+        if not gaps:
+            return keep
+        mean_gap = sum(gaps) / len(gaps)
+        best = max(range(self.min_chunks - 1, len(gaps)), key=lambda i: gaps[i])
+        if gaps[best] >= self.min_gap and gaps[best] >= self.gap_factor * mean_gap:
+            return min(keep, best + 1)
+        return keep
+
+    def select(self, candidates: List[Any], score_of: Callable[[Any], float] = lambda c: c.score) -> List[Any]:
+        """Candidates to forward to generation, best-first."""
+        ranked = sorted(candidates, key=score_of, reverse=True)
+        return ranked[:self.cutoff([score_of(c) for c in ranked])]
+
+
+def policy_for_model(embedding_model: str, max_chunks: Optional[int] = None) -> RetrievalPolicy:
+    """Policy for an embedding model, with RETRIEVAL_* environment overrides."""
+    min_score = os.environ.get("RETRIEVAL_MIN_SCORE")
+    return RetrievalPolicy(
+        fetch_k=int(os.environ.get("RETRIEVAL_FETCH_K", 20)),
+        max_chunks=max_chunks or int(os.environ.get("RETRIEVAL_MAX_CHUNKS", 5)),
+        min_score=float(min_score) if min_score else CALIBRATED_MIN_SCORES.get(embedding_model, DEFAULT_MIN_SCORE),
+        min_gap=float(os.environ.get("RETRIEVAL_MIN_GAP", 0.05)),
+        gap_factor=float(os.environ.get("RETRIEVAL_GAP_FACTOR", 2.5))
+    )
+
+
+# Example usage: chunks/tokens forwarded and relevant-chunk recall on a synthetic eval set
+if __name__ == "__main__":
+    import random
+
+    random.seed(7)
+    chunk_tokens = 250
+    queries = []
+    for _ in range(500):
+        # A handful of relevant chunks score well above the tail of unrelated ones;
+        # some queries have no good match at all
+        answerable = random.random() < 0.85
+        relevant = [min(0.95, random.gauss(0.62, 0.06)) for _ in range(random.randint(1, 4))] if answerable else []
+        unrelated = [random.gauss(0.33, 0.07) for _ in range(20 - len(relevant))]
+        queries.append([(s, True) for s in relevant] + [(s, False) for s in unrelated])
+
+    class FixedTopK:
+        def __init__(self, k, floor):
+            self.k, self.floor = k, floor
+
+        def select(self, candidates, score_of):
+            ranked = sorted(candidates, key=score_of, reverse=True)[:self.k]
+            return [c for c in ranked if score_of(c) >= self.floor]
+
+    strategies: Dict[str, Any] = {
+        "top_k=5, score >= -0.5": FixedTopK(5, -0.5),
+        "top_k=10, score >= 0.4": FixedTopK(10, 0.4),
+        "adaptive (MiniLM)": policy_for_model("all-MiniLM-L6-v2"),
+    }
+    for name, strategy in strategies.items():
+        forwarded = relevant_kept = relevant_total = answerable_hit = answerable = 0
+        for candidates in queries:
+            selected = strategy.select(candidates, score_of=lambda c: c[0])
+            forwarded += len(selected)
+            kept = sum(1 for _, is_relevant in selected if is_relevant)
+            total = sum(1 for _, is_relevant in candidates if is_relevant)
+            relevant_kept += kept
+            relevant_total += total
+            if total:
+                answerable += 1
+                answerable_hit += kept > 0
+        print(
+            f"{name:24s}: {forwarded / len(queries):4.2f} chunks "
+            f"(~{forwarded / len(queries) * chunk_tokens:5.0f} context tokens) per query, "
+            f"relevant recall {relevant_kept / relevant_total:.1%}, "
+            f"answerable queries with evidence {answerable_hit / answerable:.1%}, "
+            f"precision {relevant_kept / max(forwarded, 1):.1%}"
+        )
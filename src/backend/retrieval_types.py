@@ -0,0 +1,132 @@
+from typing import Any, Dict, Iterable, List, Optional
+
+
+class RetrievedChunk:
+    """
+    One retrieved chunk that references the vector store's match data.
+
+    The match metadata is not modified: `text` is a reference to the
+    metadata's text value, and the API/LangChain shapes are only built at the
+    boundary with to_response()/to_document(). Supports read-only
+    item access (content, source, score) for code written against the old
+    result dicts.
+    """
+
+    __slots__ = ("id", "score", "text", "metadata", "text_key")
+
+    def __init__(self, id: Optional[str], score: float, text: str, metadata: Dict[str, Any], text_key: str = "text"):
+        self.id = id
+        self.score = score
+        self.text = text
+        self.metadata = metadata
+        # Metadata key holding the text; left out of the Document metadata
+        self.text_key = text_key
+
+    @classmethod
+    def from_match(cls, match: Any, text_key: str = "text") -> Optional["RetrievedChunk"]:
+        """Wrap a Pinecone SDK match object or REST match dict; None if it carries no text."""
+        if isinstance(match, dict):
+            metadata = match.get("metadata") or {}
+            match_id, score = match.get("id"), match.get("score", 0.0)
+        else:
+            metadata = getattr(match, "metadata", None) or {}
+            match_id, score = match.id, match.score
+        text = metadata.get(text_key)
+        if not text:
+            return None
+        return cls(match_id, score, text, metadata, text_key)
+
+    @property
+    def source(self) -> str:
+        metadata = self.metadata
+        if "source_title" in metadata:
+            url = metadata.get("source_url")
+            return f"{metadata['source_title']} ({url})" if url else metadata["source_title"]
+        return metadata.get("source", "Unknown Source")
+
+    def with_text(self, text: str) -> "RetrievedChunk":
+        """Same chunk with replacement text (e.g. truncated to fit a prompt)."""
+        return RetrievedChunk(self.id, self.score, text, self.metadata, self.text_key)
+
+    def to_response(self) -> Dict[str, str]:
+        """The {content, source} shape returned by the API."""
+        return {"content": self.text, "source": self.source}
+
+    def to_document(self):
+        """LangChain Document whose metadata is the match metadata without the text (already page_content)."""
+        from langchain.schema import Document
+        text_key = self.text_key
+        return Document(page_content=self.text, metadata={key: value for key, value in self.metadata.items() if key != text_key})
+
+    def __getitem__(self, key: str) -> Any:
+        if key == "content":
+            return self.text
+        if key == "source":
+            return self.source
+        if key == "score":
+            return self.score
+        raise KeyError(key)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __repr__(self) -> str:
+        return f"RetrievedChunk(id={self.id!r}, score={self.score!r}, source={self.source!r})"
+
+
+def chunks_from_matches(matches: Iterable[Any], text_key: str = "text") -> List[RetrievedChunk]:
+    """Wrap matches that carry text, preserving order."""
+    chunks = []
+    for match in matches:
+        chunk = RetrievedChunk.from_match(match, text_key)
+        if chunk is not None:
+            chunks.append(chunk)
+    return chunks
+
+
+# Example usage: allocations per query when converting matches for the API
+if __name__ == "__main__":
+    import tracemalloc
+    from types import SimpleNamespace
+
+    def make_matches(n):
+        return [
+            SimpleNamespace(
+                id=f"doc-{i}",
+                score=0.9 - i * 0.001,
+                metadata={"text": f"Chunk {i}: " + "municipal code text " * 50, "source": f"ordinance-{i % 7}.pdf", "page": i}
+            )
+            for i in range(n)
+        ]
+
+    def old_conversion(matches):
+        # Copy the metadata so each iteration starts from intact matches, as the
+        # old code relied on; then pop/strip/rebuild the way it did
+        documents = []
+        for match in matches:
+            metadata = dict(match.metadata)
+            text = metadata.pop("text")
+            documents.append({"content": text.strip(), "source": metadata.get("source", "Unknown Source"), "score": match.score, "metadata": metadata})
+        return [{"content": doc["content"], "source": doc["source"]} for doc in documents]
+
+    def new_conversion(matches):
+        return [chunk.to_response() for chunk in chunks_from_matches(matches)]
+
+    tracemalloc.start()
+    for top_k in (10, 100):
+        matches = make_matches(top_k)
+        for name, convert in (("pop + rebuild", old_conversion), ("RetrievedChunk", new_conversion)):
+            convert(matches)
+            baseline = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            before = tracemalloc.take_snapshot()
+            result = convert(matches)
+            after = tracemalloc.take_snapshot()
+            peak = tracemalloc.get_traced_memory()[1] - baseline
+            blocks = sum(stat.count_diff for stat in after.compare_to(before, "filename") if stat.count_diff > 0)
+            del result
+            print(f"top_k={top_k:3d} {name:15s}: {peak / 1024:7.1f} KiB peak, {blocks:5d} blocks allocated per query")
+    tracemalloc.stop()
@@ -0,0 +1,102 @@
+import logging
+import os
+import random
+import threading
+import time
+from typing import Any, Callable, Dict
+
+logger = logging.getLogger(__name__)
+
+# Seconds between index stats polls; /status serves the last snapshot in between
+STATUS_REFRESH_INTERVAL = float(os.environ.get("STATUS_REFRESH_INTERVAL", 30.0))
+
+
+class StatusRefresher:
+    """
+    Polls an expensive status probe (e.g. Pinecone index stats) on a
+    background thread and keeps the latest result.
+
+    snapshot() never calls the probe, so health checks cost a dict copy no
+    matter how often they arrive. If a poll fails, the previous snapshot is
+    kept and the error is reported alongside it.
+    """
+
+    def __init__(self, name: str, probe: Callable[[], Dict[str, Any]], interval: float = STATUS_REFRESH_INTERVAL):
+        self.name = name
+        self.probe = probe
+        self.interval = interval
+
+        self._data = {}
+        self._refreshed_at = None
+        self._error = None
+        self._stopped = threading.Event()
+        self._thread = None
+        self.polls = 0
+        self.failures = 0
+
+    def start(self):
+        """Poll once immediately, then every `interval` seconds (with a little jitter)."""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name=f"status-{self.name}", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _run(self):
+        self.refresh()
+        # Jitter so workers started together don't poll the control plane in lockstep
+        while not self._stopped.wait(self.interval * random.uniform(0.9, 1.1)):
+            self.refresh()
+
+    def refresh(self):
+        """Run the probe now and replace the snapshot."""
+        self.polls += 1
+        try:
+            data = self.probe()
+        except Exception as e:
+            self.failures += 1
+            self._error = str(e)
+            logger.error(f"Error refreshing {self.name} status: {e}")
+            return
+        # Swap in a new dict rather than mutating the one readers may hold
+        self._data = dict(data)
+        self._refreshed_at = time.time()
+        self._error = None
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Latest probe result plus `snapshot_age_s` (None before the first successful poll)."""
+        data = dict(self._data)
+        refreshed_at = self._refreshed_at
+        data["snapshot_age_s"] = round(time.time() - refreshed_at, 3) if refreshed_at else None
+        if self._error:
+            data["snapshot_error"] = self._error
+        return data
+
+
+# Example usage: /status cost with the probe inline vs served from the snapshot
+if __name__ == "__main__":
+    def describe_index_stats():
+        time.sleep(0.12)  # list_indexes + describe_index_stats round trips
+        return {"database_initialized": True, "vector_count": 18234, "dimension": 384}
+
+    polls = 200
+    start = time.perf_counter()
+    for _ in range(5):
+        describe_index_stats()
+    inline = (time.perf_counter() - start) / 5
+
+    refresher = StatusRefresher("demo", describe_index_stats, interval=0.5)
+    refresher.start()
+    time.sleep(0.2)
+    start = time.perf_counter()
+    for _ in range(polls):
+        snapshot = refresher.snapshot()
+    cached = (time.perf_counter() - start) / polls
+    refresher.stop()
+
+    print(f"inline probe: {inline * 1000:.1f} ms per /status, snapshot: {cached * 1e6:.2f} us per /status")
+    print(f"snapshot: {snapshot}, control-plane calls: {refresher.polls} instead of {polls}")
@@ -0,0 +1,61 @@
+import time
+
+import pytest
+
+import chat_analytics
+from chat_analytics import ChatAnalyticsSink, _parse_timestamp
+
+
+@pytest.mark.parametrize("value", [9e11, float("inf"), float("nan"), True, False, -5, 1e20, "not a date", None, "9999-12-31T23:59:59Z" + "x"])
+def test_unusable_timestamps_default_to_now(value):
+    before = time.time()
+    assert before <= _parse_timestamp(value) <= time.time()
+
+
+@pytest.mark.parametrize("value, expected", [
+    (1714564800, 1714564800.0),
+    (1714564800123, 1714564800.123),
+    ("2024-05-01T12:00:00Z", 1714564800.0),
+])
+def test_epoch_and_iso_timestamps(value, expected):
+    assert _parse_timestamp(value) == pytest.approx(expected)
+
+
+@pytest.fixture
+def sink(tmp_path):
+    # Long interval: the tests flush explicitly
+    sink = ChatAnalyticsSink(root_dir=str(tmp_path), flush_interval=3600)
+    yield sink
+    sink.close()
+
+
+def test_bad_timestamp_does_not_stop_analytics(sink):
+    sink.record({"type": "user", "message": "bad", "timestamp": 9e11})
+    sink.flush()
+    sink.record({"type": "user", "message": "Who is the mayor?", "timestamp": "2024-05-01T12:00:00Z", "latency_ms": "slow"})
+    sink.flush()
+    assert sink.events_written == 2
+    summary = sink.summary("2024-05-01", "2024-05-01")
+    assert summary["total_events"] == 1
+    assert summary["latency_ms"] == {}
+
+
+def test_flush_thread_survives_a_failing_flush(sink, monkeypatch):
+    calls = []
+
+    def broken_day(ts):
+        calls.append(ts)
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr(chat_analytics, "_day", broken_day)
+    sink.record({"type": "user", "message": "lost"})
+    sink._wake.set()
+    deadline = time.time() + 5
+    while not calls and time.time() < deadline:
+        time.sleep(0.01)
+    monkeypatch.undo()
+
+    assert sink._thread.is_alive()
+    sink.record({"type": "user", "message": "kept"})
+    sink.flush()
+    assert sink.events_written == 1
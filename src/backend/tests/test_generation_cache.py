@@ -0,0 +1,60 @@
+from types import SimpleNamespace
+
+from generation_cache import GenerationCache, generation_key, replay_tokens
+
+
+def doc(text, **metadata):
+    return SimpleNamespace(page_content=text, metadata=metadata)
+
+
+KEY = generation_key("llama3", "v1", "When is trash collected?", [doc("Monday pickup."), doc("Holiday schedule.")])
+
+
+def test_invalidate_drops_cached_answers():
+    cache = GenerationCache()
+    cache.put(KEY, "Mondays.", cache.epoch)
+    assert cache.get(KEY) == "Mondays."
+
+    cache.invalidate()
+
+    assert cache.get(KEY) is None
+    assert cache.stats()["entries"] == 0
+    assert cache.stats()["bytes"] == 0
+
+
+def test_answer_started_before_invalidate_is_not_stored():
+    cache = GenerationCache()
+    epoch = cache.epoch          # read before a slow generation
+    cache.invalidate()           # an ingest finishes meanwhile
+    cache.put(KEY, "Stale answer.", epoch)
+
+    assert cache.get(KEY) is None
+
+    cache.put(KEY, "Fresh answer.", cache.epoch)
+    assert cache.get(KEY) == "Fresh answer."
+
+
+def test_key_ignores_question_formatting_and_chunk_order():
+    a, b = doc("Monday pickup."), doc("Holiday schedule.")
+    assert generation_key("m", "v", "When is trash collected?", [a, b]) == \
+        generation_key("m", "v", "  when is TRASH collected ", [b, a])
+    assert generation_key("m", "v", "q", [a]) != generation_key("m", "v", "q", [doc("Tuesday pickup.")])
+    assert generation_key("m", "v", "q", [doc("x", id="chunk-1")])[3] == ("chunk-1",)
+
+
+def test_bounded_by_entries_and_bytes():
+    cache = GenerationCache(max_entries=2)
+    keys = [generation_key("m", "v", f"question {i}", []) for i in range(3)]
+    for key in keys:
+        cache.put(key, "answer")
+    assert cache.get(keys[0]) is None
+    assert cache.stats()["entries"] == 2
+
+    small = GenerationCache(max_bytes=64)
+    small.put(KEY, "x" * 1000)
+    assert small.get(KEY) is None
+
+
+def test_replay_reassembles_the_answer():
+    answer = "The pool opens  at 9 a.m.\nBring ID."
+    assert "".join(replay_tokens(answer)) == answer
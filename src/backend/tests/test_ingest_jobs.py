@@ -0,0 +1,73 @@
+import time
+
+import pytest
+
+from ingest_jobs import JobStore, JobWatcher
+
+
+@pytest.fixture
+def store(tmp_path):
+    return JobStore(str(tmp_path / "jobs.db"))
+
+
+def finished_job(store, status="succeeded"):
+    job = store.submit("ingest")
+    store.finish(job["id"], status, result={"documents_processed": 1})
+    return job["id"]
+
+
+def run_watcher(store, seen, **kwargs):
+    watcher = JobWatcher(store, lambda job: seen.append(job["id"]), interval=0.05, **kwargs)
+    watcher.start()
+    return watcher
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_first_start_skips_history(store):
+    old = finished_job(store)
+    seen = []
+    watcher = run_watcher(store, seen)
+    assert wait_for(lambda: store.get_watermark("job_watcher") is not None)
+    new = finished_job(store)
+    assert wait_for(lambda: seen == [new])
+    watcher.stop()
+    assert old not in seen
+
+
+def test_jobs_finished_while_down_are_reported_after_restart(store):
+    seen = []
+    watcher = run_watcher(store, seen)
+    first = finished_job(store)
+    assert wait_for(lambda: seen == [first])
+    watcher.stop()
+
+    missed = [finished_job(store), finished_job(store, "failed")]
+
+    restarted = run_watcher(store, seen)
+    assert wait_for(lambda: seen == [first] + missed)
+    restarted.stop()
+
+
+def test_failing_handler_does_not_stall_the_watcher(store):
+    watcher = JobWatcher(store, lambda job: 1 / 0)
+    since = watcher._resume_point()
+    finished_job(store)
+    finished_job(store)
+
+    since = watcher.poll(since)
+
+    assert since == store.get_watermark("job_watcher")
+    assert store.finished_since(since) == []
+
+
+def test_watermark_never_moves_backwards(store):
+    store.set_watermark("w", 10.0)
+    store.set_watermark("w", 5.0)
+    assert store.get_watermark("w") == 10.0
+    assert store.get_watermark("other") is None
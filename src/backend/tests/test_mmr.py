@@ -0,0 +1,89 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from pinecone_langchain_adapter import PineconeVectorStore, maximal_marginal_relevance
+
+
+def loop_mmr(query_embedding, embeddings, k, lambda_mult):
+    """Straightforward per-candidate loop used as the reference."""
+    embeddings = embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+    query = query_embedding / np.linalg.norm(query_embedding)
+    selected = []
+    while len(selected) < min(k, len(embeddings)):
+        best, best_score = None, -np.inf
+        for i in range(len(embeddings)):
+            if i in selected:
+                continue
+            redundancy = max((float(embeddings[i] @ embeddings[j]) for j in selected), default=0.0)
+            score = lambda_mult * float(embeddings[i] @ query) - (1 - lambda_mult) * redundancy
+            if score > best_score:
+                best, best_score = i, score
+        selected.append(best)
+    return selected
+
+
+QUERY = np.array([1.0, 0.0, 0.0])
+CANDIDATES = np.array([
+    [1.0, 0.1, 0.0],    # most relevant
+    [1.0, 0.11, 0.0],   # near-duplicate of 0
+    [0.6, 0.0, 0.8],    # less relevant, different direction
+    [0.0, 1.0, 0.0],    # irrelevant
+])
+
+
+def test_most_relevant_first_and_near_duplicates_skipped():
+    selected = maximal_marginal_relevance(QUERY, CANDIDATES, k=2, lambda_mult=0.5)
+    assert selected == [0, 2]
+
+
+def test_lambda_one_is_plain_similarity_order():
+    selected = maximal_marginal_relevance(QUERY, CANDIDATES, k=4, lambda_mult=1.0)
+    relevance = (CANDIDATES / np.linalg.norm(CANDIDATES, axis=1, keepdims=True)) @ QUERY
+    assert selected == list(np.argsort(-relevance))
+
+
+def test_k_larger_than_candidates_returns_each_once():
+    selected = maximal_marginal_relevance(QUERY, CANDIDATES, k=10)
+    assert sorted(selected) == [0, 1, 2, 3]
+
+
+@pytest.mark.parametrize("embeddings, k", [
+    (np.empty((0, 3)), 4),
+    (CANDIDATES, 0),
+    (CANDIDATES, -1),
+    (np.array([1.0, 0.0, 0.0]), 4),
+])
+def test_degenerate_inputs_select_nothing(embeddings, k):
+    assert maximal_marginal_relevance(QUERY, embeddings, k=k) == []
+
+
+@pytest.mark.parametrize("lambda_mult", [0.25, 0.5, 0.75, 1.0])
+def test_matches_reference_loop(lambda_mult):
+    rng = np.random.default_rng(7)
+    query = rng.standard_normal(16)
+    embeddings = rng.standard_normal((40, 16))
+    assert maximal_marginal_relevance(query, embeddings, k=8, lambda_mult=lambda_mult) == \
+        loop_mmr(query, embeddings, 8, lambda_mult)
+
+
+def test_lambda_zero_still_starts_with_most_relevant():
+    assert maximal_marginal_relevance(QUERY, CANDIDATES, k=2, lambda_mult=0.0)[0] == 0
+
+
+def test_search_by_vector_maps_selection_back_to_documents():
+    def match(match_id, values, text):
+        return SimpleNamespace(id=match_id, score=0.0, values=values, metadata={"text": text} if text else {})
+
+    matches = [
+        match("no-text", [1.0, 0.0, 0.0], None),
+        match("a", CANDIDATES[0].tolist(), "alpha"),
+        match("a-dup", CANDIDATES[1].tolist(), "alpha again"),
+        match("c", CANDIDATES[2].tolist(), "gamma"),
+    ]
+    index = SimpleNamespace(query=lambda **kwargs: SimpleNamespace(matches=matches))
+    store = PineconeVectorStore("key", "index", embedding=None, index=index)
+
+    docs = store.max_marginal_relevance_search_by_vector(QUERY.tolist(), k=2, fetch_k=4)
+    assert [doc.page_content for doc in docs] == ["alpha", "gamma"]
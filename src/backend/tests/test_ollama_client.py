@@ -0,0 +1,72 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from langchain.callbacks.base import BaseCallbackHandler
+
+import ollama_client
+from ollama_client import GenerationCancelled, PooledOllama
+
+
+class StubOllama(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        body = b"".join(json.dumps({"response": f"t{i} ", "done": i == 9}).encode() + b"\n" for i in range(10))
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def server_url():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubOllama)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+
+
+class CancelAfter(BaseCallbackHandler):
+    raise_error = True
+
+    def __init__(self, tokens):
+        self.remaining = tokens
+
+    def on_llm_new_token(self, token, **kwargs):
+        self.remaining -= 1
+        if self.remaining == 0:
+            raise GenerationCancelled("client went away")
+
+
+def test_base_url_selects_its_own_client(server_url):
+    assert PooledOllama(model="m", base_url=server_url)("q") == "".join(f"t{i} " for i in range(10))
+    client = ollama_client.get_ollama_client(server_url)
+    assert client is not ollama_client.get_ollama_client()
+    assert client.base_url == server_url
+    assert client.stats()["completed"] == 1
+
+
+def test_cancelled_generation_releases_its_slot(server_url):
+    llm = PooledOllama(model="m", base_url=server_url, callbacks=[CancelAfter(3)])
+    with pytest.raises(GenerationCancelled):
+        llm("q")
+    stats = ollama_client.get_ollama_client(server_url).stats()
+    assert stats["in_flight"] == 0
+
+    # The single slot is free again
+    assert PooledOllama(model="m", base_url=server_url)("q")
+
+
+def test_closing_a_partially_read_stream_releases_its_slot(server_url):
+    client = ollama_client.get_ollama_client(server_url)
+    lines = client.generate_stream({"prompt": "q"})
+    next(lines)
+    assert client.stats()["in_flight"] == 1
+    lines.close()
+    assert client.stats()["in_flight"] == 0
@@ -0,0 +1,111 @@
+import asyncio
+import io
+import threading
+
+import pytest
+from PIL import Image
+
+import placeholder_images
+from placeholder_images import PlaceholderCache, etag_matches, validate_dimensions
+
+
+@pytest.mark.parametrize("width, height", [(1, 1), (400, 300), (2048, 2048)])
+def test_sizes_within_limits_are_accepted(width, height):
+    validate_dimensions(width, height)
+
+
+@pytest.mark.parametrize("width, height", [(0, 10), (10, -1), (2049, 10), (10, 100000)])
+def test_sizes_outside_limits_are_rejected(width, height):
+    with pytest.raises(ValueError):
+        validate_dimensions(width, height)
+
+
+def test_pixel_budget_is_enforced(monkeypatch):
+    monkeypatch.setattr(placeholder_images, "PLACEHOLDER_MAX_PIXELS", 100 * 100)
+    validate_dimensions(100, 100)
+    with pytest.raises(ValueError, match="pixels"):
+        validate_dimensions(101, 100)
+
+
+ETAG = '"400x300-0123456789abcdef"'
+
+
+@pytest.mark.parametrize("header", [ETAG, f"W/{ETAG}", f'"other", {ETAG}', "*"])
+def test_matching_if_none_match(header):
+    assert etag_matches(header, ETAG)
+
+
+@pytest.mark.parametrize("header", [None, "", '"other"', ETAG.strip('"')])
+def test_non_matching_if_none_match(header):
+    assert not etag_matches(header, ETAG)
+
+
+def test_cache_serves_the_same_png_and_etag_per_size():
+    cache = PlaceholderCache()
+    content, etag = cache.get(400, 300)
+    assert Image.open(io.BytesIO(content)).size == (400, 300)
+    assert cache.get(400, 300) == (content, etag)
+    assert cache.get(300, 400)[1] != etag
+    assert cache.stats()["entries"] == 2
+    assert cache.stats()["hit_rate"] == pytest.approx(1 / 3, abs=0.001)
+
+
+def test_cache_is_bounded():
+    cache = PlaceholderCache(max_entries=2)
+    for size in range(10, 14):
+        cache.get(size, size)
+    assert cache.stats()["entries"] == 2
+
+
+def test_concurrent_misses_render_once(monkeypatch):
+    renders = []
+    release = threading.Event()
+    render = placeholder_images.render_placeholder
+
+    def slow_render(width, height):
+        renders.append((width, height))
+        release.wait(5)
+        return render(width, height)
+
+    monkeypatch.setattr(placeholder_images, "render_placeholder", slow_render)
+    cache = PlaceholderCache()
+
+    async def burst():
+        tasks = [asyncio.ensure_future(cache.aget(64, 64)) for _ in range(5)]
+        await asyncio.sleep(0.1)
+        release.set()
+        return await asyncio.gather(*tasks)
+
+    results = asyncio.run(burst())
+    assert renders == [(64, 64)]
+    assert len({etag for _, etag in results}) == 1
+
+
+@pytest.fixture
+def api_client(tmp_path, monkeypatch):
+    # pinecone_api mounts ./static at import
+    (tmp_path / "static").mkdir()
+    monkeypatch.chdir(tmp_path)
+    api = pytest.importorskip("pinecone_api")
+    from fastapi.testclient import TestClient
+    return TestClient(api.app)
+
+
+def test_endpoint_revalidates_with_304(api_client):
+    response = api_client.get("/api/placeholder/120/80")
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "image/png"
+    assert "immutable" in response.headers["cache-control"]
+    etag = response.headers["etag"]
+
+    revalidated = api_client.get("/api/placeholder/120/80", headers={"If-None-Match": etag})
+    assert revalidated.status_code == 304
+    assert revalidated.content == b""
+    assert revalidated.headers["etag"] == etag
+
+    assert api_client.get("/api/placeholder/80/120", headers={"If-None-Match": etag}).status_code == 200
+
+
+@pytest.mark.parametrize("path", ["/api/placeholder/0/10", "/api/placeholder/5000/10", "/api/placeholder/2048/4096"])
+def test_endpoint_rejects_oversized_requests_with_400(api_client, path):
+    assert api_client.get(path).status_code == 400
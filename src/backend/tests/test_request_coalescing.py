@@ -0,0 +1,63 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from request_coalescing import SingleFlight, coalescing_key
+
+
+def test_concurrent_callers_share_one_call():
+    flight = SingleFlight("test")
+    started, release = threading.Event(), threading.Event()
+
+    def answer():
+        started.set()
+        release.wait(5)
+        return {"result": "42"}
+
+    leader = threading.Thread(target=flight.do, args=("q", answer))
+    leader.start()
+    started.wait(5)
+    with ThreadPoolExecutor(3) as pool:
+        followers = [pool.submit(flight.do, "q", answer) for _ in range(3)]
+        while flight.stats()["coalesced"] < 3:
+            pass
+        release.set()
+        results = [f.result(5) for f in followers]
+    leader.join(5)
+
+    assert results == [{"result": "42"}] * 3
+    assert flight.stats() == {"requests": 4, "upstream_calls": 1, "coalesced": 3, "in_flight": 0}
+    # Followers get their own copy
+    results[0]["result"] = "changed"
+    assert results[1]["result"] == "42"
+
+
+def test_leader_error_reaches_every_waiter_and_is_not_kept():
+    flight = SingleFlight("test")
+    started, release = threading.Event(), threading.Event()
+
+    def failing():
+        started.set()
+        release.wait(5)
+        raise RuntimeError("upstream down")
+
+    with ThreadPoolExecutor(4) as pool:
+        leader = pool.submit(flight.do, "q", failing)
+        started.wait(5)
+        followers = [pool.submit(flight.do, "q", failing) for _ in range(3)]
+        while flight.stats()["coalesced"] < 3:
+            pass
+        release.set()
+        for future in [leader] + followers:
+            with pytest.raises(RuntimeError, match="upstream down"):
+                future.result(5)
+
+    # The failure isn't cached: the next call runs again
+    assert flight.do("q", lambda: "recovered") == "recovered"
+    assert flight.stats()["in_flight"] == 0
+
+
+def test_coalescing_key_normalizes_question_and_filter():
+    assert coalescing_key("  Who is the MAYOR? ", {"b": 1, "a": 2}) == coalescing_key("who is the mayor?", {"a": 2, "b": 1})
+    assert coalescing_key("who is the mayor?", {"a": 1}) != coalescing_key("who is the mayor?", {"a": 2})
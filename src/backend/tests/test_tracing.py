@@ -0,0 +1,70 @@
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from tracing import Tracer, TracingMiddleware
+
+
+@pytest.fixture
+def traced():
+    tracer = Tracer()
+    app = FastAPI()
+
+    @app.get("/items/{item_id}")
+    def item(item_id: str):
+        return {"item_id": item_id}
+
+    app.add_middleware(TracingMiddleware, tracer=tracer)
+    return tracer, TestClient(app)
+
+
+def test_plain_trace_id_is_echoed(traced):
+    _, client = traced
+    assert client.get("/items/1", headers={"X-Trace-Id": "req-42"}).headers["x-trace-id"] == "req-42"
+
+
+@pytest.mark.parametrize("value", ["a" * 65, "<script>", "id with spaces"])
+def test_unsafe_trace_id_is_replaced(traced, value):
+    _, client = traced
+    echoed = client.get("/items/1", headers={"X-Trace-Id": value}).headers["x-trace-id"]
+    assert echoed != value
+    assert len(echoed) == 32
+
+
+def test_routes_are_labelled_by_template(traced):
+    tracer, client = traced
+    for n in range(5):
+        client.get(f"/items/{n}")
+        client.get(f"/scanner/probe-{n}")
+    client.request("BREW", "/items/1")
+    assert set(tracer.route_histograms) == {"GET /items/{item_id}", "GET <unmatched>", "OTHER /items/{item_id}"}
+
+
+@pytest.fixture
+def captured():
+    tracer = Tracer()
+    tracer.set_slow_threshold(0.000001)
+    for n in range(3):
+        trace, token = tracer.start_trace(f"GET /r{n}")
+        tracer.finish_trace(trace, token)
+    return tracer
+
+
+@pytest.mark.parametrize("limit", [0, -1, -50])
+def test_non_positive_limits_return_nothing(captured, limit):
+    assert captured.slow(limit) == []
+    assert captured.recent(limit) == []
+
+
+def test_limits_keep_the_newest(captured):
+    assert [t["route"] for t in captured.slow(2)] == ["GET /r2", "GET /r1"]
+    assert [t["route"] for t in captured.recent(2)] == ["GET /r1", "GET /r2"]
+    assert len(captured.slow(10)) == 3
+
+
+def test_zero_threshold_turns_capture_off(captured):
+    captured.set_slow_threshold(0)
+    assert captured.slow_threshold is None
+    trace, token = captured.start_trace("GET /r3")
+    captured.finish_trace(trace, token)
+    assert len(captured.slow(10)) == 3
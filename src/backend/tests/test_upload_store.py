@@ -0,0 +1,58 @@
+import asyncio
+import io
+import json
+import os
+
+from starlette.datastructures import UploadFile
+
+import upload_store
+from upload_store import IngestManifest, save_uploads
+
+
+def upload(name, content):
+    return UploadFile(io.BytesIO(content), filename=name)
+
+
+def test_source_directory_only_receives_documents(tmp_path):
+    manifest = IngestManifest(str(tmp_path / "source"))
+    results = asyncio.run(save_uploads([upload("a.pdf", b"A"), upload("big.pdf", b"B" * 100)], manifest, max_bytes=10))
+
+    assert [r["status"] for r in results] == ["stored", "rejected"]
+    assert os.listdir(tmp_path / "source") == ["a.pdf"]
+    assert os.listdir(manifest.state_dir) == ["ingest_manifest.json"]
+    assert os.path.dirname(manifest.state_dir) == str(tmp_path)
+
+
+def test_rebuild_hashes_without_holding_the_lock(tmp_path, monkeypatch):
+    source = tmp_path / "source"
+    source.mkdir()
+    (source / "manual.pdf").write_bytes(b"M")
+    manifest = IngestManifest(str(source))
+
+    locked_during_rebuild = []
+    rebuild = manifest._rebuild
+
+    def observed_rebuild():
+        locked_during_rebuild.append(manifest._lock.locked())
+        return rebuild()
+
+    monkeypatch.setattr(manifest, "_rebuild", observed_rebuild)
+    manifest.load()
+
+    assert locked_during_rebuild == [False]
+    assert len(manifest) == 1
+    assert asyncio.run(save_uploads([upload("copy.pdf", b"M")], manifest))[0]["duplicate_of"] == "manual.pdf"
+
+
+def test_legacy_manifest_is_moved_out_of_the_source_directory(tmp_path):
+    source = tmp_path / "source"
+    source.mkdir()
+    (source / "a.pdf").write_bytes(b"A")
+    legacy = {"0" * 64: {"filename": "a.pdf", "size": 1, "uploaded_at": 0}}
+    (source / upload_store.LEGACY_MANIFEST_NAME).write_text(json.dumps(legacy))
+
+    manifest = IngestManifest(str(source), state_dir=str(tmp_path / "state"))
+
+    assert manifest.get("0" * 64)["filename"] == "a.pdf"
+    assert os.listdir(source) == ["a.pdf"]
+    assert os.path.exists(tmp_path / "state" / upload_store.MANIFEST_NAME)
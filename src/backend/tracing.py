@@ -0,0 +1,289 @@
+import bisect
+import os
+import re
+import contextvars
+import threading
+import time
+import tracemalloc
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+# Latency buckets in seconds, from sub-millisecond routing up to slow LLM calls
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Requests slower than this are kept with their full stage timeline (unset: off; adjustable at runtime)
+SLOW_REQUEST_MS = os.environ.get("SLOW_REQUEST_MS")
+SLOW_REQUEST_BUFFER = int(os.environ.get("SLOW_REQUEST_BUFFER", 100))
+
+# Incoming X-Trace-Id values are kept only if they look like an id; anything
+# else gets a fresh id, so clients can't inject long or odd strings into
+# responses and stored traces
+TRACE_ID_PATTERN = re.compile(r"[A-Za-z0-9-]{1,64}")
+
+# Methods labelled by name; anything else shares one label
+TRACED_METHODS = {"GET", "HEAD", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"}
+
+# Trace of the request currently being handled (propagates into threadpools)
+_current_trace = contextvars.ContextVar("current_trace", default=None)
+
+
+class Trace:
+    """Spans recorded for a single request."""
+
+    __slots__ = ("trace_id", "route", "start", "duration", "spans", "memory_start", "allocated")
+
+    def __init__(self, route: str, trace_id: Optional[str] = None):
+        self.trace_id = trace_id or uuid.uuid4().hex
+        self.route = route
+        self.start = time.perf_counter()
+        self.duration = None
+        # (stage, offset from request start, duration), both in seconds
+        self.spans = []
+        # Net traced bytes over the request, only while tracemalloc is running
+        self.memory_start = tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else None
+        self.allocated = None
+
+    def as_dict(self) -> Dict[str, Any]:
+        result = {
+            "trace_id": self.trace_id,
+            "route": self.route,
+            "duration_ms": round(self.duration * 1000, 3) if self.duration is not None else None,
+            "spans": [
+                {"stage": stage, "offset_ms": round(offset * 1000, 3), "duration_ms": round(duration * 1000, 3)}
+                for stage, offset, duration in self.spans
+            ],
+        }
+        if self.allocated is not None:
+            result["allocated_kb"] = round(self.allocated / 1024, 1)
+        return result
+
+
+class Histogram:
+    """Cumulative latency histogram in the Prometheus bucket layout."""
+
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Tracer:
+    """
+    Lightweight span recorder.
+
+    Spans are only recorded while a request trace is active, so warm-up and
+    CLI usage cost a single context-variable lookup per span.
+    """
+
+    def __init__(self, buffer_size: int = 1024, buckets=DEFAULT_BUCKETS):
+        self._lock = threading.Lock()
+        self.buckets = buckets
+        # Ring buffer of the most recent request traces
+        self.traces = deque(maxlen=buffer_size)
+        self.stage_histograms = {}
+        self.route_histograms = {}
+        # Slow-request capture: (wall-clock time, trace) for requests over the threshold
+        self.slow_threshold = float(SLOW_REQUEST_MS) / 1000 if SLOW_REQUEST_MS else None
+        self.slow_traces = deque(maxlen=SLOW_REQUEST_BUFFER)
+        # Route -> [requests, net bytes, max net bytes] while tracemalloc is running
+        self.route_allocations = {}
+
+    def start_trace(self, route: str, trace_id: Optional[str] = None):
+        """Begin a trace for the current context; returns (trace, reset token)."""
+        trace = Trace(route, trace_id)
+        return trace, _current_trace.set(trace)
+
+    def finish_trace(self, trace: Trace, token=None):
+        trace.duration = time.perf_counter() - trace.start
+        if trace.memory_start is not None and tracemalloc.is_tracing():
+            trace.allocated = tracemalloc.get_traced_memory()[0] - trace.memory_start
+        with self._lock:
+            self.traces.append(trace)
+            histogram = self.route_histograms.get(trace.route)
+            if histogram is None:
+                histogram = self.route_histograms[trace.route] = Histogram(self.buckets)
+            histogram.observe(trace.duration)
+            if self.slow_threshold is not None and trace.duration >= self.slow_threshold:
+                self.slow_traces.append((time.time(), trace))
+            if trace.allocated is not None:
+                totals = self.route_allocations.setdefault(trace.route, [0, 0, 0])
+                totals[0] += 1
+                totals[1] += trace.allocated
+                totals[2] = max(totals[2], trace.allocated)
+        if token is not None:
+            _current_trace.reset(token)
+
+    def record(self, stage: str, duration: float, start: Optional[float] = None):
+        """Record a stage duration measured by the caller (e.g. time-to-first-token)."""
+        trace = _current_trace.get()
+        if trace is None:
+            return
+        if start is None:
+            start = time.perf_counter() - duration
+        trace.spans.append((stage, start - trace.start, duration))
+        with self._lock:
+            histogram = self.stage_histograms.get(stage)
+            if histogram is None:
+                histogram = self.stage_histograms[stage] = Histogram(self.buckets)
+            histogram.observe(duration)
+
+    @contextmanager
+    def span(self, stage: str):
+        """Time the enclosed block as one stage of the current request."""
+        if _current_trace.get() is None:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - start, start)
+
+    def current_trace_id(self) -> Optional[str]:
+        trace = _current_trace.get()
+        return trace.trace_id if trace else None
+
+    def recent(self, limit: int = 50) -> List[Dict[str, Any]]:
+        # [-0:] would be the whole buffer
+        if limit <= 0:
+            return []
+        with self._lock:
+            traces = list(self.traces)[-limit:]
+        return [trace.as_dict() for trace in traces]
+
+    def set_slow_threshold(self, threshold_ms: Optional[float]):
+        """Capture requests slower than `threshold_ms` from now on; None or <= 0 turns capture off."""
+        with self._lock:
+            self.slow_threshold = threshold_ms / 1000 if threshold_ms and threshold_ms > 0 else None
+
+    def slow(self, limit: int = 50) -> List[Dict[str, Any]]:
+        """The most recent captured slow requests, newest first; none for limit <= 0."""
+        if limit <= 0:
+            return []
+        with self._lock:
+            captured = list(self.slow_traces)[-limit:]
+        return [
+            {"captured_at": datetime.fromtimestamp(at, timezone.utc).isoformat(), **trace.as_dict()}
+            for at, trace in reversed(captured)
+        ]
+
+    def reset_allocations(self):
+        with self._lock:
+            self.route_allocations = {}
+
+    def allocations(self) -> Dict[str, Dict[str, float]]:
+        """Net traced allocations per route since the last reset. Overlapping requests share the blame."""
+        with self._lock:
+            totals = dict(self.route_allocations)
+        return {
+            route: {
+                "requests": count,
+                "net_kb_total": round(total / 1024, 1),
+                "net_kb_mean": round(total / count / 1024, 1),
+                "net_kb_max": round(peak / 1024, 1),
+            }
+            for route, (count, total, peak) in sorted(totals.items(), key=lambda item: -item[1][1])
+        }
+
+    def drain(self) -> List[Trace]:
+        """Remove and return the buffered traces (e.g. for offline benchmarks)."""
+        with self._lock:
+            traces = list(self.traces)
+            self.traces.clear()
+        return traces
+
+    def render_prometheus(self, prefix: str = "govify") -> str:
+        """Render stage and request histograms in the Prometheus text format."""
+        lines = []
+        with self._lock:
+            groups = [
+                (f"{prefix}_stage_duration_seconds", "stage", self.stage_histograms),
+                (f"{prefix}_request_duration_seconds", "route", self.route_histograms),
+            ]
+            for name, label, histograms in groups:
+                lines.append(f"# TYPE {name} histogram")
+                for key, histogram in sorted(histograms.items()):
+                    cumulative = 0
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        cumulative += count
+                        lines.append(f'{name}_bucket{{{label}="{key}",le="{bound}"}} {cumulative}')
+                    lines.append(f'{name}_bucket{{{label}="{key}",le="+Inf"}} {histogram.count}')
+                    lines.append(f'{name}_sum{{{label}="{key}"}} {histogram.sum}')
+                    lines.append(f'{name}_count{{{label}="{key}"}} {histogram.count}')
+        return "\n".join(lines) + "\n"
+
+
+# Process-wide tracer shared by the API modules
+tracer = Tracer()
+
+
+class TracingMiddleware:
+    """
+    ASGI middleware that opens a trace per HTTP request.
+
+    The trace id is taken from an incoming X-Trace-Id header when it is a
+    plain id (at most 64 of [A-Za-z0-9-]) and echoed back on the response. The trace is closed when the last body chunk
+    is sent, so streamed responses are timed end to end.
+    """
+
+    def __init__(self, app, tracer: Tracer = tracer, exclude_paths=("/metrics",)):
+        self.app = app
+        self.tracer = tracer
+        self.exclude_paths = set(exclude_paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in self.exclude_paths:
+            await self.app(scope, receive, send)
+            return
+
+        incoming = None
+        for name, value in scope.get("headers", []):
+            if name == b"x-trace-id":
+                value = value.decode("latin-1")
+                if TRACE_ID_PATTERN.fullmatch(value):
+                    incoming = value
+                break
+
+        # Labels come only from the method allow-list and the matched route
+        # template, never from the raw request, so /metrics stays bounded
+        method = scope["method"] if scope["method"] in TRACED_METHODS else "OTHER"
+        trace, token = self.tracer.start_trace(f"{method} <unmatched>", incoming)
+        finished = False
+
+        def finish():
+            nonlocal finished
+            finished = True
+            # Label by route template once routing has resolved it, so path
+            # parameters don't create a histogram per URL; unmatched paths
+            # (404s from scanners) share one label
+            route = scope.get("route")
+            if route is not None and hasattr(route, "path"):
+                trace.route = f"{method} {route.path}"
+            self.tracer.finish_trace(trace)
+
+        async def send_with_trace(message):
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                headers.append((b"x-trace-id", trace.trace_id.encode("latin-1")))
+                message = dict(message, headers=headers)
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get("more_body", False) and not finished:
+                finish()
+
+        try:
+            await self.app(scope, receive, send_with_trace)
+        finally:
+            if not finished:
+                finish()
+            _current_trace.reset(token)
@@ -0,0 +1,370 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from typing import Any, BinaryIO, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Largest accepted document; bigger files are rejected while they are copied
+# out of Starlette's spooled upload, so nothing partial reaches SOURCE_DIRECTORY
+UPLOAD_MAX_BYTES = int(os.environ.get("UPLOAD_MAX_BYTES", 200 * 1024 * 1024))
+# Largest accepted multipart request body, checked before Starlette spools it to disk
+UPLOAD_REQUEST_MAX_BYTES = int(os.environ.get("UPLOAD_REQUEST_MAX_BYTES", 1024 * 1024 * 1024))
+UPLOAD_CHUNK_SIZE = int(os.environ.get("UPLOAD_CHUNK_SIZE", 1024 * 1024))
+# Files of one multi-file upload written at the same time
+UPLOAD_CONCURRENCY = int(os.environ.get("UPLOAD_CONCURRENCY", 4))
+
+# Upload temp files and the manifest live here, outside SOURCE_DIRECTORY, so the
+# ingest loader never sees them. Defaults to a hidden sibling of the source
+# directory; keep it on the same filesystem so finished files can be renamed in.
+UPLOAD_STATE_DIR = os.environ.get("UPLOAD_STATE_DIR")
+
+MANIFEST_NAME = "ingest_manifest.json"
+# Where older versions kept the manifest, inside the source directory
+LEGACY_MANIFEST_NAME = ".ingest_manifest.json"
+
+
+class UploadTooLargeError(ValueError):
+    """The upload exceeded the size limit; nothing was stored."""
+
+
+def default_state_dir(source_dir: str) -> str:
+    """`.<name>-upload-state` next to the source directory."""
+    source_dir = os.path.abspath(source_dir)
+    return os.path.join(os.path.dirname(source_dir), f".{os.path.basename(source_dir)}-upload-state")
+
+
+def hash_file(path: str, chunk_size: int = UPLOAD_CHUNK_SIZE) -> str:
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+class IngestManifest:
+    """
+    SHA-256 -> file record for everything in the source directory.
+
+    Stored as JSON in `state_dir` (with the upload temp files) and rewritten
+    atomically. If it is missing, it is rebuilt by hashing the files already
+    in the source directory, so documents copied in by hand are deduplicated
+    too. Call load() at startup to do that up front; the hashing never holds
+    the lock, so uploads aren't serialized behind it.
+    """
+
+    def __init__(self, source_dir: str, state_dir: Optional[str] = None):
+        self.source_dir = source_dir
+        self.state_dir = state_dir or UPLOAD_STATE_DIR or default_state_dir(source_dir)
+        self.path = os.path.join(self.state_dir, MANIFEST_NAME)
+        self._lock = threading.Lock()
+        self._entries = None
+
+    def _read(self) -> Optional[Dict[str, Dict[str, Any]]]:
+        legacy_path = os.path.join(self.source_dir, LEGACY_MANIFEST_NAME)
+        if not os.path.exists(self.path) and os.path.exists(legacy_path):
+            os.makedirs(self.state_dir, exist_ok=True)
+            os.replace(legacy_path, self.path)
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.error(f"Error reading {self.path}, rebuilding it: {e}")
+            return None
+
+    def load(self) -> Dict[str, Dict[str, Any]]:
+        """The manifest entries, read from disk or rebuilt on first use."""
+        with self._lock:
+            if self._entries is not None:
+                return self._entries
+            entries = self._read()
+        rebuilt = entries is None
+        if rebuilt:
+            entries = self._rebuild()
+        with self._lock:
+            # Another thread may have finished loading (and claimed files) meanwhile
+            if self._entries is None:
+                self._entries = entries
+                if rebuilt:
+                    self._save()
+            return self._entries
+
+    def _rebuild(self) -> Dict[str, Dict[str, Any]]:
+        entries = {}
+        if not os.path.isdir(self.source_dir):
+            return entries
+        for name in sorted(os.listdir(self.source_dir)):
+            path = os.path.join(self.source_dir, name)
+            if name.startswith(".") or not os.path.isfile(path):
+                continue
+            entries.setdefault(hash_file(path), {
+                "filename": name,
+                "size": os.path.getsize(path),
+                "uploaded_at": os.path.getmtime(path),
+            })
+        return entries
+
+    def _save(self):
+        os.makedirs(self.state_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.state_dir, prefix=".manifest-", suffix=".part")
+        with os.fdopen(fd, "w") as f:
+            json.dump(self._entries, f, indent=1)
+        os.replace(tmp_path, self.path)
+
+    def get(self, sha256: str) -> Optional[Dict[str, Any]]:
+        self.load()
+        with self._lock:
+            return self._entries.get(sha256)
+
+    def claim(self, sha256: str, tmp_path: str, filename: str, size: int) -> Optional[Dict[str, Any]]:
+        """
+        Move `tmp_path` into place as `filename` and record it, unless the same
+        content is already stored; then return the existing record instead.
+        """
+        self.load()
+        with self._lock:
+            entries = self._entries
+            existing = entries.get(sha256)
+            if existing is not None and os.path.exists(os.path.join(self.source_dir, existing["filename"])):
+                return existing
+            os.replace(tmp_path, os.path.join(self.source_dir, filename))
+            # A same-named file with other content is replaced; drop its stale record
+            for digest in [d for d, entry in entries.items() if entry["filename"] == filename]:
+                del entries[digest]
+            entries[sha256] = {"filename": filename, "size": size, "uploaded_at": time.time()}
+            self._save()
+            return None
+
+    def __len__(self) -> int:
+        self.load()
+        with self._lock:
+            return len(self._entries)
+
+
+def _copy_and_hash(src: BinaryIO, dest_dir: str, max_bytes: int, chunk_size: int) -> Tuple[str, str, int]:
+    """Copy `src` to a temp file in `dest_dir` in chunks; return (temp path, sha256, size)."""
+    sha256 = hashlib.sha256()
+    size = 0
+    fd, tmp_path = tempfile.mkstemp(dir=dest_dir, prefix=".upload-", suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as out:
+            for chunk in iter(lambda: src.read(chunk_size), b""):
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadTooLargeError(f"File exceeds the {max_bytes // (1024 * 1024)} MB upload limit")
+                sha256.update(chunk)
+                out.write(chunk)
+            out.flush()
+            os.fsync(out.fileno())
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return tmp_path, sha256.hexdigest(), size
+
+
+def _store(upload: Any, manifest: IngestManifest, max_bytes: int, chunk_size: int) -> Dict[str, Any]:
+    # Never let a client-supplied name escape the source directory
+    filename = os.path.basename(upload.filename or "")
+    if not filename or filename.startswith("."):
+        return {"filename": upload.filename, "status": "rejected", "reason": "invalid_filename", "error": "Invalid filename"}
+
+    os.makedirs(manifest.source_dir, exist_ok=True)
+    os.makedirs(manifest.state_dir, exist_ok=True)
+    try:
+        tmp_path, sha256, size = _copy_and_hash(upload.file, manifest.state_dir, max_bytes, chunk_size)
+    except UploadTooLargeError as e:
+        return {"filename": filename, "status": "rejected", "reason": "too_large", "error": str(e)}
+
+    existing = manifest.claim(sha256, tmp_path, filename, size)
+    if existing is not None:
+        os.unlink(tmp_path)
+        return {
+            "filename": filename,
+            "status": "duplicate",
+            "duplicate_of": existing["filename"],
+            "size": size,
+            "sha256": sha256,
+            "path": os.path.join(manifest.source_dir, existing["filename"]),
+        }
+    return {
+        "filename": filename,
+        "status": "stored",
+        "size": size,
+        "sha256": sha256,
+        "path": os.path.join(manifest.source_dir, filename),
+    }
+
+
+async def save_upload(
+    upload: Any,
+    manifest: IngestManifest,
+    max_bytes: int = UPLOAD_MAX_BYTES,
+    chunk_size: int = UPLOAD_CHUNK_SIZE
+) -> Dict[str, Any]:
+    """
+    Stream an UploadFile into the source directory off the event loop.
+
+    The file is written to a temp file in the state directory while being
+    hashed and only renamed into place once complete, so ingest never sees a
+    partial document.
+    Returns a record with status "stored", "duplicate" or "rejected".
+    """
+    return await asyncio.to_thread(_store, upload, manifest, max_bytes, chunk_size)
+
+
+async def save_uploads(uploads, manifest: IngestManifest, concurrency: int = UPLOAD_CONCURRENCY, **kwargs):
+    """Save several uploads concurrently, at most `concurrency` at a time; results keep the input order."""
+    slots = asyncio.Semaphore(concurrency)
+
+    async def save(upload):
+        async with slots:
+            return await save_upload(upload, manifest, **kwargs)
+
+    return await asyncio.gather(*(save(upload) for upload in uploads))
+
+
+class UploadSizeLimitMiddleware:
+    """
+    ASGI middleware that caps the request body of the upload routes.
+
+    Starlette spools a multipart body to temp files before the handler runs,
+    so the per-file limit alone can't stop a huge request from filling the
+    disk. A declared Content-Length over the limit is answered with 413
+    without reading the body; chunked bodies are counted as they arrive and
+    the request is cut off with 413 once they pass the limit.
+    """
+
+    def __init__(self, app, max_bytes: int = UPLOAD_REQUEST_MAX_BYTES, paths=("/upload-documents",)):
+        self.app = app
+        self.max_bytes = max_bytes
+        self.paths = set(paths)
+
+    async def _reject(self, send):
+        body = json.dumps({"detail": f"Request exceeds the {self.max_bytes // (1024 * 1024)} MB upload limit"}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 413,
+            # The rest of the body is never read, so the connection can't be reused
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"connection", b"close"),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+
+        for name, value in scope.get("headers", []):
+            if name == b"content-length":
+                try:
+                    declared = int(value)
+                except ValueError:
+                    break
+                if declared > self.max_bytes:
+                    await self._reject(send)
+                    return
+                break
+
+        received = 0
+        exceeded = False
+        started = False
+
+        async def limited_receive():
+            nonlocal received, exceeded
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    exceeded = True
+                    raise UploadTooLargeError("Request body exceeds the upload limit")
+            return message
+
+        async def guarded_send(message):
+            nonlocal started
+            # Drop whatever error response the app builds from the aborted body parse
+            if exceeded:
+                return
+            started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except UploadTooLargeError:
+            if not exceeded:
+                raise
+        if exceeded and not started:
+            await self._reject(send)
+
+
+# Example usage: 100 MB upload throughput and event-loop stalls, old copy vs streamed
+if __name__ == "__main__":
+    import shutil
+    from starlette.datastructures import UploadFile
+
+    payload_size = 100 * 1024 * 1024
+    workdir = tempfile.mkdtemp()
+    source_path = os.path.join(workdir, "input.pdf")
+    with open(source_path, "wb") as f:
+        for _ in range(payload_size // UPLOAD_CHUNK_SIZE):
+            f.write(os.urandom(UPLOAD_CHUNK_SIZE))
+
+    async def query_latency(stop: asyncio.Event, samples: list):
+        # Stands in for /query requests that need the loop every 5 ms
+        while not stop.is_set():
+            start = time.perf_counter()
+            await asyncio.sleep(0.005)
+            samples.append(time.perf_counter() - start - 0.005)
+
+    async def run(name, store):
+        samples, stop = [], asyncio.Event()
+        probe = asyncio.create_task(query_latency(stop, samples))
+        await asyncio.sleep(0.05)
+        start = time.perf_counter()
+        results = await store()
+        elapsed = time.perf_counter() - start
+        stop.set()
+        await probe
+        samples.sort()
+        print(
+            f"{name:18s}: {payload_size * 2 / elapsed / 1e6:6.0f} MB/s for 2 x 100 MB, "
+            f"query loop delay p50 {samples[len(samples) // 2] * 1000:.1f} ms, max {samples[-1] * 1000:.1f} ms"
+        )
+        return results
+
+    async def old_copy():
+        # Previous handler: sequential shutil.copyfileobj on the event loop, then getsize
+        out_dir = os.path.join(workdir, "old")
+        os.makedirs(out_dir, exist_ok=True)
+        for i in range(2):
+            with open(source_path, "rb") as src, open(os.path.join(out_dir, f"doc{i}.pdf"), "wb") as dest:
+                shutil.copyfileobj(src, dest)
+            os.path.getsize(os.path.join(out_dir, f"doc{i}.pdf"))
+
+    manifest = IngestManifest(os.path.join(workdir, "new"))
+
+    async def streamed(names=("doc0.pdf", "doc1.pdf")):
+        uploads = [UploadFile(open(source_path, "rb"), filename=name) for name in names]
+        return await save_uploads(uploads, manifest)
+
+    async def main():
+        await run("copyfileobj", old_copy)
+        results = await run("streamed + sha256", streamed)
+        print([(r["filename"], r["status"], r.get("duplicate_of")) for r in results])
+        results = await streamed(("again.pdf",))
+        print(f"re-upload: {results[0]['status']} of {results[0]['duplicate_of']}, manifest entries: {len(manifest)}")
+        small = IngestManifest(os.path.join(workdir, "small"))
+        print((await save_uploads([UploadFile(open(source_path, "rb"), filename="big.pdf")], small, max_bytes=10 * 1024 * 1024))[0])
+
+    asyncio.run(main())
+    shutil.rmtree(workdir)
@@ -0,0 +1,131 @@
+import logging
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Representative questions used to exercise the pipeline before taking traffic
+DEFAULT_WARMUP_QUERIES = [
+    "Who is the mayor of Phoenixville?",
+    "What are the Borough Hall office hours?",
+    "When is trash collection?",
+]
+
+# Stages run in this order; apps register the callables they support
+DEFAULT_WARMUP_STAGES = ["embed", "retrieve", "generate"]
+
+
+def get_warmup_config() -> Dict[str, Any]:
+    """Read the warm-up settings from the environment."""
+    queries = os.environ.get("WARMUP_QUERIES", "")
+    stages = os.environ.get("WARMUP_STAGES", ",".join(DEFAULT_WARMUP_STAGES))
+    return {
+        "enabled": os.environ.get("WARMUP_ENABLED", "true").lower() == "true",
+        "queries": [q.strip() for q in queries.split("|") if q.strip()] or list(DEFAULT_WARMUP_QUERIES),
+        "stages": [s.strip() for s in stages.split(",") if s.strip()],
+        "rounds": max(1, int(os.environ.get("WARMUP_ROUNDS", 1))),
+    }
+
+
+class WarmupState:
+    """Tracks warm-up progress and readiness of a worker."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.status = "pending"
+        self.ready = False
+        self.started_at = None
+        self.finished_at = None
+        self.timings = {}
+        self.errors = {}
+
+    def start(self):
+        with self._lock:
+            self.status = "warming"
+            self.ready = False
+            self.started_at = time.time()
+            self.finished_at = None
+            self.timings = {}
+            self.errors = {}
+
+    def record(self, stage: str, durations: List[float], error: Optional[str] = None):
+        with self._lock:
+            if durations:
+                self.timings[stage] = {
+                    "calls": len(durations),
+                    "first_ms": round(durations[0] * 1000, 2),
+                    "last_ms": round(durations[-1] * 1000, 2),
+                    "total_ms": round(sum(durations) * 1000, 2),
+                }
+            if error:
+                self.errors[stage] = error
+
+    def finish(self, status: str = "ready"):
+        with self._lock:
+            self.status = status
+            self.ready = True
+            self.finished_at = time.time()
+
+    def as_dict(self) -> Dict[str, Any]:
+        """Snapshot suitable for the /status payload."""
+        with self._lock:
+            duration = None
+            if self.started_at and self.finished_at:
+                duration = round((self.finished_at - self.started_at) * 1000, 2)
+            return {
+                "status": self.status,
+                "ready": self.ready,
+                "started_at": self.started_at,
+                "finished_at": self.finished_at,
+                "duration_ms": duration,
+                "stages": dict(self.timings),
+                "errors": dict(self.errors),
+            }
+
+
+def run_warmup(state: WarmupState, stages: Dict[str, Callable[[str], Any]], config: Optional[Dict[str, Any]] = None) -> WarmupState:
+    """
+    Run each registered warm-up stage over the synthetic queries.
+
+    A failing stage is recorded but does not keep the worker out of rotation:
+    the request paths already fall back when a dependency is unavailable.
+    """
+    config = config or get_warmup_config()
+    state.start()
+
+    if not config["enabled"]:
+        logger.info("Warm-up disabled, marking worker ready")
+        state.finish("skipped")
+        return state
+
+    for stage in config["stages"]:
+        fn = stages.get(stage)
+        if fn is None:
+            continue
+
+        durations = []
+        error = None
+        for _ in range(config["rounds"]):
+            for query in config["queries"]:
+                start = time.perf_counter()
+                try:
+                    fn(query)
+                except Exception as e:
+                    error = str(e)
+                    logger.warning(f"Warm-up stage '{stage}' failed: {e}")
+                    break
+                durations.append(time.perf_counter() - start)
+            if error:
+                break
+
+        state.record(stage, durations, error)
+        if durations:
+            logger.info(f"Warm-up stage '{stage}': first call {durations[0] * 1000:.1f} ms, last call {durations[-1] * 1000:.1f} ms")
+
+    state.finish("ready" if not state.errors else "degraded")
+    logger.info(f"Warm-up finished with status '{state.status}'")
+    return state